@@ -0,0 +1,57 @@
+"""
+Compare the matchSeries executable with the in-process numpy backend on the example series in notebooks/.
+
+    python benchmarks/matchseries_backends.py [--stop-level 8] [--extra-stages 2]
+
+Prints the wall-clock time of both backends and the RMS difference of their final deformations in pixels. The
+executable is skipped if `matchSeries` is not found on the PATH.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+from pyiron_experimental import Project
+
+NOTEBOOKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "notebooks")
+
+
+def run(project, backend, stop_level, extra_stages):
+    job = project.create.job.MatchSeries(backend, delete_existing_job=True)
+    job.input["templateNamePattern"] = "testImg_%d_STEM.tif"
+    job.input["stopLevel"] = stop_level
+    job.input["precisionLevel"] = stop_level
+    job.input["refineStopLevel"] = stop_level
+    job.input["numExtraStages"] = extra_stages
+    job.settings.backend = backend
+    job.settings.cache.enabled = False
+    job._add_input_frames_to_restart_files(directory=NOTEBOOKS)
+    start = time.perf_counter()
+    job.run()
+    return time.perf_counter() - start, job.output.deformations.data.compute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stop-level", type=int, default=8)
+    parser.add_argument("--extra-stages", type=int, default=2)
+    args = parser.parse_args()
+    project = Project("matchseries_backends")
+    backends = ["numpy"] + (["executable"] if shutil.which("matchSeries") is not None else [])
+    results = {backend: run(project, backend, args.stop_level, args.extra_stages) for backend in backends}
+    for backend, (seconds, _) in results.items():
+        print(f"{backend:>10}: {seconds:8.2f} s")
+    if len(results) == 2:
+        numpy_deformations, executable_deformations = results["numpy"][1], results["executable"][1]
+        scale = max(numpy_deformations.shape[-2:]) - 1
+        if numpy_deformations.shape == executable_deformations.shape:
+            rms = np.sqrt(np.mean((numpy_deformations - executable_deformations) ** 2)) * scale
+            print(f"RMS difference of the final deformations: {rms:.3f} px")
+    else:
+        print("matchSeries executable not found, only the numpy backend was run.")
+    project.remove(enable=True)
+
+
+if __name__ == "__main__":
+    main()
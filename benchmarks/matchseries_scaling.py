@@ -0,0 +1,166 @@
+"""
+Measure how MatchSeries scales with the frame size and the length of a series on synthetic STEM lattice series.
+
+    python benchmarks/matchseries_scaling.py [--sizes 64 128 256] [--frames 8 32] [--backends numpy executable]
+
+Every series is generated by `synthetic_series()` with known drift, scan distortion and noise and written as a
+multi-frame TIFF. The wall-clock time of staging the frames (`write_input`), of the registration backend and of the
+output collection is printed together with the throughput and the peak memory. Every job runs in a subprocess of its
+own, measured by `measure_command()`, so the peak memory is the largest resident set size of this job process or of
+the executables it started, independent of the other runs. For the registering
+backends the RMS error of the final deformations against the known ones is given in pixels. If `matchSeries` is not
+found on the PATH, a stand-in script which reads every frame and writes zero deformations is timed instead, which
+measures the overhead of the pyiron interface only. No network access is required.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+from pyiron_experimental import Project
+from pyiron_experimental.matchseries_resources import measure_command, synthetic_series
+
+STAND_IN = """
+import bz2, os, sys
+import numpy as np
+import tifffile
+
+par = dict(line.split(None, 1) for line in open("matchSeries.par").read().splitlines() if line.strip())
+n, offset, step = int(par["numTemplates"]), int(par["templateNumOffset"]), int(par["templateNumStep"])
+pattern = par["templateNamePattern"].strip()
+for stage in range(1, int(par["numExtraStages"]) + 2):
+    stage_directory = os.path.join(par["saveDirectory"].strip(), "stage%d" % stage)
+    sys.stderr.write("Created directory %s/\\n" % stage_directory)
+    for i in range(1, n) if stage == 1 else range(n):
+        frame = tifffile.imread(pattern % (offset + i * step))
+        directory = os.path.join(stage_directory, str(i - 1 if stage == 1 else i))
+        os.makedirs(directory)
+        for axis in range(2):
+            with bz2.open(os.path.join(directory, "deformation_00_%d.dat.bz2" % axis), "wb") as f:
+                f.write(b"P9\\n# stand-in\\n%d %d\\n255\\n" % frame.shape[::-1] + np.zeros(frame.shape).tobytes())
+"""
+
+
+def phase_timer(job, seconds):
+    """Accumulate the seconds spent in write_input, run_static and collect_output of a job in `seconds`."""
+    for name in ["write_input", "run_static", "collect_output"]:
+        method = getattr(job, name)
+
+        def timed(*args, _method=method, _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                seconds[_name] += time.perf_counter() - start
+
+        setattr(job, name, timed)
+
+
+def run(project, backend, size, n_frames, extra_stages, stand_in):
+    frames, deformations = synthetic_series(n_frames, shape=(size, size), seed=size + n_frames)
+    stack_file = os.path.join(project.path, f"series_{size}_{n_frames}.tif")
+    tifffile.imwrite(stack_file, frames)
+    level = int(np.ceil(np.log2(size - 1)))
+    job = project.create.job.MatchSeries(f"{backend}_{size}_{n_frames}", delete_existing_job=True)
+    job.input_stack = stack_file
+    job.input["precisionLevel"] = level
+    job.input["stopLevel"] = level
+    job.input["refineStopLevel"] = level
+    job.input["numExtraStages"] = extra_stages
+    job.settings.backend = backend
+    job.settings.cache.enabled = False
+    if stand_in is not None:
+        job.executable = f"{sys.executable} {stand_in} 2> output.log"
+    seconds = {"write_input": 0.0, "run_static": 0.0, "collect_output": 0.0}
+    phase_timer(job, seconds)
+    start = time.perf_counter()
+    job.run()
+    total = time.perf_counter() - start
+    result = {
+        "backend": backend if stand_in is None else "stand-in",
+        "size": size,
+        "frames": n_frames,
+        "staging": seconds["write_input"],
+        "registration": seconds["run_static"] - seconds["collect_output"],
+        "collection": seconds["collect_output"],
+        "frames_per_second": n_frames / total,
+        "peak_memory_mb": None,
+        "rms_error_px": None,
+    }
+    if stand_in is None:
+        final = job.output.deformations.data.compute()
+        expected = deformations[-len(final):]
+        if final.shape == expected.shape:
+            result["rms_error_px"] = float(np.sqrt(np.mean((final - expected) ** 2)) * (size - 1))
+    return result
+
+
+def measured_run(backend, size, n_frames, extra_stages, stand_in):
+    """Call `run()` in a subprocess and add the peak memory of the subprocess and its children to the result."""
+    with tempfile.TemporaryDirectory() as directory:
+        result_file = os.path.join(directory, "result.json")
+        command = [
+            sys.executable, os.path.abspath(__file__), "--single", backend, str(size), str(n_frames),
+            "--extra-stages", str(extra_stages), "--result", result_file,
+        ]
+        if stand_in is not None:
+            command += ["--stand-in", stand_in]
+        _, peak = measure_command(command, shell=False)
+        with open(result_file) as f:
+            result = json.load(f)
+    if peak is not None:
+        result["peak_memory_mb"] = peak / 2 ** 20
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--frames", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--backends", nargs="+", default=["numpy", "executable"])
+    parser.add_argument("--extra-stages", type=int, default=1)
+    parser.add_argument("--json", help="Write the results to this file.")
+    # a single run in the subprocess started by measured_run()
+    parser.add_argument("--single", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument("--stand-in", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    project = Project("matchseries_scaling")
+    if args.single is not None:
+        backend, size, n_frames = args.single[0], int(args.single[1]), int(args.single[2])
+        with open(args.result, "w") as f:
+            json.dump(run(project, backend, size, n_frames, args.extra_stages, args.stand_in), f)
+        return
+    stand_in = None
+    if "executable" in args.backends and shutil.which("matchSeries") is None:
+        stand_in = os.path.join(project.path, "matchseries_stand_in.py")
+        with open(stand_in, "w") as f:
+            f.write(STAND_IN)
+        print("matchSeries executable not found, timing a stand-in which writes zero deformations.")
+    results = []
+    print(f"{'backend':>10} {'size':>5} {'frames':>6} {'staging':>8} {'backend':>8} {'collect':>8} "
+          f"{'frames/s':>9} {'peak MB':>8} {'RMS px':>7}")
+    for backend in args.backends:
+        for size in args.sizes:
+            for n_frames in args.frames:
+                r = measured_run(
+                    backend, size, n_frames, args.extra_stages, stand_in if backend == "executable" else None
+                )
+                results.append(r)
+                error = "-" if r["rms_error_px"] is None else f"{r['rms_error_px']:.3f}"
+                peak = "-" if r["peak_memory_mb"] is None else f"{r['peak_memory_mb']:.1f}"
+                print(f"{r['backend']:>10} {size:>5} {n_frames:>6} {r['staging']:8.2f} {r['registration']:8.2f} "
+                      f"{r['collection']:8.2f} {r['frames_per_second']:9.2f} {peak:>8} {error:>7}")
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    project.remove(enable=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from pyiron_base import Project, JOB_CLASS_DICT
 JOB_CLASS_DICT["pySTEMTEMMETAJob"] = "pyiron_experimental.pystemjob"
 JOB_CLASS_DICT["TEMMETAJob"] = "pyiron_experimental.temmetajob"
 JOB_CLASS_DICT["MatchSeries"] = "pyiron_experimental.matchseries"
+JOB_CLASS_DICT["MatchSeriesSweep"] = "pyiron_experimental.matchseries"
 JOB_CLASS_DICT["HSLineProfiles"] = "pyiron_experimental.tem_analysis"
 
 from ._version import get_versions
@@ -1,30 +1,1785 @@
+import bz2
+import contextlib
+import glob
+import hashlib
+import itertools
+import json
 import os
-import scanf
-from pyiron_base import GenericJob, GenericParameters
+import platform
+import queue
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import dask.array as da
+import h5py
+import numpy as np
+import pandas as pd
+import tifffile
+import hyperspy.api as hs
+from dask.base import tokenize
+from scipy import ndimage
+from pyiron_base import GenericJob, GenericParameters, DataContainer
+from pyiron_base.jobs.job.runfunction import (
+    execute_subprocess,
+    handle_failed_job,
+    handle_finished_job,
+    write_input_files_from_input_dict,
+)
+from pyiron_experimental.matchseries_log import MatchSeriesLogParser, MatchSeriesLogFollower
+from pyiron_experimental.matchseries_resources import (
+    fit_linear,
+    grid_pixels,
+    measure,
+    measure_command,
+    n_registrations,
+    registration_work,
+    synthetic_pair,
+)
+from pyiron_experimental.matchseries_numpy import (
+    register,
+    normalize_image,
+    frame_outliers,
+    median_image,
+    mean_image,
+    phase_correlation_shifts,
+    shift_image,
+    resize,
+    preprocess_images,
+    frame_statistics,
+    registration_metrics,
+    level_shape,
+    select_keyframes,
+)
+
+_LAZY_CHUNK_BYTES = 64 * 2 ** 20
+# output groups describing a single run, which are not shared through the cache
+_RUN_GROUPS = ["timings", "execution"]
+_THREAD_VARIABLES = [
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS",
+]
+_PREPROCESSING_KEYS = [
+    "cropInput", "cropStartX", "cropStartY", "precisionLevel", "resizeInput", "preSmoothSigma",
+    "enhanceContrastSaturationPercentage", "dontNormalizeInputImages", "normalizeMinToZero",
+]
+# parameters which do not change the cost of a registration per grid pixel
+_CALIBRATION_KEYS = [
+    "templateNamePattern", "templateNumOffset", "templateNumStep", "numTemplates", "numExtraStages", "skipStage1",
+    "cropInput", "cropStartX", "cropStartY", "resizeInput", "precisionLevel", "startLevel", "stopLevel",
+    "refineStartLevel", "refineStopLevel", "saveDirectory",
+]
 
 
 class MatchSeries(GenericJob):
+    """
+    Non-rigid registration of an image series with the matchSeries executable or an in-process NumPy/SciPy backend.
+
+    Attributes:
+        input (MatchSeriesInput): Parameters written to the matchSeries.par file.
+        settings (DataContainer): Options of the pyiron interface, which are not passed to the executable:
+            backend (str): 'executable' (default) to run matchSeries or 'numpy' to register the series in-process
+                with `matchseries_numpy.register()`, which uses lambda, startLevel, stopLevel, maxGDIterations,
+                stopEpsilon, numExtraStages, extraStagesLambdaFactor, useMedianAsNewTarget and skipStage1.
+            parallel.chunks (int): Number of overlapping sub-series registered in parallel, up to `server.cores`
+                processes at a time (default: 1). Only used by the executable backend.
+            parallel.overlap (int): Number of frames shared by neighbouring sub-series (default: 2).
+            parallel.threads (int): OpenMP/BLAS threads per executable, 0 to divide `server.cores` among the
+                processes running at a time (default: 0). At most `server.cores // threads` processes run at a time.
+            parallel.pin (bool): Pin every running executable to its own `threads` cores with taskset, where it is
+                available (default: False). The cores used by every process are stored in output/execution.
+            tiles.level (int): Register tiles of 2**level + 1 pixels instead of whole frames, 0 to disable (default:
+                0). The tile series are registered by independent executables in parallel, like chunks, and their
+                deformations are blended in the overlaps, see `_stitch_tiles()`. The memory of the registration then
+                depends on the tile size only. Only used by the executable backend.
+            tiles.overlap (int): Minimum number of pixels shared by neighbouring tiles (default: 32).
+            keyframes.step (int): Register only every step-th frame fully, 1 to register all frames (default: 1). The
+                frames between two keyframes start from the deformations of the keyframes interpolated in time, or
+                from their deformations of the previous stage, and are refined on the finest grid in-process with
+                `matchseries_numpy.register()`. The indices of the keyframes are stored in output/keyframes. Cannot
+                be combined with chunks or tiles.
+            keyframes.threshold (float): Also start a new keyframe once the RMS difference of the normalized,
+                downsampled frame to the last keyframe exceeds this value, 0 to disable (default: 0.0), see
+                `select_keyframes()`.
+            keyframes.refine_iterations (int): Gradient descent steps refining the frames between keyframes, 0 to
+                store the interpolated deformations (default: 10).
+            reject.enabled (bool): Scan the input frames before the registration and exclude blank frames, flashes and
+                frames with scan glitches from the series, see `matchseries_numpy.frame_outliers()` (default: False).
+                The rejected frames and the reasons are stored in output/rejected_frames, the remaining frames are
+                registered as a contiguous series.
+            reject.sigma (float): Threshold of the scan in robust standard deviations (default: 5.0).
+            prealign (bool): Estimate the rigid shift of every frame relative to the first one by FFT phase
+                correlation and register the translated frames prealigned_<i>.tif instead, such that startLevel can
+                be increased. The shifts are stored in output/prealign_shifts and added to the deformations
+                (default: False).
+            preprocess (bool): Crop, resize, smooth and normalize the frames in Python according to cropInput,
+                resizeInput, preSmoothSigma, enhanceContrastSaturationPercentage, dontNormalizeInputImages and
+                normalizeMinToZero and register the reduced frames preprocessed_<i>.tif instead; the executable does
+                not repeat these steps (default: False).
+            staging (str): 'copy' (default) to copy the input frames to the working directory or 'link' to hardlink
+                them, falling back to symbolic links and copies. The method used is stored in input/staging_method.
+            cache.enabled (bool): Reuse the output of a previous job of the project with identical input frames and
+                parameters instead of running matchSeries (default: False). The results are kept in the directory
+                `.matchseries_cache` of the project, which is not removed with the jobs, see `MatchSeriesCache.clear()`.
+            cache.max_size (int): Size of the project cache in bytes, least recently used results are evicted
+                (default: 10 GB).
+            storage.deformations (str): 'float64' (default), 'float16' or 'int16' to store the deformations compactly,
+                they are decoded when read.
+            storage.max_error (float): Maximum displacement error in pixels of the compactly stored deformations,
+                frames which cannot be encoded within it are stored as float64 (default: 0.01).
+            storage.deformed_templates (bool): Store the input frames warped by their deformations in Python, see
+                `_deformed_template()`, in output/stage<n>/deformed_templates (default: False). The deformed templates
+                written by the executable are not read.
+        input_stack (numpy.ndarray/dask.array.Array/str): Image series (frame, height, width) which is written to the
+            working directory as input frames, alternatively to frames provided as files. A path is read as stack
+            file, see `set_input_file()`.
+        output (MatchSeriesOutput): Results collected from the saveDirectory.
+        progress (dict): Current stage, frame and level, the number of completed registrations and the estimated
+            remaining time of a running job, parsed from output.log.
+    """
+
     def __init__(self, project, job_name):
         super().__init__(project, job_name) 
         self.input = MatchSeriesInput()
+        self.settings = DataContainer(table_name="settings")
+        self.settings.backend = "executable"
+        self.settings.prealign = False
+        self.settings.preprocess = False
+        self.settings.create_group("parallel")
+        self.settings.parallel.chunks = 1
+        self.settings.parallel.overlap = 2
+        self.settings.parallel.threads = 0
+        self.settings.parallel.pin = False
+        self.settings.create_group("tiles")
+        self.settings.tiles.level = 0
+        self.settings.tiles.overlap = 32
+        self.settings.create_group("keyframes")
+        self.settings.keyframes.step = 1
+        self.settings.keyframes.threshold = 0.0
+        self.settings.keyframes.refine_iterations = 10
+        self.settings.create_group("reject")
+        self.settings.reject.enabled = False
+        self.settings.reject.sigma = 5.0
+        self.settings.staging = "copy"
+        self.settings.create_group("cache")
+        self.settings.cache.enabled = False
+        self.settings.cache.max_size = 10 * 2 ** 30
+        self.settings.create_group("storage")
+        self.settings.storage.deformations = "float64"
+        self.settings.storage.max_error = 0.01
+        self.settings.storage.deformed_templates = False
         self.executable = "matchSeries 2> output.log"
+        self._input_stack = None
+        self._input_file = None
+        self._preview = None
+        self._rejected_frames = None
+        self._cache_key = None
+        self._cache_hit = False
+        self._log_follower = None
+        self._execution = None
+        self._prealign_shifts = None
+        self._template_scratch = None
+        self._output = MatchSeriesOutput(self)
+
+    @property
+    def output(self):
+        return self._output
+
+    @property
+    def input_stack(self):
+        return self._input_stack
+
+    @property
+    def progress(self):
+        """dict: Progress written by the running job, None if the job has not been started."""
+        progress_file = os.path.join(self.working_directory, "progress.json")
+        if not os.path.exists(progress_file):
+            return None
+        with open(progress_file, "r") as f:
+            return json.load(f)
+
+    @input_stack.setter
+    def input_stack(self, stack):
+        if not self.status.initialized:
+            raise RuntimeError("The input stack cannot be changed for a started job.")
+        if isinstance(stack, str):
+            self.set_input_file(stack)
+            return
+        stack = _stack_data(stack)
+        self._set_input_frames(len(stack))
+        self._input_stack = stack
+        self._input_file = None
+
+    def set_input_file(self, file_name, h5_path=None, frame_axis=None):
+        """
+        Register the frames of a multi-frame TIFF or an EMD/HDF5 file, alternatively to one file per frame.
+
+        The frames are extracted to the working directory in a single sequential pass when the input is written,
+        memory mapping uncompressed data, and removed again once the output is collected.
+
+        Args:
+            file_name (str): Path of the stack file (.tif/.tiff, .emd/.h5/.hdf5).
+            h5_path (str): Path of the dataset in an EMD/HDF5 file, found automatically if the file contains a single
+                3D dataset.
+            frame_axis (int): Axis of the frames in the dataset, default: 2 for Velox EMD files, else 0.
+        """
+        if not self.status.initialized:
+            raise RuntimeError("The input stack cannot be changed for a started job.")
+        input_file = {"file_name": os.path.abspath(file_name), "h5_path": h5_path, "frame_axis": frame_axis}
+        with _open_stack_file(**input_file) as stack:
+            if len(stack.shape) != 3:
+                raise ValueError(f"{file_name} has to contain frames (frame, height, width), found {stack.shape}.")
+            self._set_input_frames(stack.shape[0])
+        self._input_file = input_file
+        self._input_stack = None
+
+    def _set_input_frames(self, n_frames):
+        if n_frames < 2:
+            raise ValueError("The input stack has to contain at least two frames.")
+        self.input["templateNamePattern"] = "frame_%0" + str(len(str(n_frames - 1))) + "d.tif"
+        self.input["templateNumOffset"] = 0
+        self.input["templateNumStep"] = 1
+        self.input["numTemplates"] = n_frames
+
+    def validate_ready_to_run(self):
+        if self._input_stack is None and self._input_file is None:
+            self._add_input_frames_to_restart_files()
+
+    def _executable_activate_mpi(self):
+        # matchSeries has no MPI mode, server.cores is split into the slots of the processes by `_core_slots()`
+        pass
+
+    def _add_input_frames_to_restart_files(self, directory="."):
+        """
+        Add the input frames selected by templateNumOffset/templateNumStep/numTemplates to the files copied to the
+        working directory.
+
+        Only the expected file names are checked, so the cost does not depend on the size of the directory and frames
+        outside the configured range are ignored.
+
+        Args:
+            directory (str): Directory containing the frames (default: current directory).
+
+        Raises:
+            ValueError: if frames are missing.
+        """
+        staged = set(os.path.basename(f) for f in self.restart_file_list)
+        found = _find_files(
+            file_names=[file_name for file_name in self.frame_file_names if file_name not in staged],
+            directory=directory,
+        )
+        self._restart_file_list.extend(found.values())
 
-    def _copy_restart_files(self):
-        # copy images to working directory - bad shortcut ! 
-        for file in os.listdir('.'):
-            if scanf.scanf(self.input["templateNamePattern"], s=file, collapseWhitespace=True):
-                self._restart_file_list.append(file)
-        super()._copy_restart_files()
-        
     def write_input(self): 
-        self.input.write_file( 
+        if self.settings.staging == "copy":
+            super().write_input()
+        elif self.settings.staging == "link":
+            input_dict = self.get_input_parameter_dict()
+            files_to_link = input_dict["files_to_copy"]
+            input_dict["files_to_copy"] = {}
+            write_input_files_from_input_dict(input_dict=input_dict, working_directory=self.working_directory)
+            methods = _link_files(files=files_to_link, working_directory=self.working_directory)
+            with self.project_hdf5.open("input") as h5in:
+                h5in["staging_method"] = ", ".join(methods)
+        else:
+            raise ValueError(f"Unknown staging method '{self.settings.staging}', use 'copy' or 'link'.")
+        if self._input_stack is not None:
+            _write_frames(
+                stack=self._input_stack,
+                file_name_pattern=os.path.join(self.working_directory, self.input["templateNamePattern"]),
+            )
+        elif self._input_file is not None:
+            with _open_stack_file(**self._input_file) as stack:
+                _write_frames(
+                    stack=stack,
+                    file_name_pattern=os.path.join(self.working_directory, self.input["templateNamePattern"]),
+                )
+        if self.settings.reject.enabled:
+            self._reject_frames()
+        if self._rejected_frames is not None and not (self.settings.preprocess or self.settings.prealign):
+            _link_files(
+                files={
+                    self.accepted_file_pattern % i: os.path.join(self.working_directory, file_name)
+                    for i, file_name in enumerate(self.frame_file_names)
+                },
+                working_directory=self.working_directory,
+            )
+        if self.settings.preprocess and not self._is_preprocessed():
+            self._preprocess()
+        if self.settings.prealign and not os.path.exists(os.path.join(self.working_directory, "prealign_shifts.txt")):
+            self._prealign()
+        par_input = self._registration_input()
+        par_input.write_file(
             file_name="matchSeries.par",
             cwd=self.working_directory
         )
+        chunk_ranges = self.chunk_ranges
+        if len(chunk_ranges) > 1:
+            offset, step = int(par_input["templateNumOffset"]), int(par_input["templateNumStep"])
+            for k, (start, stop) in enumerate(chunk_ranges):
+                chunk_input = self._registration_input()
+                chunk_input["templateNamePattern"] = os.path.join("..", par_input["templateNamePattern"])
+                chunk_input["templateNumOffset"] = offset + start * step
+                chunk_input["numTemplates"] = stop - start
+                os.makedirs(os.path.join(self.working_directory, _chunk_name(k)), exist_ok=True)
+                chunk_input.write_file(
+                    file_name="matchSeries.par",
+                    cwd=os.path.join(self.working_directory, _chunk_name(k))
+                )
+        if self._tiled:
+            self._write_tiles()
+        if self._keyframed:
+            self._write_keyframes()
+
+    @property
+    def _tiled(self):
+        return self.settings.backend == "executable" and int(self.settings.tiles.level) > 0
+
+    def _tile_layout(self):
+        """
+        Tiles of the frames read by the executable.
+
+        Returns:
+            tuple, int, list: shape of the frames, size of the tiles, (row, column) of the first pixel of every tile
+        """
+        par_input = self._registration_input()
+        file_name = os.path.join(
+            self.working_directory, par_input["templateNamePattern"] % int(par_input["templateNumOffset"])
+        )
+        shape = tuple(hs.load(file_name, lazy=True).data.shape[-2:])
+        size = 2 ** int(self.settings.tiles.level) + 1
+        overlap = int(self.settings.tiles.overlap)
+        starts = itertools.product(_tile_starts(shape[0], size, overlap), _tile_starts(shape[1], size, overlap))
+        return shape, size, list(starts)
+
+    def _write_tiles(self):
+        """
+        Cut the frames read by the executable into the tiles tile_<k>/tile_<i>.tif and write the input of every tile.
+
+        Every frame is read once by one of `server.cores` threads, which writes all of its tiles.
+        """
+        if len(self.chunk_ranges) > 1:
+            raise ValueError("Tiles cannot be combined with parallel chunks.")
+        if not self.settings.preprocess and (int(self.input["cropInput"]) == 1 or int(self.input["resizeInput"]) == 1):
+            raise ValueError("Tiles of cropped or resized frames require settings.preprocess.")
+        par_input = self._registration_input()
+        shape, size, starts = self._tile_layout()
+        level = int(self.settings.tiles.level)
+        n_frames = len(self.frame_numbers)
+        pattern = "tile_%0" + str(len(str(n_frames - 1))) + "d.tif"
+        offset, step = int(par_input["templateNumOffset"]), int(par_input["templateNumStep"])
+        for k in range(len(starts)):
+            os.makedirs(os.path.join(self.working_directory, _tile_name(k)), exist_ok=True)
+
+        def cut(i):
+            image = hs.load(
+                os.path.join(self.working_directory, par_input["templateNamePattern"] % (offset + i * step))
+            ).data
+            for k, (y, x) in enumerate(starts):
+                tifffile.imwrite(
+                    os.path.join(self.working_directory, _tile_name(k), pattern % i), image[y:y + size, x:x + size]
+                )
+
+        with ThreadPoolExecutor(max_workers=max(1, int(self.server.cores))) as executor:
+            list(executor.map(cut, range(n_frames)))
+        tile_input = self._registration_input()
+        tile_input["templateNamePattern"] = pattern
+        tile_input["templateNumOffset"] = 0
+        tile_input["templateNumStep"] = 1
+        tile_input["cropInput"] = 0
+        tile_input["resizeInput"] = 0
+        tile_input["precisionLevel"] = level
+        for key in ["startLevel", "stopLevel", "refineStartLevel", "refineStopLevel"]:
+            tile_input[key] = min(int(tile_input[key]), level)
+        for k in range(len(starts)):
+            tile_input.write_file(file_name="matchSeries.par", cwd=os.path.join(self.working_directory, _tile_name(k)))
+
+    def _reject_frames(self):
+        """
+        Scan all input frames with `frame_outliers()` and exclude the outliers from `frame_numbers`.
+
+        The frames are read in blocks by `server.cores` threads. The rejected frames, the reasons and their statistics
+        are kept in `_rejected_frames` and stored in the input of the job.
+
+        Raises:
+            ValueError: if less than two frames are left.
+        """
+        self._rejected_frames = None
+        frames = self.frame_numbers
+        scan = frame_outliers(
+            _FrameFiles([os.path.join(self.working_directory, file_name) for file_name in self.frame_file_names]),
+            sigma=float(self.settings.reject.sigma),
+            max_workers=max(1, int(self.server.cores)),
+        )
+        rejected = [i for i, reason in enumerate(scan["reason"]) if reason != ""]
+        if len(frames) - len(rejected) < 2:
+            raise ValueError(f"{len(rejected)} of {len(frames)} frames were rejected, at least two have to remain.")
+        self._rejected_frames = {
+            "frame": [frames[i] for i in rejected],
+            "reason": [scan["reason"][i] for i in rejected],
+            "mean": [float(scan["mean"][i]) for i in rejected],
+            "std": [float(scan["std"][i]) for i in rejected],
+            "correlation": [float(scan["correlation"][i]) for i in rejected],
+        }
+        with self.project_hdf5.open("input") as h5in:
+            h5in["rejected_frames"] = json.dumps(self._rejected_frames)
+
+    @property
+    def accepted_file_pattern(self):
+        """str: File name pattern of the frames left after the rejection, formatted with the index of the frame."""
+        return "accepted_%0" + str(len(str(len(self.frame_numbers) - 1))) + "d.tif"
+
+    @property
+    def _keyframed(self):
+        return int(self.settings.keyframes.step) > 1
+
+    @property
+    def keyframe_file_pattern(self):
+        """str: File name pattern of the keyframes read by the executable, formatted with the index of the keyframe."""
+        return "keyframe_%0" + str(len(str(len(self.frame_numbers) - 1))) + "d.tif"
+
+    def _write_keyframes(self):
+        """
+        Select the keyframes, write their indices to keyframes.txt and, for the executable, link the frames it reads
+        as keyframe_<k>.tif and let it register these only.
+        """
+        if len(self.chunk_ranges) > 1 or self._tiled:
+            raise ValueError("Keyframes cannot be combined with parallel chunks or tiles.")
+        self._load_prealign_shifts()
+        keyframes = self._select_keyframes()
+        np.savetxt(os.path.join(self.working_directory, "keyframes.txt"), keyframes, fmt="%d")
+        if self.settings.backend != "executable":
+            return
+        par_input = self._registration_input()
+        offset, step = int(par_input["templateNumOffset"]), int(par_input["templateNumStep"])
+        _link_files(
+            files={
+                self.keyframe_file_pattern % k: os.path.join(
+                    self.working_directory, par_input["templateNamePattern"] % (offset + i * step)
+                )
+                for k, i in enumerate(keyframes)
+            },
+            working_directory=self.working_directory,
+        )
+        par_input["templateNamePattern"] = self.keyframe_file_pattern
+        par_input["templateNumOffset"] = 0
+        par_input["templateNumStep"] = 1
+        par_input["numTemplates"] = len(keyframes)
+        par_input.write_file(file_name="matchSeries.par", cwd=self.working_directory)
+
+    def _load_keyframes(self):
+        """list: Indices of the keyframes written by `_write_keyframes()`, None if every frame is registered fully."""
+        file_name = os.path.join(self.working_directory, "keyframes.txt")
+        if not self._keyframed or not os.path.exists(file_name):
+            return None
+        return [int(i) for i in np.loadtxt(file_name, dtype=int, ndmin=1)]
+
+    @property
+    def prealigned_file_pattern(self):
+        """str: File name pattern of the prealigned frames, formatted with the index of the frame."""
+        return "prealigned_%0" + str(len(str(len(self.frame_numbers) - 1))) + "d.tif"
+
+    @property
+    def preprocessed_file_pattern(self):
+        """str: File name pattern of the preprocessed frames, formatted with the index of the frame."""
+        return "preprocessed_%0" + str(len(str(len(self.frame_numbers) - 1))) + "d.tif"
+
+    @property
+    def _source_file_names(self):
+        """list: Frames read by the prealignment, the preprocessed frames or the input frames."""
+        if self.settings.preprocess:
+            return [self.preprocessed_file_pattern % i for i in range(len(self.frame_numbers))]
+        return self.frame_file_names
+
+    def _registration_input(self):
+        """
+        Copy of the input to be passed to the executable, which reads the prealigned or preprocessed frames if
+        requested. The preprocessing steps done in Python are disabled.
+        """
+        par_input = MatchSeriesInput()
+        for key in self.input.keys():
+            par_input[key] = self.input[key]
+        if self._rejected_frames is not None:
+            par_input["templateNamePattern"] = self.accepted_file_pattern
+            par_input["templateNumOffset"] = 0
+            par_input["templateNumStep"] = 1
+            par_input["numTemplates"] = len(self.frame_numbers)
+        if self.settings.preprocess:
+            par_input["templateNamePattern"] = self.preprocessed_file_pattern
+            par_input["cropInput"] = 0
+            par_input["resizeInput"] = 0
+            par_input["preSmoothSigma"] = 0
+            par_input["enhanceContrastSaturationPercentage"] = 0
+            par_input["dontNormalizeInputImages"] = 1
+        if self.settings.prealign:
+            par_input["templateNamePattern"] = self.prealigned_file_pattern
+        if self.settings.preprocess or self.settings.prealign:
+            par_input["templateNumOffset"] = 0
+            par_input["templateNumStep"] = 1
+        return par_input
+
+    def _preprocessing_parameters(self):
+        """Arguments of `preprocess_images()` taken from the input."""
+        size = 2 ** int(self.input["precisionLevel"]) + 1
+        crop = None
+        if int(self.input["cropInput"]) == 1:
+            crop = [int(self.input["cropStartY"]), int(self.input["cropStartX"]), size, size]
+        return {
+            "crop": crop,
+            "shape": [size, size] if int(self.input["resizeInput"]) == 1 else None,
+            "sigma": float(self.input["preSmoothSigma"]),
+            "saturation": float(self.input["enhanceContrastSaturationPercentage"]),
+            "normalize": int(self.input["dontNormalizeInputImages"]) == 0,
+            "min_to_zero": int(self.input["normalizeMinToZero"]) == 1,
+        }
+
+    def _is_preprocessed(self):
+        """Whether the working directory contains frames preprocessed with the current parameters."""
+        file_name = os.path.join(self.working_directory, "preprocessing.json")
+        if not os.path.exists(file_name):
+            return False
+        with open(file_name, "r") as f:
+            return json.load(f) == self._preprocessing_parameters()
+
+    def _preprocess(self):
+        """
+        Crop, resize, smooth and normalize the frames with `preprocess_images()` and write preprocessed_<i>.tif.
+
+        The frames are processed in blocks of about 64 MB by `server.cores` threads, each reading, processing and
+        writing a whole block. The parameters are written to preprocessing.json.
+        """
+        frames = self.frame_numbers
+        parameters = self._preprocessing_parameters()
+        pattern = os.path.join(self.working_directory, self.preprocessed_file_pattern)
+
+        def read(frame):
+            return hs.load(os.path.join(self.working_directory, self.input["templateNamePattern"] % frame)).data
+
+        def process(start):
+            block = preprocess_images(
+                np.array([read(frame) for frame in frames[start:start + block_size]], dtype=float), **parameters
+            )
+            for i, image in enumerate(block):
+                tifffile.imwrite(pattern % (start + i), image.astype(np.float32))
+
+        block_size = max(1, _LAZY_CHUNK_BYTES // read(frames[0]).astype(float).nbytes)
+        with ThreadPoolExecutor(max_workers=max(1, int(self.server.cores))) as executor:
+            list(executor.map(process, range(0, len(frames), block_size)))
+        with open(os.path.join(self.working_directory, "preprocessing.json"), "w") as f:
+            json.dump(parameters, f)
+
+    def _prealign(self):
+        """
+        Estimate the rigid shifts of the frames relative to the first one and write the translated frames.
+
+        The frames are processed in blocks of about 64 MB; the FFTs of a block are batched and use `server.cores`
+        threads, which also read and write the frames. The shifts in pixels are written to prealign_shifts.txt.
+        """
+        file_names = self._source_file_names
+        cores = max(1, int(self.server.cores))
+
+        def read(file_name):
+            return hs.load(os.path.join(self.working_directory, file_name)).data
+
+        reference = read(file_names[0]).astype(float)
+        block_size = max(1, _LAZY_CHUNK_BYTES // reference.nbytes)
+        shifts = []
+        with ThreadPoolExecutor(max_workers=cores) as executor:
+            for start in range(0, len(file_names), block_size):
+                block = np.array(list(executor.map(read, file_names[start:start + block_size])), dtype=float)
+                block_shifts = phase_correlation_shifts(block, reference, workers=cores)
+                aligned = np.array(list(executor.map(shift_image, block, block_shifts)), dtype=np.float32)
+                _write_frames(
+                    stack=aligned,
+                    file_name_pattern=os.path.join(self.working_directory, self.prealigned_file_pattern),
+                    frame_numbers=list(range(start, start + len(block))),
+                    max_workers=cores,
+                )
+                shifts.append(block_shifts)
+        np.savetxt(os.path.join(self.working_directory, "prealign_shifts.txt"), np.concatenate(shifts))
+
+    def _load_prealign_shifts(self):
+        """
+        Read the shifts of the prealignment as (x, y) translations in units of the image width per frame number.
+
+        Returns:
+            numpy.ndarray: shifts (row, column) in pixels, None if the frames were not prealigned
+        """
+        file_name = os.path.join(self.working_directory, "prealign_shifts.txt")
+        if not self.settings.prealign or not os.path.exists(file_name):
+            self._prealign_shifts = None
+            return None
+        shifts = np.loadtxt(file_name, ndmin=2)
+        # the width of the image seen by the executable, i.e. after cropping
+        if self.settings.preprocess:
+            size = max(hs.load(os.path.join(self.working_directory, self._source_file_names[0])).data.shape)
+        else:
+            size = max(self._read_frame(self.frame_numbers[0]).shape)
+        self._prealign_shifts = dict(zip(self.frame_numbers, shifts[:, ::-1] / (size - 1)))
+        return shifts
+
+    @property
+    def frame_numbers(self):
+        """list: Numbers of the frames selected by templateNumOffset/templateNumStep/numTemplates, not rejected."""
+        if self._rejected_frames is None:
+            return self._input_frame_numbers
+        rejected = set(self._rejected_frames["frame"])
+        return [frame for frame in self._input_frame_numbers if frame not in rejected]
+
+    @property
+    def _input_frame_numbers(self):
+        """list: Numbers of all frames selected by templateNumOffset/templateNumStep/numTemplates."""
+        offset = int(self.input["templateNumOffset"])
+        step = int(self.input["templateNumStep"])
+        return [offset + i * step for i in range(int(self.input["numTemplates"]))]
+
+    @property
+    def frame_file_names(self):
+        """list: File names of the input frames."""
+        pattern = self.input["templateNamePattern"]
+        return [pattern % frame for frame in self.frame_numbers]
+
+    @property
+    def chunk_ranges(self):
+        """list: (start, stop) indices into `frame_numbers` of the sub-series registered in parallel."""
+        return _chunk_ranges(
+            n_frames=len(self.frame_numbers),
+            n_chunks=int(self.settings.parallel.chunks),
+            overlap=int(self.settings.parallel.overlap),
+        )
+
+    @property
+    def cache(self):
+        """MatchSeriesCache: The result cache of the project."""
+        return MatchSeriesCache(
+            directory=os.path.join(self.project.path, ".matchseries_cache"),
+            max_size=int(self.settings.cache.max_size),
+        )
+
+    def _get_cache_key(self):
+        """
+        Hash of the staged input frames, the registration parameters, the chunks, the executable and the preview the
+        numpy backend starts from.
+        """
+        parameters = {
+            key: self.input[key] for key in self.input.keys()
+            if key not in ["templateNamePattern", "templateNumOffset", "templateNumStep", "saveDirectory"]
+        }
+        return self.cache.get_key(
+            file_names=[os.path.join(self.working_directory, file_name) for file_name in self.frame_file_names],
+            parameters=parameters,
+            extra=[
+                self.settings.backend, self.settings.prealign, self.settings.preprocess, self.chunk_ranges,
+                str(self.executable), self.settings.storage.deformations, float(self.settings.storage.max_error),
+                bool(self.settings.storage.deformed_templates),
+                int(self.settings.tiles.level) if self._tiled else 0, int(self.settings.tiles.overlap),
+                self._load_keyframes(), int(self.settings.keyframes.refine_iterations), self._warm_start_key(),
+            ],
+        )
+
+    def run_static(self):
+        """
+        Run the matchSeries executable; a chunked series runs one process per chunk, as many at a time as the
+        `server.cores` split into settings.parallel.threads allow.
+
+        If the cache is enabled and contains the output for identical frames and parameters, the executable is not
+        run at all. The numpy backend registers the series in this process instead.
+        """
+        if self.settings.backend not in ["executable", "numpy"]:
+            raise ValueError(f"Unknown backend '{self.settings.backend}', use 'executable' or 'numpy'.")
+        if self.settings.cache.enabled:
+            self._cache_key = self._get_cache_key()
+            self._cache_hit = self.cache.contains(self._cache_key)
+            if self._cache_hit:
+                self.status.running = True
+                handle_finished_job(job=self, job_crashed=False, collect_output=True)
+                return
+        if self.settings.backend == "numpy":
+            self.status.running = True
+            self._register_in_process()
+            handle_finished_job(job=self, job_crashed=False, collect_output=True)
+            return
+        self._start_log_follower()
+        try:
+            self._run_chunks()
+        finally:
+            self._stop_log_follower()
+
+    def _run_chunks(self):
+        """Run the executable once, or once per chunk in parallel, on the cores assigned by `_core_slots()`."""
+        self.status.running = True
+        calls = self._subprocess_calls()
+        self._finish_subprocesses(_execute_in_parallel(calls=calls, slots=self._core_slots(len(calls))))
+
+    def _core_slots(self, n_processes):
+        """
+        Split `server.cores` into slots for the executables running at a time.
+
+        Every slot runs one process at a time with settings.parallel.threads threads, or with an equal share of the
+        cores if it is 0. With settings.parallel.pin the slots get disjoint cores of the CPU affinity of this process.
+
+        Returns:
+            list: dicts with the number of threads and the cores (None without pinning) of every slot
+        """
+        cores = max(1, int(self.server.cores))
+        threads = int(self.settings.parallel.threads)
+        if threads <= 0:
+            n_slots = max(1, min(n_processes, cores))
+            threads = max(1, cores // n_slots)
+        else:
+            n_slots = max(1, min(n_processes, cores // threads))
+        available = None
+        if self.settings.parallel.pin and shutil.which("taskset") is not None:
+            available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+        slots = []
+        for k in range(n_slots):
+            pinned = None
+            if available is not None:
+                pinned = [available[(k * threads + t) % len(available)] for t in range(threads)]
+            slots.append({"threads": threads, "cores": pinned})
+        return slots
+
+    @property
+    def _run_directories(self):
+        """list: Directories the executable runs in, the working directory or one directory per chunk or tile."""
+        if self._tiled:
+            n_tiles = len(glob.glob(os.path.join(self.working_directory, _tile_name("*"))))
+            return [os.path.join(self.working_directory, _tile_name(k)) for k in range(n_tiles)]
+        if len(self.chunk_ranges) == 1:
+            return [self.working_directory]
+        return [os.path.join(self.working_directory, _chunk_name(k)) for k in range(len(self.chunk_ranges))]
+
+    def _subprocess_calls(self):
+        """(executable, shell, working directory) of every single core process of the job."""
+        executable, shell = self.executable.get_input_for_subprocess_call(cores=1, threads=1)
+        return [(executable, shell, directory) for directory in self._run_directories]
+
+    def _finish_subprocesses(self, results):
+        """Write error.out from the results of `_execute_in_parallel()` and collect the output."""
+        self._execution = {
+            "directory": [os.path.relpath(directory, self.working_directory) for directory in self._run_directories],
+            "slot": [slot for _, _, _, (slot, _) in results],
+            "threads": [threads["threads"] for _, _, _, (_, threads) in results],
+            "cores": [
+                "" if threads["cores"] is None else ",".join(str(c) for c in threads["cores"])
+                for _, _, _, (_, threads) in results
+            ],
+            "seconds": [seconds for _, _, seconds, _ in results],
+        }
+        job_crashed, shell_output = False, []
+        for output, error, _, _ in results:
+            if error is not None:
+                crashed, output = handle_failed_job(job=self, error=error)
+                job_crashed = job_crashed or crashed
+            shell_output.append(output)
+        with open(os.path.join(self.working_directory, "error.out"), mode="w") as f_err:
+            f_err.write("".join(shell_output))
+        handle_finished_job(job=self, job_crashed=job_crashed, collect_output=True)
+
+    def _start_log_follower(self):
+        """Follow the output.log of every chunk or tile in a background thread and write progress.json."""
+        directories = self._run_directories
+        chunk_ranges = self.chunk_ranges if not self._tiled else [(0, len(self.frame_numbers))] * len(directories)
+        keyframes = self._load_keyframes()
+        if keyframes is not None:
+            chunk_ranges = [(0, len(keyframes))]
+        parsers = {
+            os.path.join(directory, "output.log"): MatchSeriesLogParser(
+                n_frames=stop - start,
+                n_stages=int(self.input["numExtraStages"]) + 1,
+                skip_stage1=bool(int(self.input["skipStage1"])),
+            )
+            for directory, (start, stop) in zip(directories, chunk_ranges)
+        }
+        self._log_follower = MatchSeriesLogFollower(
+            parsers=parsers, progress_file=os.path.join(self.working_directory, "progress.json")
+        )
+        self._log_follower.start()
+
+    def _stop_log_follower(self):
+        """Stop following the logs and return the timings, None if no log was followed."""
+        if self._log_follower is None:
+            return None
+        follower, self._log_follower = self._log_follower, None
+        follower.stop()
+        return follower.timings
 
     def collect_output(self):
-        pass
-    
+        """
+        Store the deformations and, with settings.storage.deformed_templates, the deformed templates of every stage in
+        the job HDF5 file.
+
+        The results are streamed frame by frame into chunked, gzip compressed datasets
+        `output/stage<n>/deformations` (frame, [x, y], height, width) and `output/stage<n>/deformed_templates`, such
+        that the memory footprint is independent of the length of the series. For a series registered in parallel
+        chunks only the final stage is stored, merged to the reference of the first chunk. The wall-clock time spent
+        per stage and level is stored in `output/timings`, the registration quality of every frame of the final stage in
+        `output/metrics` and the median the final stage was registered against in `output/final_reference`, for
+        `append_frames()`. The numpy backend stores its output directly.
+
+        Only the deformations are read from the saveDirectory, the deformed templates written by the executable are
+        not ingested. The stored deformed templates are computed in Python instead, see `_store_frame()`.
+        """
+        timings = self._stop_log_follower()
+        shifts = self._load_prealign_shifts()
+        if self._cache_hit:
+            with h5py.File(self.project_hdf5.file_name, "a") as f:
+                if self._output.h5_path in f:
+                    del f[self._output.h5_path]
+                self.cache.restore(key=self._cache_key, hdf=f, h5_path=self._output.h5_path)
+            self._remove_extracted_frames()
+            return
+        with h5py.File(self.project_hdf5.file_name, "a") as f:
+            if self.settings.backend == "executable":
+                if self._output.h5_path in f:
+                    del f[self._output.h5_path]
+                h5_output = f.create_group(self._output.h5_path)
+                if len(self.chunk_ranges) > 1:
+                    self._collect_chunks(h5_output)
+                elif self._tiled:
+                    self._collect_tiles(h5_output)
+                elif self._load_keyframes() is not None:
+                    self._collect_keyframes(h5_output)
+                else:
+                    save_directory = os.path.join(self.working_directory, self.input["saveDirectory"])
+                    for stage_directory in _stage_directories(save_directory):
+                        self._collect_stage(h5_output, stage_directory)
+                median = self._final_median()
+                if median is not None:
+                    h5_output["final_reference"] = median
+                if timings is not None:
+                    _store_timings(h5_output, timings)
+                if self._execution is not None:
+                    _store_table(h5_output, "execution", self._execution)
+                    h5_output["execution"].attrs["node"] = platform.node()
+                if shifts is not None:
+                    h5_output["prealign_shifts"] = shifts
+                if self._rejected_frames is not None:
+                    _store_table(h5_output, "rejected_frames", self._rejected_frames)
+            if self._output.h5_path in f:
+                self._store_metrics(f[self._output.h5_path])
+        self._remove_template_scratch()
+        if self._cache_key is not None:
+            self.cache.store(key=self._cache_key, file_name=self.project_hdf5.file_name, h5_path=self._output.h5_path)
+        self._remove_extracted_frames()
+
+    def _remove_extracted_frames(self):
+        """Remove the frames extracted from the input file, they are only needed while the series is registered."""
+        if self._input_file is None:
+            return
+        file_names = [self.input["templateNamePattern"] % frame for frame in self._input_frame_numbers]
+        if self._rejected_frames is not None:
+            file_names += [self.accepted_file_pattern % i for i in range(len(self.frame_numbers))]
+        for file_name in file_names:
+            path = os.path.join(self.working_directory, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _collect_stage(self, h5_output, stage_directory):
+        frame_directories = _frame_directories(stage_directory)
+        if len(frame_directories) == 0:
+            return
+        frames = self.frame_numbers
+        if len(frame_directories) < len(frames):
+            # the reference frame is not registered in the first stage
+            frames = frames[len(frames) - len(frame_directories):]
+        h5_stage = h5_output.create_group(os.path.basename(stage_directory))
+        h5_stage.create_dataset("frames", data=np.array(frames), maxshape=(None,))
+        for i, (frame, frame_directory) in enumerate(zip(frames, frame_directories)):
+            self._store_frame(h5_stage, len(frames), i, frame, _read_deformation(frame_directory))
+
+    def _collect_chunks(self, h5_output):
+        """
+        Merge the final stage of the chunks to the reference of the first chunk.
+
+        The mapping from the common reference to the reference of a chunk is estimated from the frames it shares
+        with the previous, already merged chunk and composed with the deformations of the chunk.
+        """
+        frames = self.frame_numbers
+        chunk_ranges = self.chunk_ranges
+        stage_name = None
+        h5_stage = None
+        # merged deformations of the frames shared with the next chunk, without the prealignment shifts
+        shared = {}
+        for k, (start, stop) in enumerate(chunk_ranges):
+            save_directory = os.path.join(self.working_directory, _chunk_name(k), self.input["saveDirectory"])
+            stage_directory = _stage_directories(save_directory)[-1]
+            if stage_name is None:
+                stage_name = os.path.basename(stage_directory)
+                h5_stage = h5_output.create_group(stage_name)
+                h5_stage.create_dataset("frames", data=np.array(frames), maxshape=(None,))
+                h5_stage["chunks"] = np.array(chunk_ranges)
+            frame_directories = _frame_directories(stage_directory)
+            n_reference = (stop - start) - len(frame_directories)
+            reference = np.zeros_like(_read_deformation(frame_directories[0]))
+
+            def chunk_deformation(i):
+                j = i - start - n_reference
+                return reference if j < 0 else _read_deformation(frame_directories[j])
+
+            if k == 0:
+                correction, first = None, start
+            else:
+                first = chunk_ranges[k - 1][1]
+                correction = np.mean([shared[i] - chunk_deformation(i) for i in range(start, first)], axis=0)
+            next_start = chunk_ranges[k + 1][0] if k + 1 < len(chunk_ranges) else stop
+            shared = {}
+            for i in range(first, stop):
+                deformation = chunk_deformation(i)
+                if correction is not None:
+                    deformation = compose_deformations(correction, deformation)
+                if i >= next_start:
+                    shared[i] = deformation
+                self._store_frame(h5_stage, len(frames), i, frames[i], deformation)
+
+    def _collect_tiles(self, h5_output):
+        """
+        Stitch the deformations of the tiles frame by frame, every stage registered by all tiles is stored.
+
+        The deformations of the tiles of a frame are read by `server.cores` threads, so only a single stitched frame
+        is held in memory.
+        """
+        shape, size, starts = self._tile_layout()
+        save_directories = [
+            os.path.join(self.working_directory, _tile_name(k), self.input["saveDirectory"]) for k in range(len(starts))
+        ]
+        stage_names = [os.path.basename(stage) for stage in _stage_directories(save_directories[0])]
+        with ThreadPoolExecutor(max_workers=max(1, int(self.server.cores))) as executor:
+            for stage_name in stage_names:
+                tile_directories = [
+                    _frame_directories(os.path.join(directory, stage_name)) for directory in save_directories
+                ]
+                n_frames = min(len(directories) for directories in tile_directories)
+                if n_frames == 0:
+                    continue
+                frames = self.frame_numbers[len(self.frame_numbers) - n_frames:]
+                h5_stage = h5_output.create_group(stage_name)
+                h5_stage.create_dataset("frames", data=np.array(frames), maxshape=(None,))
+                h5_stage["tiles"] = np.array(starts)
+                for i, frame in enumerate(frames):
+                    deformations = executor.map(_read_deformation, [directories[i] for directories in tile_directories])
+                    deformation = _stitch_tiles(
+                        deformations, starts, size=size, overlap=int(self.settings.tiles.overlap), shape=shape
+                    )
+                    self._store_frame(h5_stage, n_frames, i, frame, deformation)
+
+    def _collect_keyframes(self, h5_output):
+        """
+        Store the keyframes registered by the executable and register the frames between them stage by stage.
+
+        The frames between the keyframes are refined onto the reference the executable used in the same stage: the
+        first frame in stage 1, else the median (or mean) of the deformed templates of the previous stage, here of
+        all frames instead of the keyframes only.
+        """
+        frames = self.frame_numbers
+        keyframes = self._load_keyframes()
+        save_directory = os.path.join(self.working_directory, self.input["saveDirectory"])
+        reference = self._load_registration_frame(0)
+        previous = None
+        for stage_directory in _stage_directories(save_directory):
+            frame_directories = _frame_directories(stage_directory)
+            if len(frame_directories) == 0:
+                continue
+            stage = _stage_number(stage_directory)
+            lam = float(self.input["lambda"])
+            if stage > 1:
+                lam *= float(self.input["extraStagesLambdaFactor"])
+            # the reference frame is not registered in the first stage
+            registered = keyframes[len(keyframes) - len(frame_directories):]
+            indices = list(range(0 if len(registered) == len(keyframes) else 1, len(frames)))
+            h5_stage = h5_output.create_group(os.path.basename(stage_directory))
+            h5_stage.create_dataset("frames", data=np.array([frames[i] for i in indices]), maxshape=(None,))
+            for i, frame_directory in zip(registered, frame_directories):
+                deformation = _read_deformation(frame_directory)
+                self._store_frame(h5_stage, len(indices), indices.index(i), frames[i], deformation)
+            self._register_between_keyframes(h5_stage, indices, keyframes, reference, previous, lam)
+            reference = self._stage_reference(h5_stage, reference.shape)
+            previous = (h5_stage, indices)
+        h5_output["keyframes"] = np.array(keyframes)
+
+    def _register_in_process(self):
+        """
+        Register the series with the numpy backend and store the output like `collect_output()` does.
+
+        Stage 1 registers every frame onto the first one, starting from the deformation of the previous frame. The
+        extra stages register all frames onto the median (or mean) of the deformed frames of the previous stage with
+        lambda scaled by extraStagesLambdaFactor, starting from the deformations of the previous stage.
+        """
+        frames = self.frame_numbers
+        parameters = {
+            "start_level": int(self.input["startLevel"]),
+            "stop_level": int(self.input["stopLevel"]),
+            "max_iterations": int(self.input["maxGDIterations"]),
+            "stop_epsilon": float(self.input["stopEpsilon"]),
+        }
+
+        shifts = self._load_prealign_shifts()
+        load = self._load_registration_frame
+        first_stage = 2 if int(self.input["skipStage1"]) == 1 else 1
+        reference = load(0)
+        previous = None
+        warm_start = self._warm_start()
+        keyframes = self._load_keyframes()
+        seconds = defaultdict(float)
+        with h5py.File(self.project_hdf5.file_name, "a") as f:
+            if self._output.h5_path in f:
+                del f[self._output.h5_path]
+            h5_output = f.create_group(self._output.h5_path)
+            for stage in range(first_stage, int(self.input["numExtraStages"]) + 2):
+                start = time.perf_counter()
+                lam = float(self.input["lambda"])
+                if stage > 1:
+                    lam *= float(self.input["extraStagesLambdaFactor"])
+                indices = list(range(1 if stage == 1 else 0, len(frames)))
+                h5_stage = h5_output.create_group("stage" + str(stage))
+                h5_stage.create_dataset("frames", data=np.array([frames[i] for i in indices]), maxshape=(None,))
+                level_seconds = defaultdict(float)
+                deformation = None
+                stage_parameters = dict(parameters)
+                # the first stage starts from the same stage of the preview
+                warm = warm_start[0].get(stage) if previous is None and warm_start is not None else None
+                if warm is not None:
+                    stage_parameters["start_level"] = min(
+                        max(parameters["start_level"], warm_start[1]), parameters["stop_level"]
+                    )
+                for j, i in enumerate(indices):
+                    if keyframes is not None and i not in keyframes:
+                        continue
+                    stored = None
+                    if previous is not None and i in previous[1]:
+                        stored = _decode_frames(
+                            previous[0]["deformations"], previous[0]["deformations"][previous[1].index(i)]
+                        )
+                    elif warm is not None:
+                        stored = _interpolate_deformations(warm[0], warm[1], frames[i])
+                    if stored is not None:
+                        # the stored deformations include the prealignment shifts
+                        deformation = stored
+                        if shifts is not None:
+                            deformation = stored - self._prealign_shifts[frames[i]][:, None, None]
+                    deformation = register(
+                        load(i), reference, lam=lam, initial=deformation, timings=level_seconds, **stage_parameters
+                    )
+                    self._store_frame(h5_stage, len(indices), j, frames[i], deformation)
+                if keyframes is not None:
+                    self._register_between_keyframes(
+                        h5_stage, indices, keyframes, reference, previous, lam, timings=level_seconds
+                    )
+                reference = self._stage_reference(h5_stage, reference.shape)
+                previous = (h5_stage, indices)
+                for level, s in level_seconds.items():
+                    seconds[(stage, level)] += s
+                seconds[(stage, -1)] += time.perf_counter() - start - sum(level_seconds.values())
+            keys = sorted(seconds.keys())
+            _store_timings(h5_output, {
+                "stage": [stage for stage, _ in keys],
+                "level": [level for _, level in keys],
+                "seconds": [seconds[key] for key in keys],
+            })
+            if shifts is not None:
+                h5_output["prealign_shifts"] = shifts
+            if keyframes is not None:
+                h5_output["keyframes"] = np.array(keyframes)
+            if self._rejected_frames is not None:
+                _store_table(h5_output, "rejected_frames", self._rejected_frames)
+
+    def _load_registration_frame(self, i):
+        """
+        Frame i (an index into `frame_numbers`) as it is registered: prealigned, preprocessed or cropped, and
+        normalized unless dontNormalizeInputImages is set. `_load_prealign_shifts()` has to be called before.
+        """
+        if self._prealign_shifts is not None:
+            image = self._read_frame(
+                i, file_name_pattern=self.prealigned_file_pattern, crop=not self.settings.preprocess
+            )
+        elif self.settings.preprocess:
+            image = self._read_frame(i, file_name_pattern=self.preprocessed_file_pattern, crop=False)
+        else:
+            image = self._read_frame(self.frame_numbers[i])
+        return normalize_image(image) if int(self.input["dontNormalizeInputImages"]) == 0 else image
+
+    def _stage_reference(self, h5_stage, shape):
+        """
+        Reference of the stage following `h5_stage`, the median or mean of its deformed templates.
+
+        The deformed templates are stored on the grid of the deformations, 2**stopLevel + 1 pixels, the reference is
+        resized to the `shape` of the registered frames. The registration does not use finer levels than the grid, so
+        no detail is lost.
+        """
+        templates = self._deformed_templates(h5_stage)
+        if int(self.input["useMedianAsNewTarget"]) == 1:
+            reference = median_image(templates)
+        else:
+            reference = mean_image(templates)
+        reference = resize(reference, shape)
+        return normalize_image(reference) if int(self.input["dontNormalizeInputImages"]) == 0 else reference
+
+    def _select_keyframes(self):
+        """
+        Indices of the keyframes with settings.keyframes, see `select_keyframes()`.
+
+        With a threshold the registered frames are read once, one at a time. `_load_prealign_shifts()` has to be
+        called before.
+        """
+        step = int(self.settings.keyframes.step)
+        threshold = float(self.settings.keyframes.threshold)
+        n_frames = len(self.frame_numbers)
+        images = (self._load_registration_frame(i) for i in range(n_frames)) if threshold > 0 else None
+        return select_keyframes(n_frames, step, images=images, threshold=threshold)
+
+    def _register_between_keyframes(self, h5_stage, indices, keyframes, reference, previous, lam, timings=None):
+        """
+        Register the frames between the keyframes of a stage, whose deformations are stored already.
+
+        Every frame starts from its deformation in the previous stage or, in the first stage, from the deformations of
+        the neighbouring keyframes interpolated in time, and is refined by settings.keyframes.refine_iterations
+        gradient descent steps on the finest grid only.
+
+        Args:
+            h5_stage (h5py.Group): Stage with the deformations of the keyframes.
+            indices (list): Indices into `frame_numbers` of the frames of the stage.
+            keyframes (list): Indices of the keyframes.
+            reference (numpy.ndarray): Reference of the stage.
+            previous (tuple): Group and indices of the previous stage, None for the first stage.
+            lam (float): Smoothness weight of the stage.
+            timings (dict): Seconds spent per level are added to this dict, if given.
+        """
+        frames = self.frame_numbers
+        positions = {i: j for j, i in enumerate(indices)}
+        known = [i for i in keyframes if i in positions]
+        iterations = int(self.settings.keyframes.refine_iterations)
+
+        def stored(group, group_indices, i):
+            """Deformation of frame i stored in a stage, without the prealignment shift."""
+            dataset = group["deformations"]
+            deformation = _decode_frames(dataset, dataset[group_indices.index(i)])
+            if self._prealign_shifts is not None:
+                deformation = deformation - self._prealign_shifts[frames[i]][:, None, None]
+            return deformation
+
+        zero = np.zeros_like(stored(h5_stage, indices, known[0]))
+        for i in indices:
+            if i in keyframes:
+                continue
+            if previous is not None and i in previous[1]:
+                initial = stored(previous[0], previous[1], i)
+            else:
+                k = int(np.searchsorted(known, i))
+                neighbours = [known[max(k - 1, 0)], known[min(k, len(known) - 1)]]
+                if i < known[0] and 0 not in positions:
+                    # the reference of the first stage is not registered
+                    neighbours[0] = 0
+                initial = _interpolate_deformations(
+                    [frames[n] for n in neighbours],
+                    [zero if n not in positions else stored(h5_stage, indices, n) for n in neighbours],
+                    frames[i],
+                )
+            deformation = initial
+            if iterations > 0:
+                # the finest grid of the keyframes, the square grid of the executable or the grid of the numpy backend
+                level = int(np.ceil(np.log2(max(initial.shape[1:]) - 1)))
+                deformation = resize(register(
+                    self._load_registration_frame(i), reference, lam=lam, start_level=level, stop_level=level,
+                    max_iterations=iterations, stop_epsilon=float(self.input["stopEpsilon"]), initial=initial,
+                    timings=timings,
+                ), initial.shape[1:])
+            self._store_frame(h5_stage, len(indices), positions[i], frames[i], deformation)
+
+    def append_frames(self, num_frames=None, stack=None, directory="."):
+        """
+        Register frames added to a finished series and append them to the final stage of the output.
+
+        Only the new frames are registered, against the reference of the final stage, i.e. the median of the previous
+        stage with useMedianAsNewTarget. The existing results are neither recomputed nor copied. The new frames
+        continue the numbering of the series and are either read from `directory` by templateNamePattern or taken
+        from `stack`.
+
+        Args:
+            num_frames (int): Number of frames to append from `directory`.
+            stack (numpy.ndarray/dask.array.Array/hs.signals.Signal2D): New frames, alternatively to `num_frames`.
+            directory (str): Directory containing the new frames (default: current directory).
+        """
+        if not self.status.finished:
+            raise RuntimeError("Frames can only be appended to a finished job.")
+        if self.settings.backend != "executable":
+            raise ValueError("Frames can only be appended to a series registered with the executable backend.")
+        if self.settings.prealign or self.settings.preprocess:
+            raise ValueError("Frames can not be appended to a prealigned or preprocessed series.")
+        if self._input_file is not None:
+            raise ValueError("Frames can not be appended to a series extracted from an input file.")
+        if self._rejected_frames is not None:
+            raise ValueError("Frames can not be appended to a series with rejected frames.")
+        if (num_frames is None) == (stack is None):
+            raise ValueError("Either the number of frames or a stack of frames has to be given.")
+        if not self.input["templateNamePattern"].endswith((".tif", ".tiff")):
+            raise ValueError("Frames can only be appended to a series of TIFF images.")
+        if stack is not None:
+            stack = _stack_data(stack)
+            num_frames = len(stack)
+        step = int(self.input["templateNumStep"])
+        frames = [self.frame_numbers[-1] + step * (i + 1) for i in range(num_frames)]
+        pattern = os.path.join(self.working_directory, self.input["templateNamePattern"])
+        if stack is not None:
+            _write_frames(stack=stack, file_name_pattern=pattern, frame_numbers=frames)
+        else:
+            found = _find_files(file_names=[self.input["templateNamePattern"] % frame for frame in frames],
+                                directory=directory)
+            if self.settings.staging == "link":
+                _link_files(files=found, working_directory=self.working_directory)
+            else:
+                for file_name, source in found.items():
+                    shutil.copy(source, os.path.join(self.working_directory, file_name))
+
+        append_directory = os.path.join(
+            self.working_directory, "append_" + str(len(glob.glob(os.path.join(self.working_directory, "append_*"))))
+        )
+        os.makedirs(append_directory)
+        reference, reference_is_median = self._final_reference()
+        if reference_is_median:
+            tifffile.imwrite(os.path.join(append_directory, "frame_0.tif"), reference)
+        else:
+            _link_files(files={"frame_0.tif": reference}, working_directory=append_directory)
+        _link_files(
+            files={"frame_" + str(j + 1) + ".tif": pattern % frame for j, frame in enumerate(frames)},
+            working_directory=append_directory,
+        )
+        append_input = MatchSeriesInput()
+        for key in self.input.keys():
+            append_input[key] = self.input[key]
+        append_input["templateNamePattern"] = "frame_%d.tif"
+        append_input["templateNumOffset"] = 0
+        append_input["templateNumStep"] = 1
+        append_input["numTemplates"] = num_frames + 1
+        append_input["numExtraStages"] = 0
+        append_input["skipStage1"] = 0
+        if reference_is_median:
+            # the median is already cropped and resized
+            append_input["dontResizeOrCropReference"] = 1
+            # the frames of the extra stage they are appended to were registered with the scaled lambda
+            append_input["lambda"] = float(self.input["lambda"]) * float(self.input["extraStagesLambdaFactor"])
+        append_input.write_file(file_name="matchSeries.par", cwd=append_directory)
+        executable, shell = self.executable.get_input_for_subprocess_call(cores=1, threads=1)
+        execute_subprocess(
+            executable=_thread_prefix(**self._core_slots(1)[0]) + executable,
+            shell=shell,
+            working_directory=append_directory,
+        )
+
+        frame_directories = _frame_directories(
+            _stage_directories(os.path.join(append_directory, self.input["saveDirectory"]))[0]
+        )
+        with h5py.File(self.project_hdf5.file_name, "a") as f:
+            h5_stage = f[self._output._stage_path()]
+            n_old = h5_stage["frames"].shape[0]
+            n_frames = n_old + num_frames
+            for name in ["frames", "deformations", "deformed_templates"]:
+                if name in h5_stage:
+                    h5_stage[name].resize(n_frames, axis=0)
+            h5_stage["frames"][n_old:] = frames
+            for j, (frame, frame_directory) in enumerate(zip(frames, frame_directories)):
+                self._store_frame(h5_stage, n_frames, n_old + j, frame, _read_deformation(frame_directory))
+            self._store_metrics(f[self._output.h5_path])
+        self._remove_template_scratch()
+        self.input["numTemplates"] = int(self.input["numTemplates"]) + num_frames
+        self.to_hdf()
+
+    def _store_metrics(self, h5_output):
+        """
+        Store the registration quality of every frame of the final stage in `output/metrics`.
+
+        The metrics are computed by `registration_metrics()` against the median (with useMedianAsNewTarget) or the
+        mean of the deformed templates of the final stage, i.e. the template the series is reduced to.
+        """
+        if "metrics" in h5_output:
+            del h5_output["metrics"]
+        stages = sorted([key for key in h5_output.keys() if key.startswith("stage")], key=_stage_number)
+        if len(stages) == 0:
+            return
+        h5_stage = h5_output[stages[-1]]
+        templates = self._deformed_templates(h5_stage)
+        if int(self.input["useMedianAsNewTarget"]) == 1:
+            reference = median_image(templates)
+        else:
+            reference = mean_image(templates)
+        metrics = registration_metrics(
+            templates, _DecodedFrames(h5_stage["deformations"]), reference, max_workers=self.server.cores
+        )
+        _store_table(h5_output, "metrics", {"frame": h5_stage["frames"][()], **metrics})
+
+    def _final_reference(self):
+        """
+        The reference of the final stage, the median of the previous stage or the first frame.
+
+        The median is read from output/final_reference, which is shared through the cache, or from the saveDirectory.
+
+        Returns:
+            numpy.ndarray/str, bool: median image or path of the first frame, whether it is the median
+        """
+        with h5py.File(self.project_hdf5.file_name, "r") as f:
+            if self._output.h5_path + "/final_reference" in f:
+                return f[self._output.h5_path + "/final_reference"][()], True
+        median = self._final_median()
+        if median is not None:
+            return median, True
+        if len(self._output.stages) > 1:
+            raise ValueError("The reference of the final stage is neither stored nor found in the saveDirectory.")
+        return os.path.join(self.working_directory, self.frame_file_names[0]), False
+
+    def _final_median(self):
+        """The median of the stage before the final one written by the executable, None if there is none."""
+        save_directory = os.path.join(
+            self.working_directory, _chunk_name(0) if len(self.chunk_ranges) > 1 else "", self.input["saveDirectory"]
+        )
+        stage_directories = _stage_directories(save_directory)
+        if len(stage_directories) > 1 and os.path.isfile(os.path.join(stage_directories[-2], "median.q2bz")):
+            return _read_quocmesh(os.path.join(stage_directories[-2], "median.q2bz"))
+        return None
+
+    def estimate_resources(self, frame_shape=None, recalibrate=False, set_server=False, safety_factor=1.5):
+        """
+        Predict the wall-clock time, the peak memory and the disk space of the job.
+
+        The time of a registration is modelled as proportional to the pixels of all grids it visits from startLevel
+        to stopLevel and from refineStartLevel to refineStopLevel, plus a constant per process. The memory of a process
+        is modelled as linear in the pixels of the finest grid plus two input frames. Both are calibrated on this
+        machine by registering two synthetic frames on the grids of the levels 6 and 7 with the backend and the
+        parameters of the job, including the enabled save* outputs; the calibration is stored in the project and
+        reused for the same machine, backend and parameters.
+
+        Args:
+            frame_shape (tuple): (height, width) of the input frames, read from the first frame by default.
+            recalibrate (bool): Repeat the calibration even if one is stored.
+            set_server (bool): Set server.run_time and server.memory_limit to the estimates times safety_factor.
+            safety_factor (float): Factor applied to the estimates for the server settings (default: 1.5).
+
+        Returns:
+            dict: seconds (wall-clock), cpu_seconds (summed over the processes), memory (peak bytes of the job, None
+                if it cannot be measured), disk (bytes of the output), registrations and processes
+        """
+        frame_shape = tuple(frame_shape) if frame_shape is not None else self._first_frame_shape()
+        size = 2 ** int(self.input["precisionLevel"]) + 1
+        shape = frame_shape
+        if int(self.input["cropInput"]) == 1:
+            shape = (
+                min(size, frame_shape[0] - int(self.input["cropStartY"])),
+                min(size, frame_shape[1] - int(self.input["cropStartX"])),
+            )
+        if self.settings.preprocess and int(self.input["resizeInput"]) == 1:
+            shape = (size, size)
+        stop_level = int(self.input["stopLevel"])
+        n_extra_stages = int(self.input["numExtraStages"])
+        skip_stage1 = int(self.input["skipStage1"]) == 1
+        if self.settings.backend == "numpy":
+            work = registration_work(self.input["startLevel"], stop_level, shape=shape)
+            finest = grid_pixels(stop_level, shape)
+            process_frames = [len(self.frame_numbers)]
+            workers = 1
+        elif self._tiled:
+            level = int(self.settings.tiles.level)
+            tile_size = 2 ** level + 1
+            overlap = int(self.settings.tiles.overlap)
+            work = registration_work(
+                min(int(self.input["startLevel"]), level), min(stop_level, level),
+                min(int(self.input["refineStartLevel"]), level), min(int(self.input["refineStopLevel"]), level),
+            )
+            finest = grid_pixels(min(max(stop_level, int(self.input["refineStopLevel"])), level))
+            n_tiles = len(_tile_starts(shape[0], tile_size, overlap)) * len(_tile_starts(shape[1], tile_size, overlap))
+            process_frames = [len(self.frame_numbers)] * n_tiles
+            workers = len(self._core_slots(n_tiles))
+        else:
+            work = registration_work(
+                self.input["startLevel"], stop_level, self.input["refineStartLevel"], self.input["refineStopLevel"]
+            )
+            finest = grid_pixels(max(stop_level, int(self.input["refineStopLevel"])))
+            process_frames = [stop - start for start, stop in self.chunk_ranges]
+            workers = len(self._core_slots(len(process_frames)))
+        calibration = self._calibration(recalibrate=recalibrate)
+        registrations = [n_registrations(n, n_extra_stages, skip_stage1) for n in process_frames]
+        intercept, slope = calibration["seconds"]
+        process_seconds = [intercept + slope * work * n for n in registrations]
+        memory = None
+        if calibration["memory"] is not None:
+            intercept, slope = calibration["memory"]
+            memory = workers * (intercept + slope * finest + 2 * 8 * int(np.prod(frame_shape)))
+            if self.settings.backend == "numpy":
+                # blocks of 64 rows of all deformed templates are read for the median
+                memory += len(self.frame_numbers) * 64 * shape[1] * 8
+        n_arrays = 3
+        if self.settings.backend == "executable":
+            for key, n in [
+                ("saveNamedDeformations", 2), ("saveNamedDeformedTemplates", 1), ("saveDeformedTemplates", 1),
+                ("saveRefAndTempl", 2),
+            ]:
+                n_arrays += n * int(self.input[key])
+        estimate = {
+            "seconds": max(process_seconds) * int(np.ceil(len(process_seconds) / workers)),
+            "cpu_seconds": sum(process_seconds),
+            "memory": memory,
+            "disk": sum(registrations) * n_arrays * finest * 8,
+            "registrations": sum(registrations),
+            "processes": len(process_seconds),
+        }
+        if set_server:
+            self.server.run_time = int(np.ceil(estimate["seconds"] * safety_factor))
+            if memory is not None:
+                self.server.memory_limit = str(int(np.ceil(memory * safety_factor / 2 ** 30))) + "GB"
+        return estimate
+
+    def _first_frame_shape(self):
+        """Shape of the first input frame, taken from the input stack or read from its file."""
+        if self._input_stack is not None:
+            return tuple(self._input_stack.shape[1:])
+        if self._input_file is not None:
+            with _open_stack_file(**self._input_file) as stack:
+                return tuple(stack.shape[1:])
+        try:
+            return tuple(hs.load(self._find_input_frame(0), lazy=True).data.shape[-2:])
+        except FileNotFoundError as e:
+            raise ValueError(str(e) + ", pass frame_shape.")
+
+    def _find_input_frame(self, i):
+        """Path of the input frame i (an index into `frame_numbers`), staged or not yet staged."""
+        file_name = self.frame_file_names[i]
+        candidates = [f for f in self.restart_file_list if os.path.basename(f) == file_name] + [
+            os.path.join(self.working_directory, file_name), os.path.abspath(file_name)
+        ]
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+        raise FileNotFoundError(f"The frame {file_name} was not found")
+
+    def _read_input_frame(self, i):
+        """Input frame i (an index into `frame_numbers`) from the input stack, the input file or its file."""
+        if self._input_stack is not None:
+            return np.asarray(self._input_stack[i])
+        if self._input_file is not None:
+            with _open_stack_file(**self._input_file) as stack:
+                return np.asarray(stack[i])
+        return hs.load(self._find_input_frame(i)).data
+
+    def preview(self, n_frames=8, level=6):
+        """
+        Register an evenly strided subset of the frames on a coarse grid, to check the parameters within seconds.
+
+        The subset is cropped, resized to 2**level + 1 pixels and preprocessed in Python and registered with the
+        current input and settings, with the levels capped at `level`, by the job `<job_name>_preview` in the project
+        `<job_name>_hdf5`; with settings.cache.enabled an unchanged preview is taken from the cache. The numpy
+        backend starts the full run from the deformations of the last preview, interpolated in time, and skips the
+        levels below `level`.
+
+        Args:
+            n_frames (int): Number of frames, including the first and the last one.
+            level (int): Finest level, the precision of the preview.
+
+        Returns:
+            dict: frames (frame numbers of the subset), template (median or mean of the deformed templates of the
+                final stage, following useMedianAsNewTarget), metrics (pandas.DataFrame, see
+                `MatchSeriesOutput.metrics`) and seconds (wall-clock time of the preview)
+        """
+        start = time.perf_counter()
+        n_total = len(self.frame_numbers)
+        indices = sorted(set(np.round(np.linspace(0, n_total - 1, min(int(n_frames), n_total))).astype(int)))
+        parameters = self._preprocessing_parameters()
+        frames = np.array([self._read_input_frame(i) for i in indices], dtype=float)
+        if parameters["crop"] is not None:
+            row, column, height, width = parameters["crop"]
+            frames = frames[:, row:row + height, column:column + width]
+        shape = parameters["shape"] if parameters["shape"] is not None else frames.shape[1:]
+        if self.settings.backend == "numpy":
+            shape = level_shape(shape, level)
+        else:
+            shape = (2 ** level + 1,) * 2
+        parameters.update(crop=None, shape=shape)
+        child_project = self.project.open(self.job_name + "_hdf5")
+        job = child_project.create.job.MatchSeries(self.job_name + "_preview", delete_existing_job=True)
+        for key in self.input.keys():
+            job.input[key] = self.input[key]
+        job.settings = self.settings.copy()
+        job.settings.preprocess = False
+        job.settings.parallel.chunks = 1
+        job.settings.tiles.level = 0
+        job.settings.storage.deformed_templates = True
+        job.executable = self.executable.executable_path
+        job.server.cores = self.server.cores
+        job.input_stack = preprocess_images(frames, **parameters).astype(np.float32)
+        for key, value in [
+            ("cropInput", 0), ("resizeInput", 0), ("preSmoothSigma", 0), ("enhanceContrastSaturationPercentage", 0),
+            ("dontNormalizeInputImages", 1), ("precisionLevel", level),
+        ]:
+            job.input[key] = value
+        for key in ["startLevel", "stopLevel", "refineStartLevel", "refineStopLevel"]:
+            job.input[key] = min(int(job.input[key]), level)
+        job.run()
+        preview_frames = [self.frame_numbers[i] for i in indices]
+        self._preview = {
+            "job": job.job_name,
+            "frames": preview_frames,
+            "level": level,
+            "crop": self._preprocessing_parameters()["crop"],
+        }
+        metrics = job.output.metrics
+        metrics["frame"] = [preview_frames[j] for j in metrics["frame"]]
+        if int(self.input["useMedianAsNewTarget"]) == 1:
+            template = job.output.get_template("median")
+        else:
+            template = job.output.get_template("mean")
+        return {
+            "frames": preview_frames,
+            "template": template,
+            "metrics": metrics,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def _warm_start(self):
+        """
+        Deformations of every stage of the last preview, if it registered frames of this series with the same cropping.
+
+        The first frame, the reference of stage 1, is added to stage 1 with a zero deformation.
+
+        Returns:
+            dict, int: frame numbers and deformations of the preview per stage number and the level of the preview, or
+                None
+        """
+        if self._preview is None or self._preview["crop"] != self._preprocessing_parameters()["crop"]:
+            return None
+        if not set(self._preview["frames"]).issubset(self.frame_numbers):
+            return None
+        if not os.path.isdir(os.path.join(self.project.path, self.job_name + "_hdf5")):
+            return None
+        child_project = self.project.open(self.job_name + "_hdf5")
+        if child_project.get_job_id(self._preview["job"]) is None:
+            return None
+        job = child_project.load(self._preview["job"])
+        if not job.status.finished:
+            return None
+        stages = {}
+        with h5py.File(job.project_hdf5.file_name, "r") as f:
+            for stage in job.output.stages:
+                h5_stage = f[job.output.h5_path + "/" + stage]
+                frames = [self._preview["frames"][j] for j in h5_stage["frames"][()]]
+                deformations = _decode_frames(h5_stage["deformations"], h5_stage["deformations"][()])
+                if frames[0] != self._preview["frames"][0]:
+                    frames = [self._preview["frames"][0]] + frames
+                    deformations = np.concatenate([np.zeros_like(deformations[:1]), deformations])
+                stages[_stage_number(stage)] = (frames, deformations)
+        return stages, int(self._preview["level"])
+
+    def _warm_start_key(self):
+        """Preview job, frames, level and a hash of the deformations the numpy backend starts from, None if cold."""
+        warm_start = self._warm_start() if self.settings.backend == "numpy" else None
+        if warm_start is None:
+            return None
+        stages, level = warm_start
+        digest = hashlib.sha256()
+        for stage in sorted(stages):
+            digest.update(np.ascontiguousarray(stages[stage][1]).tobytes())
+        return [self._preview["job"], self._preview["frames"], level, digest.hexdigest()]
+
+    def _calibration(self, recalibrate=False):
+        """
+        Coefficients of the resource model for this machine, backend and parameters, stored in the project.
+
+        Returns:
+            dict: (intercept, slope) of the seconds per grid pixel and of the memory per pixel of the finest grid
+        """
+        file_name = os.path.join(self.project.path, ".matchseries_calibration.json")
+        parameters = {
+            key: _normalize_parameter(self.input[key]) for key in self.input.keys() if key not in _CALIBRATION_KEYS
+        }
+        key = hashlib.sha256(json.dumps(
+            [platform.node(), self.settings.backend, str(self.executable.executable_path), parameters], sort_keys=True
+        ).encode()).hexdigest()
+        calibrations = {}
+        if os.path.exists(file_name):
+            with open(file_name, "r") as f:
+                calibrations = json.load(f)
+        if key in calibrations and not recalibrate:
+            return calibrations[key]
+        runs = [self._calibration_run(level) for level in [6, 7]]
+        calibrations[key] = {
+            "seconds": fit_linear([work for work, _, _, _ in runs], [seconds for _, _, seconds, _ in runs]),
+            "memory": None if any(memory is None for _, _, _, memory in runs) else fit_linear(
+                [pixels for _, pixels, _, _ in runs], [memory for _, _, _, memory in runs]
+            ),
+        }
+        with open(file_name, "w") as f:
+            json.dump(calibrations, f)
+        return calibrations[key]
+
+    def _calibration_run(self, level):
+        """
+        Register two synthetic frames on the grid of `level` with the backend and the parameters of the job.
+
+        Returns:
+            int, int, float, int: work in grid pixels, pixels of the finest grid, seconds, peak memory in bytes
+        """
+        start_level = min(int(self.input["startLevel"]), level)
+        refine_start_level = min(int(self.input["refineStartLevel"]), level)
+        frames = synthetic_pair(2 ** level + 1)
+        if self.settings.backend == "numpy":
+            seconds, memory = measure(lambda: register(
+                frames[1], frames[0], lam=float(self.input["lambda"]), start_level=start_level, stop_level=level,
+                max_iterations=int(self.input["maxGDIterations"]), stop_epsilon=float(self.input["stopEpsilon"]),
+            ))
+            return registration_work(start_level, level, shape=frames.shape[1:]), grid_pixels(level), seconds, memory
+        par_input = MatchSeriesInput()
+        for key in self.input.keys():
+            par_input[key] = self.input[key]
+        for key, value in [
+            ("templateNamePattern", "frame_%d.tif"), ("templateNumOffset", 0), ("templateNumStep", 1),
+            ("numTemplates", 2), ("numExtraStages", 0), ("skipStage1", 0), ("cropInput", 0), ("resizeInput", 0),
+            ("precisionLevel", level), ("startLevel", start_level), ("stopLevel", level),
+            ("refineStartLevel", refine_start_level), ("refineStopLevel", level), ("saveDirectory", "results/"),
+        ]:
+            par_input[key] = value
+        executable, shell = self.executable.get_input_for_subprocess_call(cores=1, threads=1)
+        with tempfile.TemporaryDirectory() as directory:
+            for i, frame in enumerate(frames):
+                tifffile.imwrite(os.path.join(directory, "frame_%d.tif" % i), frame)
+            par_input.write_file(file_name="matchSeries.par", cwd=directory)
+            seconds, memory = measure_command(executable, shell=shell, working_directory=directory)
+        work = registration_work(start_level, level, refine_start_level, level)
+        return work, grid_pixels(level), seconds, memory
+
+    def apply_deformations(self, stack, stage=None, order=1):
+        """
+        Warp a stack acquired along with the registered series, e.g. other detector channels, EDX maps or spectrum
+        images, with the stored deformations of a stage.
+
+        The result is computed lazily by `deform_stack()` frame by frame and in blocks of channels, reading one
+        deformation at a time from the job HDF5 file. The stack has to cover the field of view of the registered images,
+        i.e. it has to be cropped like the input if cropInput is set, but may have a different number of pixels.
+
+        Args:
+            stack (numpy.ndarray/dask.array.Array/hs.signals.BaseSignal): One entry per frame of the series, either
+                an array (frame, height, width, ...), an image stack with a single navigation axis or a signal with
+                the navigation axes (x, y, frame), like a series of spectrum images.
+            stage (int): Number of the stage (default: the final stage). Frames not registered in the stage, i.e.
+                the reference in stage 1, are dropped.
+            order (int): Spline interpolation order.
+
+        Returns:
+            dask.array.Array/hs.signals.BaseSignal: the deformed stack, a lazy signal for signal input
+        """
+        signal = None
+        if isinstance(stack, hs.signals.BaseSignal):
+            axes_manager = stack.axes_manager
+            if not (axes_manager.signal_dimension == 2 and axes_manager.navigation_dimension == 1) and not (
+                axes_manager.signal_dimension < 2 and axes_manager.navigation_dimension == 3
+            ):
+                raise ValueError(
+                    "The signal has to be a stack of 2D signals with a single navigation axis or have the navigation "
+                    "axes (x, y, frame)!"
+                )
+            signal, stack = stack, stack.data
+        elif not isinstance(stack, (np.ndarray, da.Array)):
+            raise ValueError("The stack has to be a numpy array, a dask array or a hyperspy signal!")
+        if stack.shape[0] != len(self.frame_numbers):
+            raise ValueError(f"The stack has {stack.shape[0]} frames, but the series has {len(self.frame_numbers)}.")
+        stage_path = self._output._stage_path(stage=stage)
+        with h5py.File(self.project_hdf5.file_name, "r") as f:
+            stage_frames = f[stage_path + "/frames"][()].tolist()
+        # the frames of a stage are a contiguous part of the series
+        start = self.frame_numbers.index(stage_frames[0])
+        stop = start + len(stage_frames)
+        deformed = deform_stack(
+            stack=stack[start:stop],
+            deformations=_HDF5Frames(self.project_hdf5.file_name, stage_path + "/deformations"),
+            order=order,
+        )
+        if signal is None:
+            return deformed
+        if stop - start != len(self.frame_numbers):
+            signal = signal.inav[..., start:stop]
+        result = signal.as_lazy()
+        result.data = deformed
+        return result
+
+    def _store_frame(self, h5_stage, n_frames, i, frame, deformation):
+        """
+        Store the deformation of a frame and, with settings.storage.deformed_templates, its deformed template.
+
+        The deformed templates written by the executable are not ingested. With settings.storage.deformed_templates
+        they are computed in Python by `_deformed_template()` instead.
+        """
+        if self._prealign_shifts is not None:
+            deformation = deformation + self._prealign_shifts[frame][:, None, None]
+        if "deformations" not in h5_stage:
+            _create_deformation_dataset(
+                h5_stage, n_frames, deformation,
+                encoding=self.settings.storage.deformations,
+                max_error=float(self.settings.storage.max_error),
+            )
+        _write_deformation(h5_stage, i, deformation)
+        if self.settings.storage.deformed_templates:
+            template = self._deformed_template(frame, deformation)
+            if "deformed_templates" not in h5_stage:
+                _create_frame_dataset(h5_stage, "deformed_templates", n_frames, template)
+            h5_stage["deformed_templates"][i] = template
+
+    def _deformed_template(self, frame, deformation):
+        """
+        The input image of a frame warped by its deformation, including the prealignment shift.
+
+        The input frame is cropped like the executable does, resized to the grid of the deformation, i.e.
+        2**stopLevel + 1 pixels (the refined level for refined results), and warped with `deform_image()`. It is not
+        normalized and only saveNamedDeformedTemplatesUsingNearestNeighborInterpolation of the
+        saveNamedDeformedTemplates* options is used. This way the templates of all backends, chunks, tiles and
+        keyframes are computed alike, but they may differ from the files written by the executable.
+        """
+        nearest = int(self.input["saveNamedDeformedTemplatesUsingNearestNeighborInterpolation"]) == 1
+        template = self._read_frame(frame, deformation.shape[1:])
+        return deform_image(template, deformation, order=0 if nearest else 1)
+
+    def _deformed_templates(self, h5_stage):
+        """
+        Deformed templates of a stage, for the references of the stages and the metrics.
+
+        Without settings.storage.deformed_templates they are computed frame by frame into a scratch file in the working
+        directory, which `_remove_template_scratch()` removes again.
+        """
+        if "deformed_templates" in h5_stage:
+            return h5_stage["deformed_templates"]
+        if self._template_scratch is None:
+            self._template_scratch = h5py.File(os.path.join(self.working_directory, "deformed_templates.h5"), "w")
+        if h5_stage.name not in self._template_scratch:
+            group = self._template_scratch.create_group(h5_stage.name)
+            deformations = h5_stage["deformations"]
+            for i, frame in enumerate(h5_stage["frames"][()]):
+                template = self._deformed_template(frame, _decode_frames(deformations, deformations[i]))
+                if i == 0:
+                    _create_frame_dataset(group, "deformed_templates", deformations.shape[0], template)
+                group["deformed_templates"][i] = template
+        return self._template_scratch[h5_stage.name]["deformed_templates"]
+
+    def _remove_template_scratch(self):
+        if self._template_scratch is None:
+            return
+        file_name = self._template_scratch.filename
+        self._template_scratch.close()
+        self._template_scratch = None
+        os.remove(file_name)
+
+    def _read_frame(self, frame, shape=None, file_name_pattern=None, crop=True):
+        """
+        Read the input image of a frame and crop/resize it like the matchSeries executable does.
+
+        If cropInput is set, the image is cropped to 2**precisionLevel + 1 pixels, then it is resized to `shape`, if
+        given. The file name is formatted from `file_name_pattern` (default: templateNamePattern), frames which are
+        already cropped are read with `crop=False`.
+        """
+        file_name_pattern = self.input["templateNamePattern"] if file_name_pattern is None else file_name_pattern
+        file_name = os.path.join(self.working_directory, file_name_pattern % frame)
+        image = hs.load(file_name).data.astype(float)
+        if crop and int(self.input["cropInput"]) == 1:
+            x, y = int(self.input["cropStartX"]), int(self.input["cropStartY"])
+            size = 2 ** int(self.input["precisionLevel"]) + 1
+            image = image[y:y + size, x:x + size]
+        if shape is not None and image.shape != tuple(shape):
+            image = ndimage.zoom(image, np.array(shape) / np.array(image.shape), order=1)
+        return image
+
     def to_hdf(self, hdf=None, group_name=None):
         super().to_hdf(
             hdf=hdf,
@@ -32,6 +1787,13 @@ class MatchSeries(GenericJob):
         )
         with self.project_hdf5.open("input") as h5in:
             self.input.to_hdf(h5in)
+            self.settings.to_hdf(h5in)
+            if self._input_file is not None:
+                h5in["input_file"] = json.dumps(self._input_file)
+            if self._preview is not None:
+                h5in["preview"] = json.dumps(self._preview)
+            if self._rejected_frames is not None:
+                h5in["rejected_frames"] = json.dumps(self._rejected_frames)
 
     def from_hdf(self, hdf=None, group_name=None):
         super().from_hdf(
@@ -40,6 +1802,1103 @@ class MatchSeries(GenericJob):
         )
         with self.project_hdf5.open("input") as h5in:
             self.input.from_hdf(h5in)
+            if "settings" in h5in.list_groups():
+                self.settings.from_hdf(h5in)
+            if "input_file" in h5in.list_nodes():
+                self._input_file = json.loads(h5in["input_file"])
+            if "preview" in h5in.list_nodes():
+                self._preview = json.loads(h5in["preview"])
+            if "rejected_frames" in h5in.list_nodes():
+                self._rejected_frames = json.loads(h5in["rejected_frames"])
+
+
+class MatchSeriesSweep(MatchSeries):
+    """
+    Register a series with every combination of a grid of matchSeries parameters.
+
+    The input frames are staged, written from the input stack, preprocessed and prealigned only once, in the working
+    directory of the sweep; if the grid varies the preprocessing, every variant preprocesses and prealigns itself.
+    Every variant is a MatchSeries job in the project `<job_name>_hdf5` which hardlinks these frames. The executables
+    of all variants run concurrently on the slots of `server.cores`, see settings.parallel; variants found in the
+    cache and variants with the numpy backend run one after the other.
+
+    Attributes:
+        input (MatchSeriesInput): Parameters of every variant, overwritten by the grid.
+        settings (DataContainer): Settings of every variant, see MatchSeries.
+        grid (DataContainer): Values per parameter of the input, e.g. grid["lambda"] = [100, 200].
+        output (MatchSeriesSweepOutput): Comparison table of the variants.
+    """
+
+    def __init__(self, project, job_name):
+        super().__init__(project, job_name)
+        self.grid = DataContainer(table_name="grid")
+        self._variant_seconds = None
+        self._output = MatchSeriesSweepOutput(self)
+
+    @property
+    def child_project(self):
+        """Project of the variant jobs."""
+        return self.project.open(self.job_name + "_hdf5")
+
+    @property
+    def variants(self):
+        """list: Parameters of every variant, combinations of the values of the grid."""
+        keys = list(self.grid.keys())
+        return [dict(zip(keys, values)) for values in itertools.product(*[list(self.grid[key]) for key in keys])]
+
+    @property
+    def _tiled(self):
+        # every variant cuts its own tiles
+        return False
+
+    @property
+    def _keyframed(self):
+        # every variant selects its own keyframes
+        return False
+
+    def _variant_name(self, k):
+        return self.job_name + "_" + str(k)
+
+    def _create_variant(self, k, parameters):
+        """Create and save a MatchSeries job hardlinking the frames prepared by the sweep."""
+        job = self.child_project.create.job.MatchSeries(self._variant_name(k), delete_existing_job=True)
+        for key in self.input.keys():
+            job.input[key] = self.input[key]
+        for key, value in parameters.items():
+            job.input[key] = value
+        job.settings = self.settings.copy()
+        job.settings.staging = "link"
+        # the frames rejected by the sweep are not staged for the variants
+        job.settings.reject.enabled = False
+        job._rejected_frames = self._rejected_frames
+        job.executable = self.executable.executable_path
+        file_names = list(self.frame_file_names)
+        # the preprocessed frames are only shared if all variants preprocess alike
+        if not self.settings.preprocess or all(key not in _PREPROCESSING_KEYS for key in self.grid.keys()):
+            if self.settings.preprocess:
+                file_names += self._source_file_names + ["preprocessing.json"]
+            if self.settings.prealign:
+                file_names += [self.prealigned_file_pattern % i for i in range(len(self.frame_numbers))]
+                file_names.append("prealign_shifts.txt")
+        job._restart_file_list.extend([os.path.join(self.working_directory, file_name) for file_name in file_names])
+        job.save()
+        return job
+
+    def run_static(self):
+        """
+        Create the variants and run them, the executables of the variants concurrently.
+
+        Only the executables are dispatched to the slots of `server.cores`. Variants with the numpy backend register
+        in this process and variants found in the cache are restored here, one after the other and before the
+        executables start; each of them gets all `server.cores` of the sweep. A sweep over the numpy backend therefore
+        takes as long as its variants together.
+        """
+        self.status.running = True
+        jobs = [self._create_variant(k, parameters) for k, parameters in enumerate(self.variants)]
+        self._variant_seconds = [0.0] * len(jobs)
+        pending = []
+        for k, job in enumerate(jobs):
+            if job.settings.cache.enabled:
+                job._cache_key = job._get_cache_key()
+            if job.settings.backend == "numpy" or (job._cache_key is not None and job.cache.contains(job._cache_key)):
+                start = time.perf_counter()
+                job.server.cores = self.server.cores
+                job.run()
+                self._variant_seconds[k] = time.perf_counter() - start
+            else:
+                pending.append(k)
+        calls = {k: jobs[k]._subprocess_calls() for k in pending}
+        for k in pending:
+            jobs[k].status.running = True
+            jobs[k]._start_log_follower()
+        try:
+            all_calls = [call for k in pending for call in calls[k]]
+            results = _execute_in_parallel(calls=all_calls, slots=self._core_slots(len(all_calls)))
+            for k in pending:
+                job_results, results = results[:len(calls[k])], results[len(calls[k]):]
+                self._variant_seconds[k] = sum(seconds for _, _, seconds, _ in job_results)
+                jobs[k]._finish_subprocesses(job_results)
+        finally:
+            for k in pending:
+                jobs[k]._stop_log_follower()
+        handle_finished_job(job=self, job_crashed=False, collect_output=True)
+
+    def collect_output(self):
+        """
+        Store a table of the parameters, the job name, the status, the seconds spent in the registration summed over
+        the processes of a variant, the RMS deviation of the deformed templates of the final stage from their mean (from
+        the reference of the metrics, if the variants do not store the deformed templates) and the mean normalized
+        cross correlation and minimum Jacobian determinant of the stored metrics.
+        """
+        table = defaultdict(list)
+        for k, parameters in enumerate(self.variants):
+            job = self.child_project.load(self._variant_name(k))
+            for key, value in parameters.items():
+                table[key].append(value)
+            table["job"].append(job.job_name)
+            table["status"].append(str(job.status))
+            table["seconds"].append(np.nan if self._variant_seconds is None else self._variant_seconds[k])
+            residual, ncc, jacobian_min = np.nan, np.nan, np.nan
+            if job.status.finished:
+                with h5py.File(job.project_hdf5.file_name, "r") as f:
+                    templates = job.output._stage_path() + "/deformed_templates"
+                    if job.output.h5_path + "/metrics" in f:
+                        metrics = _read_table(f[job.output.h5_path + "/metrics"])
+                        ncc, jacobian_min = metrics["ncc"].mean(), metrics["jacobian_min"].min()
+                        residual = float(np.sqrt(np.mean(metrics["rms"] ** 2)))
+                    if templates in f:
+                        residual = _rms_residual(f[templates])
+            table["residual"].append(residual)
+            table["ncc"].append(ncc)
+            table["jacobian_min"].append(jacobian_min)
+        with h5py.File(self.project_hdf5.file_name, "a") as f:
+            if self._output.h5_path in f:
+                del f[self._output.h5_path]
+            _store_table(f.create_group(self._output.h5_path), "table", table)
+        self._remove_extracted_frames()
+
+    def to_hdf(self, hdf=None, group_name=None):
+        super().to_hdf(hdf=hdf, group_name=group_name)
+        with self.project_hdf5.open("input") as h5in:
+            self.grid.to_hdf(h5in)
+
+    def from_hdf(self, hdf=None, group_name=None):
+        super().from_hdf(hdf=hdf, group_name=group_name)
+        with self.project_hdf5.open("input") as h5in:
+            self.grid.from_hdf(h5in)
+
+
+class MatchSeriesSweepOutput:
+    """
+    Access to the results of a MatchSeriesSweep job.
+
+    Attributes:
+        table (pandas.DataFrame): Parameters, job name, status, seconds, residual, mean normalized cross correlation
+            and minimum Jacobian determinant of every variant.
+    """
+
+    def __init__(self, job):
+        self._job = job
+
+    @property
+    def h5_path(self):
+        return self._job.project_hdf5.h5_path + "/output"
+
+    @property
+    def table(self):
+        if not os.path.exists(self._job.project_hdf5.file_name):
+            return None
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path + "/table" not in f:
+                return None
+            return _read_table(f[self.h5_path + "/table"])
+
+
+class MatchSeriesCache:
+    """
+    Content addressed cache of MatchSeries results.
+
+    Each entry is an HDF5 file holding a copy of the output group of a job, named by a hash of the input frames and
+    the parameters. Entries are evicted in least recently used order once the cache exceeds `max_size` bytes.
+
+    Args:
+        directory (str): Cache directory.
+        max_size (int): Maximum size of the cache in bytes.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(file_names, parameters, extra=None, max_workers=None):
+        """
+        Hash the content of the input files, the normalized parameters and additional data.
+
+        Args:
+            file_names (list): Input files, hashed in parallel.
+            parameters (dict): Parameters; numeric values are compared as numbers, e.g. '1e-6' equals '0.000001'.
+            extra (list): Additional data to distinguish results.
+            max_workers (int): Number of threads used for hashing.
+
+        Returns:
+            str: key
+        """
+        digest = hashlib.sha256()
+        for key in sorted(parameters.keys()):
+            digest.update(f"{key}={_normalize_parameter(parameters[key])};".encode())
+        digest.update(repr(extra).encode())
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for file_digest in executor.map(_file_digest, file_names):
+                digest.update(file_digest)
+        return digest.hexdigest()
+
+    def _file_name(self, key):
+        return os.path.join(self.directory, key + ".h5")
+
+    @property
+    def size(self):
+        """int: Size of the cache in bytes."""
+        return sum(os.path.getsize(f) for f in glob.glob(os.path.join(self.directory, "*.h5")))
+
+    def contains(self, key):
+        return os.path.exists(self._file_name(key))
+
+    def restore(self, key, hdf, h5_path):
+        """
+        Copy the cached output group to h5_path of the open h5py.File hdf and mark the entry as recently used.
+
+        The timings and the execution table describe the run which filled the cache and are not restored.
+        """
+        with h5py.File(self._file_name(key), "r") as f:
+            f.copy(f["output"], hdf, name=h5_path)
+        for name in _RUN_GROUPS:
+            if h5_path + "/" + name in hdf:
+                del hdf[h5_path + "/" + name]
+        os.utime(self._file_name(key))
+
+    def store(self, key, file_name, h5_path):
+        """Copy the output group h5_path of the HDF5 file file_name to the cache and evict old entries."""
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_file = self._file_name(key) + "." + str(os.getpid())
+        with h5py.File(file_name, "r") as f_in, h5py.File(temporary_file, "w") as f_out:
+            f_in.copy(f_in[h5_path], f_out, name="output")
+            for name in _RUN_GROUPS:
+                if "output/" + name in f_out:
+                    del f_out["output/" + name]
+        os.replace(temporary_file, self._file_name(key))
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries, except `keep`, until the cache fits into max_size."""
+        entries = sorted(glob.glob(os.path.join(self.directory, "*.h5")), key=os.path.getmtime)
+        size = sum(os.path.getsize(f) for f in entries)
+        for entry in entries:
+            if size <= self.max_size:
+                break
+            if keep is not None and entry == self._file_name(keep):
+                continue
+            size -= os.path.getsize(entry)
+            os.remove(entry)
+
+    def clear(self):
+        """Remove all entries."""
+        for entry in glob.glob(os.path.join(self.directory, "*.h5")):
+            os.remove(entry)
+
+
+def _normalize_parameter(value):
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+def _file_digest(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+class MatchSeriesOutput:
+    """
+    Access to the results of a MatchSeries job stored by `MatchSeries.collect_output()`.
+
+    The deformations and deformed templates are returned as lazy hyperspy signals backed by dask arrays, which read
+    the frames from the job HDF5 file only when they are computed. Slicing, averaging or plotting a long series
+    therefore never loads more than the required frames into memory.
+
+    Attributes:
+        stages (list): Names of the stored registration stages, e.g. ['stage1', 'stage2', 'stage3'].
+        frames (numpy.ndarray): Frame numbers of the final stage.
+        deformations (hs.signals.LazySignal2D): Deformations of the final stage, navigation axes (component, frame).
+        deformed_templates (hs.signals.LazySignal2D): Deformed input images of the final stage, at the resolution
+            of the deformations and not normalized, only stored with settings.storage.deformed_templates, see
+            `MatchSeries._deformed_template()`.
+        timings (pandas.DataFrame): Wall-clock seconds spent per stage and level, level -1 accounts for the time
+            outside of the registration levels; summed over the chunks of a parallel run. None for cached results.
+        prealign_shifts (numpy.ndarray): Rigid (row, column) shifts in pixels of the prealignment, None without.
+        metrics (pandas.DataFrame): Registration quality of every frame of the final stage, see
+            `registration_metrics()`, None for jobs collected before the metrics were introduced.
+        execution (pandas.DataFrame): Run directory, slot, threads, pinned cores and seconds of every executable,
+            None for the numpy backend and cached results. The attribute `node` names the host.
+    """
+
+    def __init__(self, job):
+        self._job = job
+
+    @property
+    def h5_path(self):
+        return self._job.project_hdf5.h5_path + "/output"
+
+    @property
+    def stages(self):
+        if not os.path.exists(self._job.project_hdf5.file_name):
+            return []
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path not in f:
+                return []
+            return sorted([key for key in f[self.h5_path].keys() if key.startswith("stage")], key=_stage_number)
+
+    def _stage_path(self, stage=None):
+        stages = self.stages
+        if len(stages) == 0:
+            raise ValueError("No output available, the job has not been collected yet.")
+        stage = stages[-1] if stage is None else "stage" + str(stage)
+        return self.h5_path + "/" + stage
+
+    def _signal(self, name, axes_names, stage=None):
+        data = _lazy_dataset(self._job.project_hdf5.file_name, self._stage_path(stage=stage) + "/" + name)
+        axes = [{"size": size, "name": axis_name} for size, axis_name in zip(data.shape, axes_names)]
+        return hs.signals.Signal2D(data, axes=axes).as_lazy()
+
+    @property
+    def frames(self):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            return f[self._stage_path() + "/frames"][()]
+
+    @property
+    def prealign_shifts(self):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path + "/prealign_shifts" not in f:
+                return None
+            return f[self.h5_path + "/prealign_shifts"][()]
+
+    @property
+    def keyframes(self):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path + "/keyframes" not in f:
+                return None
+            return f[self.h5_path + "/keyframes"][()]
+
+    @property
+    def rejected_frames(self):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path + "/rejected_frames" not in f:
+                return None
+            return _read_table(f[self.h5_path + "/rejected_frames"])
+
+    @property
+    def timings(self):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path + "/timings" not in f:
+                return None
+            return _read_table(f[self.h5_path + "/timings"])[["stage", "level", "seconds"]]
+
+    @property
+    def execution(self):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path + "/execution" not in f:
+                return None
+            table = _read_table(f[self.h5_path + "/execution"])
+            table.attrs["node"] = f[self.h5_path + "/execution"].attrs["node"]
+            return table
+
+    @property
+    def metrics(self):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self.h5_path + "/metrics" not in f:
+                return None
+            return _read_table(f[self.h5_path + "/metrics"])
+
+    @property
+    def deformations(self):
+        return self.get_deformations()
+
+    @property
+    def deformed_templates(self):
+        return self.get_deformed_templates()
+
+    def get_deformations(self, stage=None):
+        """Deformations of the given stage number (default: the final stage) as lazy hyperspy signal."""
+        return self._signal("deformations", ["frame", "component", "height", "width"], stage=stage)
+
+    def get_deformed_templates(self, stage=None):
+        """Deformed input images of the given stage number (default: the final stage) as lazy hyperspy signal."""
+        self._check_deformed_templates(stage=stage)
+        return self._signal("deformed_templates", ["frame", "height", "width"], stage=stage)
+
+    def _check_deformed_templates(self, stage=None):
+        with h5py.File(self._job.project_hdf5.file_name, "r") as f:
+            if self._stage_path(stage=stage) + "/deformed_templates" not in f:
+                raise ValueError(
+                    "No deformed templates stored, set job.settings.storage.deformed_templates = True before the run."
+                )
+
+    def get_template(self, method="median", stage=None, sigma=3.0, iterations=1, max_workers=None):
+        """
+        Reduce the deformed templates of a stage (default: the final stage) to a single image in O(frame) memory.
+
+        Args:
+            method (str): 'median' (approximated by the P-square algorithm), 'mean' or 'clipped_mean'.
+            stage (int): Number of the stage.
+            sigma (float): Clipping threshold of 'clipped_mean' in standard deviations.
+            iterations (int): Number of clipping iterations of 'clipped_mean'.
+            max_workers (int): Number of threads reading the frames.
+
+        Returns:
+            numpy.ndarray: template
+        """
+        if method not in ["median", "mean", "clipped_mean"]:
+            raise ValueError(f"Unknown method '{method}', use 'median', 'mean' or 'clipped_mean'.")
+        self._check_deformed_templates(stage=stage)
+        statistics = frame_statistics(
+            _HDF5Frames(self._job.project_hdf5.file_name, self._stage_path(stage=stage) + "/deformed_templates"),
+            sigma=sigma,
+            iterations=iterations if method == "clipped_mean" else 0,
+            median=method == "median",
+            max_workers=max_workers,
+        )
+        return statistics[method]
+
+
+def metrics_table(project, recursive=True):
+    """
+    Registration metrics of all finished MatchSeries jobs of a project in a single table.
+
+    Only the compact `output/metrics` tables are read, neither the jobs nor their frames are loaded, so filtering
+    hundreds of registrations, e.g. by `table[table.jacobian_min < 0.5].job.unique()`, is fast.
+
+    Args:
+        project (pyiron_base.Project): Project to search.
+        recursive (bool): Include the sub projects.
+
+    Returns:
+        pandas.DataFrame: the columns of `MatchSeriesOutput.metrics` preceded by the job name
+    """
+    df = project.job_table(recursive=recursive)
+    df = df[(df.hamilton == "MatchSeries") & (df.status == "finished")]
+    tables = []
+    for job_id, job_name in zip(df.id, df.job):
+        hdf = project.inspect(int(job_id)).project_hdf5
+        with h5py.File(hdf.file_name, "r") as f:
+            if hdf.h5_path + "/output/metrics" not in f:
+                continue
+            table = _read_table(f[hdf.h5_path + "/output/metrics"])
+        table.insert(0, "job", job_name)
+        tables.append(table)
+    if len(tables) == 0:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)
+
+
+def deform_image(image, deformation, order=1):
+    """
+    Apply a matchSeries deformation to an image.
+
+    Args:
+        image (numpy.ndarray): 2D image.
+        deformation (numpy.ndarray): x and y displacement with shape (2, height, width) in units of the image width,
+            as written by the matchSeries executable.
+        order (int): Spline interpolation order.
+
+    Returns:
+        numpy.ndarray: deformed image
+    """
+    h, w = image.shape
+    coordinates = np.mgrid[0:h, 0:w] + deformation[::-1] * (max(h, w) - 1)
+    return ndimage.map_coordinates(image, coordinates, order=order, mode="nearest")
+
+
+def compose_deformations(first, second):
+    """
+    Compose two matchSeries deformations, i.e. the displacement of x -> y + second(y) with y = x + first(x).
+
+    Args:
+        first (numpy.ndarray): deformation applied first, shape (2, height, width).
+        second (numpy.ndarray): deformation applied second, shape (2, height, width).
+
+    Returns:
+        numpy.ndarray: composed deformation
+    """
+    h, w = first.shape[1:]
+    coordinates = np.mgrid[0:h, 0:w] + first[::-1] * (max(h, w) - 1)
+    return first + np.stack(
+        [ndimage.map_coordinates(component, coordinates, order=1, mode="nearest") for component in second]
+    )
+
+
+def deform_stack(stack, deformations, order=1):
+    """
+    Lazily apply one matchSeries deformation per frame to a stack, e.g. to other channels acquired simultaneously.
+
+    The stack is processed by dask in blocks of a single frame and as many trailing channels (e.g. energy channels of
+    a spectrum image) as fit into about 64 MB, such that a spectrum image is never loaded as a whole. All channels of a
+    block are interpolated with the same coordinates in a single call. Deformations on a different grid than the
+    stack are resized, they are given in units of the image width.
+
+    Args:
+        stack (numpy.ndarray/dask.array.Array): frames (frame, height, width, ...), trailing axes are warped alike.
+        deformations (numpy.ndarray/h5py.Dataset): deformations (frame, 2, height, width) as written by matchSeries.
+        order (int): Spline interpolation order.
+
+    Returns:
+        dask.array.Array: deformed stack with a floating point dtype
+    """
+    stack = stack if isinstance(stack, da.Array) else da.from_array(stack, chunks=-1)
+    if stack.ndim < 3:
+        raise ValueError("The stack has to have the shape (frame, height, width, ...).")
+    if len(deformations) != stack.shape[0]:
+        raise ValueError(f"The stack has {stack.shape[0]} frames, but there are {len(deformations)} deformations.")
+    dtype = np.result_type(stack.dtype, np.float32)
+    trailing = stack.shape[3:]
+    chunks = (1, -1, -1) + (-1,) * len(trailing[:-1])
+    if len(trailing) > 0:
+        other_bytes = int(np.prod(stack.shape[1:-1])) * np.dtype(dtype).itemsize
+        chunks += (max(1, _LAZY_CHUNK_BYTES // max(other_bytes, 1)),)
+    return stack.rechunk(chunks).map_blocks(
+        _deform_block, deformations=deformations, order=order, dtype=dtype, meta=np.array((), dtype=dtype)
+    )
+
+
+def _deform_block(block, deformations, order, block_info=None):
+    """Deform a block (1, height, width, ...) of `deform_stack()` with the deformation of its frame."""
+    frame = block_info[0]["array-location"][0][0]
+    h, w = block.shape[1:3]
+    deformation = resize(np.asarray(deformations[frame], dtype=float), (h, w))
+    channels = np.moveaxis(block[0].reshape(h, w, -1), -1, 0).astype(block_info[None]["dtype"], copy=False)
+    n = channels.shape[0]
+    # all channels share the coordinates, like the template and its derivatives in matchseries_numpy
+    coordinates = np.mgrid[0:h, 0:w] + deformation[::-1] * (max(h, w) - 1)
+    coordinates = np.stack([
+        np.broadcast_to(np.arange(n, dtype=float)[:, None, None], (n, h, w)),
+        np.broadcast_to(coordinates[0], (n, h, w)),
+        np.broadcast_to(coordinates[1], (n, h, w)),
+    ])
+    deformed = ndimage.map_coordinates(channels, coordinates, order=order, mode="nearest")
+    return np.moveaxis(deformed, 0, -1).reshape(block.shape)
+
+
+def _chunk_ranges(n_frames, n_chunks, overlap):
+    """Split n_frames into n_chunks (start, stop) ranges of equal length, each overlapping its predecessor."""
+    if n_chunks <= 1:
+        return [(0, n_frames)]
+    if overlap < 1:
+        raise ValueError("Chunks have to overlap by at least one frame to be merged.")
+    size = int(np.ceil((n_frames + (n_chunks - 1) * overlap) / n_chunks))
+    if size <= overlap:
+        raise ValueError(f"{n_frames} frames cannot be split into {n_chunks} chunks overlapping by {overlap} frames.")
+    ranges = []
+    start = 0
+    while True:
+        stop = min(start + size, n_frames)
+        ranges.append((start, stop))
+        if stop == n_frames:
+            return ranges
+        start = stop - overlap
+
+
+def _chunk_name(k):
+    return "chunk_" + str(k)
+
+
+def _interpolate_deformations(frames, deformations, frame):
+    """Deformation of a frame, linearly interpolated between the deformations of the nearest of the sorted frames."""
+    k = int(np.searchsorted(frames, frame))
+    if k == 0:
+        return deformations[0]
+    if k == len(frames):
+        return deformations[-1]
+    t = (frame - frames[k - 1]) / (frames[k] - frames[k - 1])
+    return (1 - t) * deformations[k - 1] + t * deformations[k]
+
+
+def _tile_name(k):
+    return "tile_" + str(k)
+
+
+def _tile_starts(length, size, overlap):
+    """First pixels of the fewest evenly spaced tiles of `size` pixels covering `length` pixels with `overlap`."""
+    if length < size:
+        raise ValueError(f"The frames ({length} pixels) are smaller than the tiles ({size} pixels).")
+    if size <= overlap:
+        raise ValueError(f"The tiles ({size} pixels) have to be larger than their overlap ({overlap} pixels).")
+    n = int(np.ceil((length - overlap) / (size - overlap)))
+    if n <= 1:
+        return [0]
+    return [int(round(k * (length - size) / (n - 1))) for k in range(n)]
+
+
+def _tile_ramp(start, size, overlap, length):
+    """Blending weight of a tile along one axis, rising linearly over `overlap` pixels at inner edges."""
+    i = np.arange(size, dtype=float)
+    ramp = np.ones(size)
+    if start > 0:
+        ramp = np.minimum(ramp, (i + 1) / (overlap + 1))
+    if start + size < length:
+        ramp = np.minimum(ramp, (size - i) / (overlap + 1))
+    return ramp
+
+
+def _stitch_tiles(deformations, starts, size, overlap, shape):
+    """
+    Blend the deformations of tiles into the deformation of the frame.
+
+    Args:
+        deformations (iterable): Deformations of the tiles in units of the tile width, on any grid.
+        starts (list): (row, column) of the first pixel of every tile.
+        size (int): Size of the tiles in pixels.
+        overlap (int): Width of the blending ramps at the inner edges of the tiles in pixels.
+        shape (tuple): Shape of the frame.
+
+    Returns:
+        numpy.ndarray: deformation (2, height, width) of the frame in units of the frame width
+    """
+    h, w = shape
+    total = np.zeros((2, h, w))
+    weights = np.zeros((h, w))
+    for deformation, (y, x) in zip(deformations, starts):
+        weight = np.outer(_tile_ramp(y, size, overlap, h), _tile_ramp(x, size, overlap, w))
+        total[:, y:y + size, x:x + size] += weight * resize(deformation, (size, size)) * (size - 1)
+        weights[y:y + size, x:x + size] += weight
+    return total / weights / (max(h, w) - 1)
+
+
+def _stage_directories(save_directory):
+    return sorted(glob.glob(os.path.join(save_directory, "stage*")), key=_stage_number)
+
+
+def _stage_number(stage):
+    return int(os.path.basename(stage)[len("stage"):])
+
+
+def _frame_directories(stage_directory):
+    """Result directories of the registered frames of a stage, preferring the refined results ('<i>-r')."""
+    directories = []
+    i = 0
+    while True:
+        for name in [str(i) + "-r", str(i)]:
+            directory = os.path.join(stage_directory, name)
+            if os.path.isdir(directory):
+                directories.append(directory)
+                break
+        else:
+            return directories
+        i += 1
+
+
+def _read_deformation(frame_directory):
+    """Read the deformation of the finest level found in a frame result directory."""
+    x_files = sorted(glob.glob(os.path.join(frame_directory, "deformation_*_0.dat.bz2")))
+    if len(x_files) == 0:
+        raise FileNotFoundError("No deformation found in " + frame_directory)
+    return np.stack([_read_quocmesh(x_files[-1]), _read_quocmesh(x_files[-1][:-len("0.dat.bz2")] + "1.dat.bz2")])
+
+
+def _read_quocmesh(file_name):
+    """Read a (bz2 compressed) QuOcMesh 2D array as written by the matchSeries executable."""
+    open_file = bz2.open if file_name.endswith(("bz2", ".q2bz")) else open
+    with open_file(file_name, "rb") as f:
+        magic = f.readline().rstrip().decode("ascii")
+        dtypes = {"P9": np.float64, "P8": np.float32}
+        if magic not in dtypes:
+            raise ValueError("Unsupported QuOcMesh array type '" + magic + "' in " + file_name)
+        line = f.readline()
+        while line.startswith(b"#"):
+            line = f.readline()
+        width, height = [int(n) for n in line.split()[:2]]
+        # the maximum value is terminated by a single newline, the binary data may start with a newline character
+        while f.read(1) != b"\n":
+            pass
+        return np.frombuffer(f.read(), dtype=dtypes[magic]).reshape(height, width)
+
+
+class _FrameFiles:
+    """Frames stored one image per file, read on access like the frames of a dataset."""
+
+    def __init__(self, file_names):
+        self.file_names = file_names
+        self.shape = (len(file_names),) + tuple(hs.load(file_names[0], lazy=True).data.shape[-2:])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        return np.stack([hs.load(file_name).data for file_name in self.file_names[item]])
+
+
+class _HDF5Frames:
+    """Array-like view on an HDF5 dataset, which opens the file only for the duration of a read."""
+
+    def __init__(self, file_name, h5_path):
+        self.file_name = file_name
+        self.h5_path = h5_path
+        with h5py.File(file_name, "r") as f:
+            self.shape = f[h5_path].shape
+            self.dtype = _decoded_dtype(f[h5_path])
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        with h5py.File(self.file_name, "r") as f:
+            return _decode_frames(f[self.h5_path], f[self.h5_path][item])
+
+
+class _DecodedFrames:
+    """Array-like view on an open HDF5 dataset, which decodes the frames written by `_write_deformation()`."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = dataset.shape
+        self.dtype = _decoded_dtype(dataset)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        return _decode_frames(self.dataset, self.dataset[item])
+
+
+def _lazy_dataset(file_name, h5_path):
+    """Dask array over a frame dataset, reading several frames per chunk to keep the task graph small."""
+    frames = _HDF5Frames(file_name, h5_path)
+    frame_bytes = int(np.prod(frames.shape[1:])) * frames.dtype.itemsize
+    n_frames = max(1, min(frames.shape[0], _LAZY_CHUNK_BYTES // max(frame_bytes, 1)))
+    return da.from_array(
+        frames,
+        chunks=(n_frames,) + frames.shape[1:],
+        name="matchseries-" + tokenize(file_name, h5_path, os.path.getmtime(file_name)),
+        asarray=True,
+        fancy=False,
+    )
+
+
+def _find_files(file_names, directory):
+    """
+    Locate files by name in a directory with one stat call per file.
+
+    Returns:
+        dict: file names and their absolute paths.
+
+    Raises:
+        ValueError: if files are missing.
+    """
+    found, missing = {}, []
+    for file_name in file_names:
+        path = os.path.abspath(os.path.join(directory, file_name))
+        if os.path.isfile(path):
+            found[file_name] = path
+        else:
+            missing.append(file_name)
+    if len(missing) > 0:
+        raise ValueError(
+            f"{len(missing)} input frames are missing in {os.path.abspath(directory)}: "
+            + ", ".join(missing[:10]) + (", ..." if len(missing) > 10 else "")
+        )
+    return found
+
+
+def _link_files(files, working_directory):
+    """
+    Stage files in the working directory without copying their content.
+
+    Files are hardlinked if they are on the same filesystem as the working directory, otherwise symlinked. Only if
+    neither is possible they are copied.
+
+    Args:
+        files (dict): target file names and their source paths.
+        working_directory (str): directory to stage the files in.
+
+    Returns:
+        list: the methods used, in the order of their first use.
+    """
+    device = os.stat(working_directory).st_dev
+    methods = []
+    hardlink, symlink = True, True
+    for file_name, source in files.items():
+        target = os.path.join(working_directory, file_name)
+        if os.path.lexists(target):
+            continue
+        method = None
+        if hardlink and os.stat(source).st_dev == device:
+            try:
+                os.link(source, target)
+                method = "hardlink"
+            except OSError:
+                hardlink = False
+        if method is None and symlink:
+            try:
+                os.symlink(os.path.abspath(source), target)
+                method = "symlink"
+            except OSError:
+                symlink = False
+        if method is None:
+            shutil.copy(source, target)
+            method = "copy"
+        if method not in methods:
+            methods.append(method)
+    return methods
+
+
+def _stack_data(stack):
+    """Validate an image stack and return its (numpy or dask) data array."""
+    if isinstance(stack, hs.signals.BaseSignal):
+        if stack.axes_manager.navigation_dimension != 1 or stack.axes_manager.signal_dimension != 2:
+            raise ValueError("The signal has to be a stack of 2D signals with a single navigation axis!")
+        stack = stack.data
+    elif not isinstance(stack, (np.ndarray, da.Array)):
+        raise ValueError("The input stack has to be a numpy array, a dask array or a hyperspy signal!")
+    if stack.ndim != 3 or stack.shape[0] < 1:
+        raise ValueError("The input stack has to have the shape (frame, height, width).")
+    return stack
+
+
+@contextlib.contextmanager
+def _open_stack_file(file_name, h5_path=None, frame_axis=None):
+    """
+    Open the frames of a multi-frame TIFF or an EMD/HDF5 file without reading them.
+
+    Uncompressed contiguous data is memory mapped, so slicing blocks of frames reads the file once, sequentially.
+    Compressed TIFF pages are decoded one at a time and chunked or compressed HDF5 datasets are read chunk-wise.
+
+    Args:
+        file_name (str): Path of the file.
+        h5_path (str): Path of the dataset in an EMD/HDF5 file, found automatically if it contains a single 3D dataset.
+        frame_axis (int): Axis of the frames, default: 2 for Velox EMD datasets (Data/Image/...), else 0.
+
+    Yields:
+        numpy.memmap/_TiffPages/h5py.Dataset/dask.array.Array: frames (frame, height, width)
+    """
+    if file_name.lower().endswith((".tif", ".tiff")):
+        try:
+            stack = tifffile.memmap(file_name, mode="r")
+        except ValueError:
+            with tifffile.TiffFile(file_name) as tif:
+                yield _TiffPages(tif)
+            return
+        yield stack
+        return
+    if not file_name.lower().endswith((".emd", ".h5", ".hdf5")):
+        raise ValueError(f"Unsupported stack file {file_name}, use a multi-frame TIFF or an EMD/HDF5 file.")
+    with h5py.File(file_name, "r") as f:
+        if h5_path is None:
+            datasets = []
+            f.visititems(
+                lambda name, node: datasets.append(name) if isinstance(node, h5py.Dataset) and node.ndim == 3 else None
+            )
+            if len(datasets) != 1:
+                raise ValueError(f"Found {len(datasets)} 3D datasets in {file_name}, select one by h5_path.")
+            h5_path = datasets[0]
+        dataset = f[h5_path]
+        if frame_axis is None:
+            frame_axis = 2 if h5_path.lstrip("/").startswith("Data/Image") else 0
+        offset = dataset.id.get_offset()
+        if dataset.chunks is None and offset is not None:
+            stack = np.memmap(file_name, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+            yield np.moveaxis(stack, frame_axis, 0)
+        elif frame_axis % dataset.ndim == 0:
+            yield dataset
+        else:
+            yield da.moveaxis(da.from_array(dataset, chunks=dataset.chunks, lock=True), frame_axis, 0)
+
+
+class _TiffPages:
+    """Array-like view on the pages of an open TIFF file, decoding the pages of a slice in order."""
+
+    def __init__(self, tif):
+        self.pages = tif.pages
+        self.shape = (len(self.pages),) + tuple(self.pages[0].shape)
+        self.dtype = self.pages[0].dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return np.stack([self.pages[i].asarray() for i in range(*item.indices(len(self)))])
+        return self.pages[item].asarray()
+
+
+def _write_frames(stack, file_name_pattern, frame_numbers=None, max_workers=None):
+    """
+    Write the frames of a stack to individual TIFF files with a pool of threads.
+
+    The stack is processed in blocks of frames, so a lazy stack is never computed as a whole and no copy of a numpy
+    stack is created.
+
+    Args:
+        stack (numpy.ndarray/dask.array.Array): frames (frame, height, width).
+        file_name_pattern (str): file name pattern formatted with the frame number.
+        frame_numbers (list): numbers of the frames (default: 0, 1, 2, ...).
+        max_workers (int): number of threads.
+    """
+    frame_numbers = range(len(stack)) if frame_numbers is None else frame_numbers
+    frame_bytes = int(np.prod(stack.shape[1:])) * stack.dtype.itemsize
+    block_size = max(1, _LAZY_CHUNK_BYTES // max(frame_bytes, 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(stack), block_size):
+            block = stack[start:start + block_size]
+            if isinstance(block, da.Array):
+                block = block.compute()
+            list(executor.map(
+                lambda i: tifffile.imwrite(file_name_pattern % frame_numbers[start + i], block[i]),
+                range(len(block))
+            ))
+
+
+def _execute_in_parallel(calls, slots):
+    """
+    Run (executable, shell, working directory) shell calls with one thread per slot of `MatchSeries._core_slots()`.
+
+    Every call waits for a free slot and runs with the thread count and cores of that slot, see `_thread_prefix()`.
+
+    Returns:
+        list: (shell output, exception or None, seconds, (slot index, slot)) of every call
+    """
+    free = queue.Queue()
+    for k in range(len(slots)):
+        free.put(k)
+
+    def execute(call):
+        executable, shell, working_directory = call
+        k = free.get()
+        start = time.perf_counter()
+        try:
+            output = execute_subprocess(
+                executable=_thread_prefix(**slots[k]) + executable, shell=shell, working_directory=working_directory
+            )
+            return output, None, time.perf_counter() - start, (k, slots[k])
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            return None, e, time.perf_counter() - start, (k, slots[k])
+        finally:
+            free.put(k)
+
+    with ThreadPoolExecutor(max_workers=len(slots)) as executor:
+        return list(executor.map(execute, calls))
+
+
+def _thread_prefix(threads, cores=None):
+    """
+    Shell prefix exporting the OpenMP/BLAS thread counts and pinning the shell, and therefore every command of the
+    executable, to the given cores with taskset.
+    """
+    prefix = "export " + " ".join(variable + "=" + str(threads) for variable in _THREAD_VARIABLES) + "; "
+    if cores is not None:
+        prefix += "export OMP_PROC_BIND=close; taskset -cp " + ",".join(str(c) for c in cores) + " $$ > /dev/null; "
+    return prefix
+
+
+def _store_timings(h5_output, timings):
+    _store_table(h5_output, "timings", timings)
+
+
+def _store_table(h5_output, name, table):
+    """Store a dict of columns as group of datasets, the order of the columns is kept in the attribute 'columns'."""
+    h5_table = h5_output.create_group(name)
+    for key, value in table.items():
+        value = np.array(value)
+        if value.dtype.kind == "U":
+            h5_table.create_dataset(key, data=value.astype(object), dtype=h5py.string_dtype())
+        else:
+            h5_table.create_dataset(key, data=value)
+    h5_table.attrs["columns"] = list(table.keys())
+
+
+def _read_table(h5_table):
+    """Read a table stored by `_store_table()` as pandas.DataFrame."""
+    columns = list(h5_table.attrs["columns"]) if "columns" in h5_table.attrs else list(h5_table.keys())
+    return pd.DataFrame({
+        key: h5_table[key].asstr()[()] if h5_table[key].dtype.kind == "O" else h5_table[key][()] for key in columns
+    })
+
+
+def _rms_residual(dataset):
+    """Root mean square deviation of the frames of an array or HDF5 dataset from their mean, read frame by frame."""
+    mean = mean_image(dataset)
+    return float(np.sqrt(np.mean([np.mean((dataset[i] - mean) ** 2) for i in range(dataset.shape[0])])))
+
+
+def _create_deformation_dataset(hdf, n_frames, deformation, encoding="float64", max_error=0.01):
+    """
+    Create the dataset 'deformations', optionally encoded with a bounded error.
+
+    Args:
+        hdf (h5py.Group): Group of the stage.
+        n_frames (int): Number of frames.
+        deformation (numpy.ndarray): First deformation, defines the shape.
+        encoding (str): 'float64' (lossless), 'float16' or 'int16' with the attribute 'scale_factor', such that the
+            quantization error is below max_error.
+        max_error (float): Maximum displacement error in pixels of the deformation grid, stored in the attribute
+            'max_error' and checked by `_write_deformation()`.
+    """
+    if encoding == "float64":
+        return _create_frame_dataset(hdf, "deformations", n_frames, deformation.astype(np.float64))
+    if encoding == "float16":
+        dataset = _create_frame_dataset(hdf, "deformations", n_frames, deformation.astype(np.float16))
+    elif encoding == "int16":
+        dataset = _create_frame_dataset(hdf, "deformations", n_frames, deformation.astype(np.int16))
+        # the quantization error is at most half of max_error
+        dataset.attrs["scale_factor"] = max_error / (max(deformation.shape[1:]) - 1)
+    else:
+        raise ValueError(f"Unknown deformation encoding '{encoding}', use 'float64', 'float16' or 'int16'.")
+    dataset.attrs["max_error"] = max_error
+    return dataset
+
+
+def _write_deformation(hdf, i, deformation):
+    """
+    Write a deformation to frame i of the dataset 'deformations' of a stage.
+
+    If the encoding of the dataset cannot represent the deformation within its 'max_error', e.g. a displacement
+    exceeding the range of int16, the dataset is converted to float64 first.
+    """
+    dataset = hdf["deformations"]
+    if "max_error" in dataset.attrs:
+        if "scale_factor" in dataset.attrs:
+            encoded = np.clip(np.round(deformation / dataset.attrs["scale_factor"]), -32767, 32767).astype(np.int16)
+        else:
+            encoded = deformation.astype(np.float16)
+        error = np.max(np.abs(_decode_frames(dataset, encoded) - deformation)) * (max(deformation.shape[1:]) - 1)
+        if error <= dataset.attrs["max_error"]:
+            dataset[i] = encoded
+            return
+        dataset = _widen_deformation_dataset(hdf)
+    dataset[i] = deformation
+
+
+def _widen_deformation_dataset(hdf):
+    """Replace an encoded dataset 'deformations' by a float64 dataset with the decoded frames."""
+    dataset = hdf["deformations"]
+    widened = _create_frame_dataset(hdf, "deformations_float64", dataset.shape[0], np.zeros(dataset.shape[1:]))
+    for i in range(dataset.shape[0]):
+        widened[i] = _decode_frames(dataset, dataset[i])
+    del hdf["deformations"]
+    hdf.move("deformations_float64", "deformations")
+    return hdf["deformations"]
+
+
+def _decoded_dtype(dataset):
+    if "scale_factor" in dataset.attrs:
+        return np.dtype(np.float64)
+    if dataset.dtype == np.float16:
+        return np.dtype(np.float32)
+    return dataset.dtype
+
+
+def _decode_frames(dataset, data):
+    """Decode data read from a dataset written by `_write_deformation()`, other data is returned unchanged."""
+    if "scale_factor" in dataset.attrs:
+        return data * dataset.attrs["scale_factor"]
+    if dataset.dtype == np.float16:
+        return np.asarray(data, dtype=np.float32)
+    return data
+
+
+def _create_frame_dataset(hdf, name, n_frames, frame):
+    return hdf.create_dataset(
+        name,
+        shape=(n_frames,) + frame.shape,
+        dtype=frame.dtype,
+        chunks=(1,) + frame.shape,
+        maxshape=(None,) + frame.shape,
+        compression="gzip",
+        shuffle=True,
+    )
 
 
 class MatchSeriesInput(GenericParameters):
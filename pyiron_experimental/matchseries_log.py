@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+
+class MatchSeriesLogParser:
+    """
+    Incremental parser of the log written by the matchSeries executable.
+
+    Every line is passed to `feed()` together with the time it was read. The parser keeps track of the current stage,
+    frame and level and accumulates the wall-clock time spent per stage and level. Time spent outside of a
+    registration level, e.g. reading images or computing the median, is accounted to level -1.
+
+    Args:
+        n_frames (int): Number of frames of the series.
+        n_stages (int): Number of stages, i.e. numExtraStages + 1.
+        skip_stage1 (bool): Whether the first stage is skipped.
+    """
+
+    _stage_pattern = re.compile(r"Created directory .*stage(\d+)/$")
+    _frame_pattern = re.compile(r"Created directory .*stage(\d+)/(\d+)(-r)?/$")
+    _level_pattern = re.compile(r"Registration on level (\d+) started")
+
+    def __init__(self, n_frames, n_stages, skip_stage1=False):
+        self.stage = None
+        self.frame = None
+        self.level = None
+        self.refining = False
+        # the reference frame is not registered in the first stage
+        self.total = (n_stages - 1) * n_frames + (0 if skip_stage1 else n_frames - 1)
+        self._frames_started = set()
+        self._finished = False
+        self._start_time = None
+        self._last_time = None
+        self._current = None
+        self._seconds = defaultdict(float)
+
+    def start(self, t=None):
+        """Mark the start of the executable."""
+        self._switch(time.time() if t is None else t, key=(0, -1))
+
+    def feed(self, line, t=None):
+        """Parse a single line of the log read at time t (default: now)."""
+        t = time.time() if t is None else t
+        line = line.strip()
+        match = self._frame_pattern.search(line)
+        if match is not None:
+            self.stage, self.frame, self.refining = int(match.group(1)), int(match.group(2)), match.group(3) is not None
+            self.level = None
+            self._frames_started.add((self.stage, self.frame))
+            self._switch(t, key=(self.stage, -1))
+            return
+        match = self._stage_pattern.search(line)
+        if match is not None:
+            self.stage, self.frame, self.level = int(match.group(1)), None, None
+            self._switch(t, key=(self.stage, -1))
+            return
+        match = self._level_pattern.search(line)
+        if match is not None:
+            self.level = int(match.group(1))
+            self._switch(t, key=(self.stage or 0, self.level))
+
+    def finish(self, t=None):
+        """Mark the end of the executable."""
+        self._switch(time.time() if t is None else t, key=None)
+        self._finished = True
+
+    def _switch(self, t, key):
+        if self._start_time is None:
+            self._start_time = t
+        if self._current is not None:
+            self._seconds[self._current] += t - self._last_time
+        self._current = key
+        self._last_time = t
+
+    @property
+    def completed(self):
+        """int: Number of completely registered frames, summed over all stages."""
+        if self._finished:
+            return self.total
+        return max(len(self._frames_started) - 1, 0)
+
+    @property
+    def elapsed(self):
+        if self._start_time is None:
+            return 0.0
+        return self._last_time - self._start_time
+
+    def eta(self, t=None):
+        """Estimated remaining wall-clock time in seconds, None if no frame is completed yet."""
+        if self._finished:
+            return 0.0
+        if self.completed == 0:
+            return None
+        elapsed = (time.time() if t is None else t) - self._start_time
+        return elapsed / self.completed * max(self.total - self.completed, 0)
+
+    @property
+    def timings(self):
+        """dict: Lists 'stage', 'level' and 'seconds' of the accumulated wall-clock time."""
+        keys = sorted(self._seconds.keys())
+        return {
+            "stage": [stage for stage, _ in keys],
+            "level": [level for _, level in keys],
+            "seconds": [self._seconds[key] for key in keys],
+        }
+
+    def progress(self, t=None):
+        """dict: Current stage, frame, level, the number of completed and total registrations and the ETA."""
+        return {
+            "stage": self.stage,
+            "frame": self.frame,
+            "level": self.level,
+            "refining": self.refining,
+            "completed": self.completed,
+            "total": self.total,
+            "elapsed": self.elapsed,
+            "eta": self.eta(t=t),
+            "finished": self._finished,
+        }
+
+
+class MatchSeriesLogFollower(threading.Thread):
+    """
+    Follow the logs of running matchSeries executables and periodically write the combined progress to a json file.
+
+    Args:
+        parsers (dict): Log file names and their MatchSeriesLogParser.
+        progress_file (str): File the combined progress is written to.
+        interval (float): Polling interval in seconds.
+    """
+
+    def __init__(self, parsers, progress_file, interval=0.5):
+        super().__init__(daemon=True)
+        self.parsers = parsers
+        self.progress_file = progress_file
+        self.interval = interval
+        self._positions = {file_name: 0 for file_name in parsers.keys()}
+        self._stop_event = threading.Event()
+        t = time.time()
+        for parser in parsers.values():
+            parser.start(t)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._read()
+            self._write_progress()
+
+    def stop(self):
+        """Read the remaining lines, finish the parsers and write the final progress."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self._read()
+        t = time.time()
+        for parser in self.parsers.values():
+            parser.finish(t)
+        self._write_progress()
+
+    def _read(self):
+        t = time.time()
+        for file_name, parser in self.parsers.items():
+            if not os.path.exists(file_name):
+                continue
+            with open(file_name, "rb") as f:
+                f.seek(self._positions[file_name])
+                for line in iter(f.readline, b""):
+                    if not line.endswith(b"\n"):
+                        break
+                    self._positions[file_name] += len(line)
+                    parser.feed(line.decode(errors="replace"), t)
+
+    @property
+    def timings(self):
+        """dict: Timings summed over all followed logs."""
+        seconds = defaultdict(float)
+        for parser in self.parsers.values():
+            timings = parser.timings
+            for stage, level, s in zip(timings["stage"], timings["level"], timings["seconds"]):
+                seconds[(stage, level)] += s
+        keys = sorted(seconds.keys())
+        return {
+            "stage": [stage for stage, _ in keys],
+            "level": [level for _, level in keys],
+            "seconds": [seconds[key] for key in keys],
+        }
+
+    def progress(self):
+        """dict: Progress of a single log or the sum of completed/total and the maximum ETA of several logs."""
+        progress = [parser.progress() for parser in self.parsers.values()]
+        if len(progress) == 1:
+            return progress[0]
+        etas = [p["eta"] for p in progress]
+        return {
+            "completed": sum(p["completed"] for p in progress),
+            "total": sum(p["total"] for p in progress),
+            "elapsed": max(p["elapsed"] for p in progress),
+            "eta": None if None in etas else max(etas),
+            "finished": all(p["finished"] for p in progress),
+            "chunks": progress,
+        }
+
+    def _write_progress(self):
+        temporary_file = self.progress_file + ".tmp"
+        with open(temporary_file, "w") as f:
+            json.dump(self.progress(), f)
+        os.replace(temporary_file, self.progress_file)
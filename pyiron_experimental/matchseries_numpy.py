@@ -0,0 +1,520 @@
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import fft, ndimage
+
+_BLOCK_BYTES = 64 * 2 ** 20
+
+
+def normalize_image(image):
+    """Scale an image linearly to [0, 1] like the matchSeries executable does."""
+    image = np.asarray(image, dtype=float)
+    low, high = image.min(), image.max()
+    if high == low:
+        return np.zeros_like(image)
+    return (image - low) / (high - low)
+
+
+def level_shape(shape, level):
+    """
+    Shape of the grid on a registration level.
+
+    The longest side of the grid has 2**level + 1 pixels like the grids of the matchSeries executable, but the grid is
+    never finer than the image itself.
+    """
+    scale = min(1.0, 2 ** level / (max(shape) - 1))
+    return tuple(max(2, int(round((n - 1) * scale)) + 1) for n in shape)
+
+
+def resize(data, shape):
+    """Resize the last two axes of an array to the given shape, images are smoothed before downsampling."""
+    shape = tuple(shape)
+    if data.shape[-2:] == shape:
+        return data
+    scale = np.array(shape) / np.array(data.shape[-2:])
+    sigma = np.maximum((1 / scale - 1) / 2, 0)
+    leading = [1.0] * (data.ndim - 2)
+    if np.any(sigma > 0):
+        data = ndimage.gaussian_filter(data, sigma=[0] * (data.ndim - 2) + list(sigma))
+    zoomed = ndimage.zoom(data, leading + list(scale), order=1)
+    # zoom rounds the output shape, pad or crop by at most one pixel
+    zoomed = zoomed[..., :shape[0], :shape[1]]
+    pad = [(0, 0)] * (data.ndim - 2) + [(0, s - z) for s, z in zip(shape, zoomed.shape[-2:])]
+    return np.pad(zoomed, pad, mode="edge")
+
+
+def _laplacian_eigenvalues(shape):
+    """Eigenvalues of the 5-point Laplacian with Neumann boundary conditions in the DCT-II basis."""
+    ky, kx = [2 * np.cos(np.pi * np.arange(n) / n) - 2 for n in shape]
+    return ky[:, None] + kx[None, :]
+
+
+class _Level:
+    """Energy and gradient descent of the registration on a single grid."""
+
+    def __init__(self, template, reference, lam):
+        self.reference = reference
+        self.lam = lam
+        h, w = reference.shape
+        self.scale = max(h, w) - 1
+        self.grid = np.mgrid[0:h, 0:w].astype(float)
+        # template and its row and column derivatives, interpolated in a single call
+        self.stack = np.stack([template, *np.gradient(template)])
+        self.channels = np.broadcast_to(np.arange(3, dtype=float)[:, None, None], (3, h, w))
+        self.laplacian = _laplacian_eigenvalues((h, w))
+
+    def warp(self, u):
+        coordinates = self.grid + u[::-1] * self.scale
+        coordinates = np.stack([
+            self.channels, np.broadcast_to(coordinates[0], self.channels.shape),
+            np.broadcast_to(coordinates[1], self.channels.shape),
+        ])
+        return ndimage.map_coordinates(self.stack, coordinates, order=1, mode="nearest")
+
+    def energy(self, u, warped=None):
+        if warped is None:
+            warped = self.warp(u)
+        data = 0.5 * np.sum((warped[0] - self.reference) ** 2)
+        smoothness = np.sum(np.diff(u, axis=1) ** 2) + np.sum(np.diff(u, axis=2) ** 2)
+        return data + 0.5 * self.lam * self.scale ** 2 * smoothness
+
+    def step(self, u, warped, tau):
+        """Semi-implicit gradient step, the smoothness term is treated implicitly in the DCT basis."""
+        residual = warped[0] - self.reference
+        gradient = residual * self.scale * np.stack([warped[2], warped[1]])
+        rhs = fft.dctn(u - tau * gradient, type=2, axes=(1, 2), norm="ortho")
+        rhs /= 1 - tau * self.lam * self.scale ** 2 * self.laplacian
+        return fft.idctn(rhs, type=2, axes=(1, 2), norm="ortho")
+
+    def descent(self, u, max_iterations, stop_epsilon, tau=1e-3):
+        """Gradient descent with Armijo-like step size control: halve tau until the energy decreases, then double."""
+        warped = self.warp(u)
+        energy = self.energy(u, warped)
+        for _ in range(max_iterations):
+            while True:
+                u_new = self.step(u, warped, tau)
+                warped_new = self.warp(u_new)
+                energy_new = self.energy(u_new, warped_new)
+                if energy_new < energy or tau < 1e-12:
+                    break
+                tau /= 2
+            if energy_new >= energy:
+                break
+            decrease = (energy - energy_new) / max(energy, np.finfo(float).tiny)
+            u, warped, energy = u_new, warped_new, energy_new
+            tau *= 2
+            if decrease < stop_epsilon:
+                break
+        return u
+
+
+def register(
+    template, reference, lam=200.0, start_level=6, stop_level=8, max_iterations=200, stop_epsilon=1e-6,
+    initial=None, timings=None,
+):
+    """
+    Non-rigid registration of a template onto a reference image, coarse to fine.
+
+    Minimizes 1/2 |T(x + u(x)) - R(x)|^2 + lam/2 |grad u|^2 on the unit square like the matchSeries executable, by
+    gradient descent on every level from `start_level` to `stop_level`; the result of a level is prolongated to the
+    next one.
+
+    Args:
+        template (numpy.ndarray): 2D image which is deformed.
+        reference (numpy.ndarray): 2D image of the same shape.
+        lam (float): Weight of the smoothness of the deformation, `lambda` of matchSeries.
+        start_level (int): Coarsest level, its grid has 2**start_level + 1 pixels along the longest side.
+        stop_level (int): Finest level.
+        max_iterations (int): Maximum number of gradient descent steps per level, `maxGDIterations` of matchSeries.
+        stop_epsilon (float): Relative energy decrease below which the descent stops, `stopEpsilon` of matchSeries.
+        initial (numpy.ndarray): Initial deformation, e.g. the result of the previous frame.
+        timings (dict): Seconds spent per level are added to this dict, if given.
+
+    Returns:
+        numpy.ndarray: x and y displacement with shape (2, height, width) on the grid of `stop_level` in units of the
+            image width, as written by the matchSeries executable.
+    """
+    template = np.asarray(template, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    if template.shape != reference.shape:
+        raise ValueError(f"Template {template.shape} and reference {reference.shape} differ in shape.")
+    u = initial
+    for level in range(int(start_level), int(stop_level) + 1):
+        start = time.perf_counter()
+        shape = level_shape(reference.shape, level)
+        u = np.zeros((2,) + shape) if u is None else resize(u, shape)
+        u = _Level(resize(template, shape), resize(reference, shape), lam).descent(u, max_iterations, stop_epsilon)
+        if timings is not None:
+            timings[level] += time.perf_counter() - start
+    return u
+
+
+def median_image(dataset, block_rows=64):
+    """Pixelwise median over the first axis of an array or HDF5 dataset, read in blocks of rows."""
+    result = np.empty(dataset.shape[1:])
+    for row in range(0, dataset.shape[1], block_rows):
+        result[row:row + block_rows] = np.median(dataset[:, row:row + block_rows], axis=0)
+    return result
+
+
+def mean_image(dataset):
+    """Pixelwise mean over the first axis of an array or HDF5 dataset, read frame by frame."""
+    result = np.zeros(dataset.shape[1:])
+    for i in range(dataset.shape[0]):
+        result += dataset[i]
+    return result / dataset.shape[0]
+
+
+def phase_correlation_shifts(frames, reference, workers=None):
+    """
+    Rigid shifts of a block of frames relative to a reference by FFT phase correlation.
+
+    All frames of the block are transformed in a single batched FFT, `workers` threads are passed to scipy.fft. The
+    peak of the correlation is refined to subpixel precision by a parabola through its neighbours.
+
+    Args:
+        frames (numpy.ndarray): Frames (frame, height, width).
+        reference (numpy.ndarray): 2D image of the same shape as the frames.
+        workers (int): Number of threads of the FFT.
+
+    Returns:
+        numpy.ndarray: (row, column) shift d of every frame in pixels, such that frame(x + d) matches reference(x).
+    """
+    frames = np.asarray(frames, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    n, h, w = frames.shape
+    window = np.outer(np.hanning(h), np.hanning(w))
+    reference_fft = fft.rfft2((reference - reference.mean()) * window, workers=workers)
+    frames_fft = fft.rfft2((frames - frames.mean(axis=(1, 2), keepdims=True)) * window, workers=workers)
+    cross = frames_fft * np.conj(reference_fft)
+    # whiten the cross-power spectrum only where it carries energy, the weak frequencies would otherwise be amplified
+    # to unit magnitude noise
+    magnitude = np.abs(cross)
+    cross /= magnitude + np.maximum(0.1 * magnitude.max(axis=(1, 2), keepdims=True), np.finfo(float).tiny)
+    correlation = fft.irfft2(cross, s=(h, w), workers=workers)
+    index = np.arange(n)
+    rows, columns = np.unravel_index(np.argmax(correlation.reshape(n, -1), axis=1), (h, w))
+    center = correlation[index, rows, columns]
+    shifts = []
+    for position, size, (dr, dc) in [(rows, h, (1, 0)), (columns, w, (0, 1))]:
+        plus = correlation[index, (rows + dr) % h, (columns + dc) % w]
+        minus = correlation[index, (rows - dr) % h, (columns - dc) % w]
+        curvature = plus - 2 * center + minus
+        offset = np.divide(minus - plus, 2 * curvature, out=np.zeros(n), where=curvature != 0)
+        shift = position + np.clip(offset, -0.5, 0.5)
+        shifts.append(np.where(shift > size / 2, shift - size, shift))
+    return np.stack(shifts, axis=1)
+
+
+def shift_image(image, shift):
+    """Translate an image by the shift d returned by `phase_correlation_shifts()`, i.e. return image(x + d)."""
+    return ndimage.shift(np.asarray(image, dtype=float), -np.asarray(shift), order=1, mode="nearest")
+
+
+def preprocess_images(
+    frames, crop=None, shape=None, sigma=0.0, saturation=0.0, normalize=True, min_to_zero=True
+):
+    """
+    Crop, resize, smooth and normalize a block of frames like the matchSeries executable does with its input.
+
+    Every step is applied to the whole block at once, smoothing and resizing act on the last two axes only.
+
+    Args:
+        frames (numpy.ndarray): Frames (frame, height, width).
+        crop (tuple): (row, column, height, width) of the region to keep, None to keep the full frames.
+        shape (tuple): Shape the frames are resized to after cropping, None to keep their shape.
+        sigma (float): Standard deviation of the Gaussian smoothing in units of the image width, `preSmoothSigma`.
+        saturation (float): Percentage of pixels saturated at both ends of the intensity range before normalizing,
+            `enhanceContrastSaturationPercentage`.
+        normalize (bool): Scale every frame to [0, 1], unless min_to_zero is False, then only divide by the maximum.
+        min_to_zero (bool): Shift the minimum to zero when normalizing, `normalizeMinToZero`.
+
+    Returns:
+        numpy.ndarray: preprocessed frames
+    """
+    frames = np.asarray(frames, dtype=float)
+    if crop is not None:
+        row, column, height, width = crop
+        frames = frames[:, row:row + height, column:column + width]
+    if shape is not None:
+        frames = resize(frames, shape)
+    if sigma > 0:
+        pixels = sigma * (max(frames.shape[1:]) - 1)
+        frames = ndimage.gaussian_filter(frames, sigma=[0, pixels, pixels])
+    if not normalize:
+        return frames
+    flat = frames.reshape(len(frames), -1)
+    if saturation > 0:
+        low, high = np.percentile(flat, [saturation / 2, 100 - saturation / 2], axis=1)
+        frames = np.clip(frames, low[:, None, None], high[:, None, None])
+        flat = frames.reshape(len(frames), -1)
+    low = flat.min(axis=1)[:, None, None] if min_to_zero else np.zeros((len(frames), 1, 1))
+    high = flat.max(axis=1)[:, None, None]
+    return np.divide(frames - low, high - low, out=np.zeros_like(frames), where=high > low)
+
+
+def iterate_blocks(dataset, block_frames, max_workers=None):
+    """
+    Yield consecutive blocks of frames of an array or HDF5 dataset as float arrays.
+
+    The blocks are read by a pool of threads, at most `max_workers` blocks ahead of the consumer, so the memory is
+    bounded by the size of the blocks in flight.
+    """
+    max_workers = max_workers if max_workers is not None else min(4, os.cpu_count() or 1)
+    starts = iter(range(0, dataset.shape[0], block_frames))
+
+    def read(start):
+        return np.asarray(dataset[start:start + block_frames], dtype=float)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(executor.submit(read, start) for start in itertools.islice(starts, max_workers))
+        while len(pending) > 0:
+            block = pending.popleft().result()
+            pending.extend(executor.submit(read, start) for start in itertools.islice(starts, 1))
+            yield block
+
+
+class _P2Median:
+    """
+    P-square estimate of the median (Jain and Chlamtac, 1985) of every pixel, updated frame by frame.
+
+    Five markers per pixel are kept, so the memory does not depend on the number of frames. The median of the first
+    five frames is exact.
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.first = []
+        self.heights = None
+        self.positions = None
+        self.desired = np.array([1, 2, 3, 4, 5], dtype=float)
+        self.increments = np.array([0, 0.25, 0.5, 0.75, 1])
+
+    def update(self, frame):
+        x = np.asarray(frame, dtype=float).ravel()
+        if self.heights is None:
+            self.first.append(x)
+            if len(self.first) == 5:
+                self.heights = np.sort(np.array(self.first), axis=0)
+                self.positions = np.broadcast_to(np.arange(1, 6, dtype=float)[:, None], self.heights.shape).copy()
+                self.first = []
+            return
+        q, n = self.heights, self.positions
+        k = np.minimum(np.sum(x >= q[1:], axis=0), 3)
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        n[1:] += np.arange(1, 5)[:, None] > k
+        self.desired += self.increments
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(1, 4):
+                d = self.desired[i] - n[i]
+                move = ((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1))
+                s = np.sign(d)
+                parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                neighbour_q = np.where(s > 0, q[i + 1], q[i - 1])
+                neighbour_n = np.where(s > 0, n[i + 1], n[i - 1])
+                linear = q[i] + s * (neighbour_q - q[i]) / (neighbour_n - n[i])
+                inside = (q[i - 1] < parabolic) & (parabolic < q[i + 1])
+                q[i] = np.where(move, np.where(inside, parabolic, linear), q[i])
+                n[i] = np.where(move, n[i] + s, n[i])
+
+    @property
+    def median(self):
+        if self.heights is None:
+            return np.median(np.array(self.first), axis=0).reshape(self.shape)
+        return self.heights[2].reshape(self.shape)
+
+
+def frame_statistics(dataset, sigma=3.0, iterations=1, median=True, max_workers=None):
+    """
+    Pixelwise mean, standard deviation, sigma clipped mean and approximate median over the first axis of an array or
+    HDF5 dataset in O(frame) memory.
+
+    The first pass accumulates the sums of the values and of their squares and updates a P-square median estimate,
+    every clipping iteration takes another pass which only accumulates the values within `sigma` standard deviations
+    of the previous clipped mean. The frames are read in blocks of about 64 MB with `iterate_blocks()`.
+
+    Args:
+        dataset (numpy.ndarray/h5py.Dataset): Frames (frame, height, width).
+        sigma (float): Clipping threshold in standard deviations.
+        iterations (int): Number of clipping iterations.
+        median (bool): Estimate the median.
+        max_workers (int): Number of threads reading blocks.
+
+    Returns:
+        dict: mean, std, clipped_mean and median (None if not estimated) images
+    """
+    shape = tuple(dataset.shape[1:])
+    block_frames = max(1, _BLOCK_BYTES // (int(np.prod(shape)) * 8))
+    total, squares = np.zeros(shape), np.zeros(shape)
+    estimator = _P2Median(shape) if median else None
+    for block in iterate_blocks(dataset, block_frames, max_workers=max_workers):
+        total += block.sum(axis=0)
+        squares += np.sum(block ** 2, axis=0)
+        if estimator is not None:
+            for frame in block:
+                estimator.update(frame)
+    n = dataset.shape[0]
+    mean = total / n
+    std = np.sqrt(np.maximum(squares / n - mean ** 2, 0))
+    clipped_mean, clipped_std = mean, std
+    for _ in range(iterations):
+        total, squares, count = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        low, high = clipped_mean - sigma * clipped_std, clipped_mean + sigma * clipped_std
+        for block in iterate_blocks(dataset, block_frames, max_workers=max_workers):
+            inside = (block >= low) & (block <= high)
+            total += np.sum(block, axis=0, where=inside)
+            squares += np.sum(block ** 2, axis=0, where=inside)
+            count += inside.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            clipped_mean = np.where(count > 0, total / count, mean)
+            clipped_std = np.where(count > 0, np.sqrt(np.maximum(squares / count - clipped_mean ** 2, 0)), std)
+    return {
+        "mean": mean,
+        "std": std,
+        "clipped_mean": clipped_mean,
+        "median": estimator.median if estimator is not None else None,
+    }
+
+
+def registration_metrics(templates, deformations, reference, max_workers=None):
+    """
+    Quality of the registration of every frame, computed in blocks of frames.
+
+    Args:
+        templates (numpy.ndarray/h5py.Dataset): Deformed templates (frame, height, width).
+        deformations (numpy.ndarray/h5py.Dataset): Deformations (frame, 2, height, width) in units of the image width.
+        reference (numpy.ndarray): Reference image (height, width).
+        max_workers (int): Number of threads reading blocks.
+
+    Returns:
+        dict: float32 arrays of the normalized cross correlation with the reference (ncc), the root mean square
+            residual (rms), the minimum and maximum of the Jacobian determinant of x -> x + u(x) (jacobian_min,
+            jacobian_max) and the maximum displacement in pixels (max_displacement) per frame
+    """
+    reference = np.asarray(reference, dtype=float)
+    centered_reference = reference - reference.mean()
+    reference_norm = np.sqrt(np.sum(centered_reference ** 2))
+    block_frames = max(1, _BLOCK_BYTES // (3 * reference.size * 8))
+    metrics = {key: [] for key in ["ncc", "rms", "jacobian_min", "jacobian_max", "max_displacement"]}
+    for t, u in zip(
+        iterate_blocks(templates, block_frames, max_workers=max_workers),
+        iterate_blocks(deformations, block_frames, max_workers=max_workers),
+    ):
+        centered = t - t.mean(axis=(1, 2), keepdims=True)
+        norm = np.sqrt(np.sum(centered ** 2, axis=(1, 2))) * reference_norm
+        correlation = np.sum(centered * centered_reference, axis=(1, 2))
+        metrics["ncc"].append(np.divide(correlation, norm, out=np.zeros_like(norm), where=norm > 0))
+        metrics["rms"].append(np.sqrt(np.mean((t - reference) ** 2, axis=(1, 2))))
+        u = u * (max(u.shape[2:]) - 1)
+        dx_dy, dx_dx = np.gradient(u[:, 0], axis=(1, 2))
+        dy_dy, dy_dx = np.gradient(u[:, 1], axis=(1, 2))
+        determinant = (1 + dx_dx) * (1 + dy_dy) - dx_dy * dy_dx
+        metrics["jacobian_min"].append(determinant.min(axis=(1, 2)))
+        metrics["jacobian_max"].append(determinant.max(axis=(1, 2)))
+        metrics["max_displacement"].append(np.sqrt(u[:, 0] ** 2 + u[:, 1] ** 2).max(axis=(1, 2)))
+    return {key: np.concatenate(value).astype(np.float32) for key, value in metrics.items()}
+
+
+def frame_outliers(dataset, sigma=5.0, size=128, max_workers=None):
+    """
+    Find blank frames, flashes and frames with scan glitches in a single pass over the frames.
+
+    The mean and standard deviation of every frame are computed on the full frame, the normalized cross correlation
+    with the previous and the next frame on frames subsampled to about `size` pixels. A frame is an outlier if it is
+    blank, or its mean, standard deviation or best neighbour correlation lies more than `sigma` robust standard
+    deviations (1.4826 times the median absolute deviation) from the median of the series. The robust standard
+    deviations are at least 1% of the median for the mean and standard deviation and 0.01 for the correlation, such
+    that the noise of a clean series is not rejected. A frame correlated badly with only one neighbour is kept, the
+    outlier is its other neighbour.
+
+    Args:
+        dataset (numpy.ndarray/h5py.Dataset): Frames (frame, height, width), at least two.
+        sigma (float): Threshold in robust standard deviations.
+        size (int): Approximate longest side of the subsampled frames correlated.
+        max_workers (int): Number of threads reading blocks.
+
+    Returns:
+        dict: mean, std and correlation arrays and the reasons (list of str, '' if the frame is kept) per frame
+    """
+    shape = tuple(dataset.shape[1:])
+    stride = max(1, int(np.ceil(max(shape) / size)))
+    block_frames = max(1, _BLOCK_BYTES // (int(np.prod(shape)) * 8))
+    means, stds, correlations = [], [], []
+    last = None
+    for block in iterate_blocks(dataset, block_frames, max_workers=max_workers):
+        means.append(block.mean(axis=(1, 2)))
+        stds.append(block.std(axis=(1, 2)))
+        small = block[:, ::stride, ::stride]
+        small = small - small.mean(axis=(1, 2), keepdims=True)
+        small /= np.maximum(np.sqrt(np.sum(small ** 2, axis=(1, 2), keepdims=True)), np.finfo(float).tiny)
+        joined = small if last is None else np.concatenate([last[None], small])
+        correlations.append(np.sum(joined[1:] * joined[:-1], axis=(1, 2)))
+        last = small[-1]
+    mean, std, consecutive = np.concatenate(means), np.concatenate(stds), np.concatenate(correlations)
+    correlation = np.maximum(np.append(-np.inf, consecutive), np.append(consecutive, -np.inf))
+    blank = std <= np.finfo(float).eps * np.maximum(np.abs(mean), 1)
+    # the statistics of the series are taken from the frames which are not blank
+    tests = [
+        ("blank", blank),
+        ("intensity", np.abs(_robust_z(mean[~blank], mean, relative_scale=0.01)) > sigma),
+        ("contrast", np.abs(_robust_z(std[~blank], std, relative_scale=0.01)) > sigma),
+        ("correlation", _robust_z(correlation[~blank], correlation, minimum_scale=0.01) < -sigma),
+    ]
+    reasons = [", ".join(name for name, outlier in tests if outlier[i]) for i in range(len(mean))]
+    return {"mean": mean, "std": std, "correlation": correlation, "reason": reasons}
+
+
+def _robust_z(sample, values, minimum_scale=0.0, relative_scale=0.0):
+    """
+    Deviation of values from the median of a sample in robust standard deviations, which are at least minimum_scale
+    and relative_scale times the absolute median.
+    """
+    if len(sample) == 0:
+        return np.zeros_like(values)
+    median = np.median(sample)
+    scale = max(
+        1.4826 * np.median(np.abs(sample - median)), minimum_scale, relative_scale * abs(median), np.finfo(float).tiny
+    )
+    return (values - median) / scale
+
+
+def select_keyframes(n_frames, step, images=None, threshold=0.0, size=64):
+    """
+    Frames of a series to be registered fully, the frames in between start from interpolated deformations.
+
+    Every `step`-th frame is a keyframe, the first and the last frame always are. If images are given, a frame also
+    becomes a keyframe as soon as the RMS difference of its normalized, downsampled image to the last keyframe exceeds
+    `threshold`, i.e. `step` is the largest gap between keyframes.
+
+    Args:
+        n_frames (int): Number of frames of the series.
+        step (int): Largest number of frames from one keyframe to the next.
+        images (iterable): Images of the frames, read one at a time, None to select every `step`-th frame only.
+        threshold (float): RMS difference of the normalized images starting a new keyframe.
+        size (int): Longest side in pixels of the downsampled images compared.
+
+    Returns:
+        list: indices of the keyframes
+    """
+    step = max(1, int(step))
+    if images is None:
+        return sorted(set(range(0, n_frames, step)) | {n_frames - 1})
+    keyframes, last = [], None
+    for i, image in enumerate(images):
+        image = np.asarray(image, dtype=float)
+        small = normalize_image(resize(image, level_shape(image.shape, int(np.ceil(np.log2(size))))))
+        if (
+            last is None or i - keyframes[-1] >= step or i == n_frames - 1
+            or np.sqrt(np.mean((small - last) ** 2)) > threshold
+        ):
+            keyframes.append(i)
+            last = small
+    return keyframes
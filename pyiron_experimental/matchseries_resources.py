@@ -0,0 +1,164 @@
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy import ndimage
+
+from pyiron_experimental.matchseries_numpy import level_shape
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# runs the command given by its arguments and prints the peak memory of its children in kilobytes
+_MEASURE_WRAPPER = """
+import resource, subprocess, sys
+shell = sys.argv[1] == "shell"
+code = subprocess.call(sys.argv[2] if shell else sys.argv[2:], shell=shell, stdout=subprocess.DEVNULL)
+print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+sys.exit(code)
+"""
+
+
+def grid_pixels(level, shape=None):
+    """
+    Number of pixels of the grid of a registration level.
+
+    Args:
+        level (int): Level, the longest side of the grid has 2**level + 1 pixels.
+        shape (tuple): Shape of the images for the grids of the numpy backend, None for the square grids of the
+            matchSeries executable.
+    """
+    if shape is None:
+        return (2 ** int(level) + 1) ** 2
+    return int(np.prod(level_shape(shape, int(level))))
+
+
+def registration_work(start_level, stop_level, refine_start_level=None, refine_stop_level=None, shape=None):
+    """Pixels of all grids visited by a single registration, including the refinement levels if given."""
+    work = sum(grid_pixels(level, shape) for level in range(int(start_level), int(stop_level) + 1))
+    if refine_start_level is not None:
+        work += sum(grid_pixels(level, shape) for level in range(int(refine_start_level), int(refine_stop_level) + 1))
+    return work
+
+
+def n_registrations(n_frames, n_extra_stages, skip_stage1=False):
+    """Number of registrations of a series, the reference is not registered in stage 1."""
+    return (0 if skip_stage1 else n_frames - 1) + n_frames * n_extra_stages
+
+
+def fit_linear(x, y):
+    """Least squares fit y = intercept + slope * x with non-negative coefficients, returns (intercept, slope)."""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if len(x) > 1 and np.ptp(x) > 0:
+        slope, intercept = np.polyfit(x, y, 1)
+        if slope > 0 and intercept >= 0:
+            return float(intercept), float(slope)
+    # a proportional model is on the safe side if the measurements are too noisy
+    return 0.0, float(np.max(y / x))
+
+
+def synthetic_pair(size, shift=1.5, seed=0):
+    """Two smooth random images of size x size pixels, the second shifted by `shift` pixels along both axes."""
+    image = ndimage.gaussian_filter(np.random.default_rng(seed).random((size, size)), max(1.0, size / 32))
+    image = (image - image.min()) / (image.max() - image.min())
+    return np.stack([image, ndimage.shift(image, (shift, shift), mode="nearest")]).astype(np.float32)
+
+
+def measure(function):
+    """
+    Run a function in this process and measure its wall-clock time and peak memory.
+
+    The peak memory is traced by tracemalloc, i.e. it includes numpy arrays but not the interpreter.
+
+    Returns:
+        float, int: seconds, bytes
+    """
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def measure_command(command, shell=True, working_directory=None):
+    """
+    Run a command in a subprocess and measure its wall-clock time and peak memory.
+
+    The command is started by a small Python wrapper process, which reports the maximum resident set size of its
+    children. The running maximum over the children of this process would include every earlier, possibly larger
+    run, and the resident set size of a child spawned by this process directly starts from the size of this process.
+    Where the resource module is not available the memory is None.
+
+    Returns:
+        float, int: seconds, bytes
+
+    Raises:
+        subprocess.CalledProcessError: if the command fails.
+    """
+    start = time.perf_counter()
+    if resource is None:
+        subprocess.run(command, shell=shell, cwd=working_directory, stdout=subprocess.DEVNULL, check=True)
+        return time.perf_counter() - start, None
+    arguments = [command] if shell else list(command)
+    result = subprocess.run(
+        [sys.executable, "-S", "-c", _MEASURE_WRAPPER, "shell" if shell else "exec"] + arguments,
+        cwd=working_directory, stdout=subprocess.PIPE, check=False,
+    )
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command)
+    # ru_maxrss is given in kilobytes on Linux
+    return seconds, int(result.stdout.split()[-1]) * 1024
+
+
+def synthetic_series(n_frames, shape=(256, 256), spacing=8.0, drift=(0.3, 0.2), scan_distortion=0.5, noise=0.05,
+                     dose=None, seed=0):
+    """
+    Synthetic STEM series of a square lattice of atomic columns with known drift, scan distortion and noise.
+
+    Frame i samples the lattice at p + s_i(p), where s_i combines a linear drift of i * drift pixels and a scan
+    distortion shifting every scan line along x by a smooth, frame dependent offset of up to `scan_distortion` pixels.
+    To first order, the matchSeries deformation registering frame i to frame 0 is s_0 - s_i.
+
+    Args:
+        n_frames (int): Number of frames.
+        shape (tuple): (height, width) of the frames.
+        spacing (float): Lattice spacing in pixels.
+        drift (tuple): (x, y) drift in pixels per frame.
+        scan_distortion (float): Amplitude of the line offsets in pixels.
+        noise (float): Standard deviation of the additive Gaussian noise, the lattice intensity is in [0, 1].
+        dose (float): Electrons per pixel at maximum intensity for Poisson noise, None for no shot noise.
+        seed (int): Seed of the random numbers.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: frames (frame, height, width) as float32, deformations (frame, [x, y], height,
+            width) in units of the image width
+    """
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    y, x = np.mgrid[0:h, 0:w].astype(float)
+    rows = np.arange(h, dtype=float)
+    frames = np.empty((n_frames, h, w), dtype=np.float32)
+    shifts = np.empty((n_frames, 2, h, w))
+    for i in range(n_frames):
+        # a smooth line jitter: a few random sine modes along the slow scan axis
+        periods = rng.uniform(h / 4, 2 * h, size=3)
+        phases = rng.uniform(0, 2 * np.pi, size=3)
+        lines = np.sum(np.sin(2 * np.pi * rows[:, None] / periods + phases), axis=1) / 3 * scan_distortion
+        shifts[i, 0] = i * drift[0] + lines[:, None]
+        shifts[i, 1] = i * drift[1]
+        u, v = (x + shifts[i, 0]) / spacing, (y + shifts[i, 1]) / spacing
+        image = ((1 + np.cos(2 * np.pi * u)) * (1 + np.cos(2 * np.pi * v)) / 4) ** 3
+        if dose is not None:
+            image = rng.poisson(image * dose) / dose
+        frames[i] = image + rng.normal(0, noise, size=shape) if noise > 0 else image
+    deformations = (shifts[:1] - shifts) / (max(h, w) - 1)
+    return frames, deformations
@@ -35,7 +35,7 @@ setup(
         'matplotlib==3.9.2',
         'pystem==0.0.26',
         'hyperspy==2.2.0',
-        'scanf==1.5.2',
+        'tifffile==2024.8.30',
     ],
     cmdclass=versioneer.get_cmdclass(),
 )
@@ -0,0 +1,921 @@
+import os
+import shutil
+import sys
+from unittest import mock
+import h5py
+import numpy as np
+from scipy import ndimage
+
+import hyperspy.api as hs
+import tifffile
+
+from pyiron_base._tests import TestWithCleanProject
+from pyiron_experimental.matchseries import (
+    deform_image, compose_deformations, metrics_table, _chunk_ranges, _thread_prefix, _tile_starts, _stitch_tiles
+)
+from pyiron_experimental.matchseries_log import MatchSeriesLogParser
+from pyiron_experimental.matchseries_resources import synthetic_series, measure_command
+from pyiron_experimental.matchseries_numpy import (
+    register, preprocess_images, frame_statistics, registration_metrics, select_keyframes, frame_outliers
+)
+
+
+def write_quocmesh(file_name, array):
+    import bz2
+    with bz2.open(file_name, "wb") as f:
+        f.write(b"P9\n# This is a QuOcMesh file of type 9 (=RAW DOUBLE)\n")
+        f.write(f"{array.shape[1]} {array.shape[0]}\n255\n".encode())
+        f.write(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+
+
+FAKE_MATCHSERIES = """
+import bz2, os, sys
+import numpy as np
+import tifffile
+
+par = dict(line.split(None, 1) for line in open("matchSeries.par").read().splitlines() if line.strip())
+n, offset, step = int(par["numTemplates"]), int(par["templateNumOffset"]), int(par["templateNumStep"])
+frame = tifffile.imread(par["templateNamePattern"].strip() % offset)
+
+
+def write(file_name, array):
+    with bz2.open(file_name, "wb") as f:
+        f.write(b"P9\\n# fake\\n%d %d\\n255\\n" % (array.shape[1], array.shape[0]) + array.tobytes())
+
+
+for stage in range(1, int(par["numExtraStages"]) + 2):
+    stage_directory = os.path.join(par["saveDirectory"].strip(), "stage%d" % stage)
+    sys.stderr.write("Created directory %s/\\n" % stage_directory)
+    templates = range(1, n) if stage == 1 else range(n)
+    for i, template in enumerate(templates):
+        directory = os.path.join(stage_directory, "%d-r" % i if i > 0 else "0")
+        os.makedirs(directory)
+        sys.stderr.write("Created directory %s/\\nRegistration on level 6 started\\n" % directory)
+        for axis in range(2):
+            write(os.path.join(directory, "deformation_08_%d.dat.bz2" % axis),
+                  np.full(frame.shape, 0.001 * (offset + template * step) + 0.0005 * axis))
+    write(os.path.join(stage_directory, "median.q2bz"), np.full(frame.shape, 0.5))
+sys.stderr.write("done")
+"""
+
+
+def use_fake_executable(job):
+    """Replace the matchSeries executable by a script writing deformations 0.001 * frame (+ 0.0005 for y)."""
+    script = os.path.join(job.project.path, "fake_matchseries.py")
+    with open(script, "w") as f:
+        f.write(FAKE_MATCHSERIES)
+    job.executable = f"{sys.executable} {script} 2> output.log"
+
+
+def write_fake_frames(job, n_frames, shape=(16, 16)):
+    os.makedirs(job.working_directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for frame in range(n_frames):
+        image = hs.signals.Signal2D(rng.random(shape).astype(np.float32))
+        image.save(os.path.join(job.working_directory, job.input["templateNamePattern"] % frame), overwrite=True)
+
+
+def write_fake_results(job, n_frames, shape=(16, 16), n_stages=2, shift=0.01, directory=None):
+    """Write frames and matchSeries like results with deformations (shift * (i + axis)) into the job directory."""
+    write_fake_frames(job, n_frames, shape=shape)
+    directory = job.working_directory if directory is None else os.path.join(job.working_directory, directory)
+    for stage in range(1, n_stages + 1):
+        n = n_frames - 1 if stage == 1 else n_frames
+        for i in range(n):
+            frame_directory = os.path.join(
+                directory, job.input["saveDirectory"], f"stage{stage}", f"{i}-r" if i > 0 else str(i)
+            )
+            os.makedirs(frame_directory, exist_ok=True)
+            for axis in range(2):
+                write_quocmesh(
+                    os.path.join(frame_directory, f"deformation_08_{axis}.dat.bz2"),
+                    np.full(shape, shift * (i + axis)),
+                )
+
+
+class TestMatchSeries(TestWithCleanProject):
+
+    def setUp(self):
+        self.job = self.project.create.job.MatchSeries('match')
+        self.job.input["templateNamePattern"] = "frame_%03d.tif"
+        self.job.input["numTemplates"] = 5
+        self.job.input["numExtraStages"] = 1
+
+    def test_frame_numbers(self):
+        self.assertEqual(self.job.frame_numbers, [0, 1, 2, 3, 4])
+        self.job.input["templateNumOffset"] = 2
+        self.job.input["templateNumStep"] = 3
+        self.assertEqual(self.job.frame_numbers, [2, 5, 8, 11, 14])
+
+    def test_deform_image(self):
+        image = np.arange(100, dtype=float).reshape(10, 10)
+        self.assertTrue(np.allclose(deform_image(image, np.zeros((2, 10, 10))), image))
+        deformation = np.zeros((2, 10, 10))
+        deformation[0] = 1 / 9
+        self.assertTrue(np.allclose(deform_image(image, deformation)[:, :-1], image[:, 1:]))
+
+    def test_collect_output(self):
+        write_fake_results(self.job, n_frames=5, n_stages=2)
+        self.job.settings.storage.deformed_templates = True
+        self.job.save()
+        self.job.collect_output()
+        self.assertEqual(self.job.output.stages, ['stage1', 'stage2'])
+        with self.subTest('final stage'):
+            self.assertEqual(self.job.output.frames.tolist(), [0, 1, 2, 3, 4])
+            self.assertEqual(self.job.output.deformations.data.shape, (5, 2, 16, 16))
+            self.assertEqual(self.job.output.deformed_templates.data.shape, (5, 16, 16))
+            self.assertTrue(np.allclose(self.job.output.deformations.data[3, 1].compute(), 0.04))
+        with self.subTest('reference is not registered in stage 1'):
+            self.assertEqual(self.job.output.get_deformations(stage=1).data.shape, (4, 2, 16, 16))
+        with self.subTest('lazy'):
+            signal = self.job.output.deformed_templates
+            self.assertTrue(signal._lazy)
+            self.assertEqual(signal.axes_manager.navigation_shape, (5,))
+            self.assertEqual(signal.axes_manager[0].name, 'frame')
+            self.assertTrue(np.allclose(signal.inav[2].data.compute(), signal.data.compute()[2]))
+        with self.subTest('reload'):
+            job = self.project.load('match')
+            self.assertTrue(np.array_equal(
+                job.output.deformations.data.compute(), self.job.output.deformations.data.compute()
+            ))
+        with self.subTest('cropped templates'):
+            job = self.project.create.job.MatchSeries('match_cropped')
+            job.input["cropInput"] = 1
+            job.input["cropStartX"] = 2
+            job.input["cropStartY"] = 0
+            job.input["precisionLevel"] = 5
+            job.settings.storage.deformed_templates = True
+            write_fake_results(job, n_frames=5, shape=(17, 17), n_stages=1, shift=0.0)
+            for frame in range(5):
+                ramp = np.tile(np.arange(40, dtype=np.float32), (40, 1))
+                hs.signals.Signal2D(ramp).save(
+                    os.path.join(job.working_directory, job.input["templateNamePattern"] % frame), overwrite=True
+                )
+            job.save()
+            job.collect_output()
+            # the 33 pixels from x = 2 are cropped and resized to the 17 pixels of the deformations
+            template = job.output.deformed_templates.data[0].compute()
+            self.assertTrue(np.allclose(template[:, 0], 2))
+            self.assertTrue(np.allclose(template[:, -1], 34))
+
+    def test_metrics(self):
+        write_fake_results(self.job, n_frames=5, n_stages=2)
+        self.job.settings.storage.deformed_templates = True
+        self.job.save()
+        self.job.collect_output()
+        metrics = self.job.output.metrics
+        self.assertEqual(
+            list(metrics.columns), ["frame", "ncc", "rms", "jacobian_min", "jacobian_max", "max_displacement"]
+        )
+        self.assertEqual(metrics.frame.tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(metrics.ncc.dtype, np.float32)
+        with self.subTest('constant shifts do not distort'):
+            self.assertTrue(np.allclose(metrics.jacobian_min, 1))
+            self.assertTrue(np.allclose(metrics.jacobian_max, 1))
+        with self.subTest('displacement in pixels'):
+            expected = 15 * np.hypot(0.01 * np.arange(5), 0.01 * np.arange(1, 6))
+            self.assertTrue(np.allclose(metrics.max_displacement, expected))
+        with self.subTest('against the reference'):
+            templates = self.job.output.deformed_templates.data.compute()
+            reference = np.median(templates, axis=0)
+            self.assertTrue(np.allclose(metrics.rms, np.sqrt(np.mean((templates - reference) ** 2, axis=(1, 2)))))
+            self.assertTrue(np.all(metrics.ncc <= 1 + 1e-6))
+        with self.subTest('distortion'):
+            deformations = np.zeros((1, 2, 16, 16))
+            deformations[0, 0] = np.linspace(0, -2, 16)[None, :] / 15
+            self.assertTrue(np.allclose(
+                registration_metrics(templates[:1], deformations, reference)["jacobian_min"], 1 - 2 / 15
+            ))
+        with self.subTest('deformed templates not stored'):
+            job = self.project.create.job.MatchSeries('match_without_templates')
+            for key in ["templateNamePattern", "numTemplates", "numExtraStages"]:
+                job.input[key] = self.job.input[key]
+            write_fake_results(job, n_frames=5, n_stages=2)
+            job.save()
+            job.collect_output()
+            with h5py.File(job.project_hdf5.file_name, "r") as f:
+                self.assertNotIn("deformed_templates", f[job.output._stage_path()])
+            with self.assertRaises(ValueError):
+                job.output.deformed_templates
+            self.assertFalse(os.path.exists(os.path.join(job.working_directory, "deformed_templates.h5")))
+            self.assertTrue(np.allclose(job.output.metrics.rms, metrics.rms))
+        with self.subTest('project table'):
+            # only finished jobs are listed
+            self.assertEqual(len(metrics_table(self.project)), 0)
+            self.job.status.finished = True
+            table = metrics_table(self.project)
+            self.assertEqual(table.job.unique().tolist(), ['match'])
+            self.assertEqual(len(table), 5)
+
+    def test_chunk_ranges(self):
+        self.assertEqual(_chunk_ranges(10, 1, 2), [(0, 10)])
+        self.assertEqual(_chunk_ranges(10, 3, 2), [(0, 5), (3, 8), (6, 10)])
+        with self.assertRaises(ValueError):
+            _chunk_ranges(10, 3, 0)
+        with self.assertRaises(ValueError):
+            _chunk_ranges(2, 2, 2)
+        self.job.settings.parallel.chunks = 2
+        self.assertEqual(self.job.chunk_ranges, [(0, 4), (2, 5)])
+
+    def test_compose_deformations(self):
+        first = np.full((2, 8, 8), 0.1)
+        second = np.full((2, 8, 8), 0.2)
+        self.assertTrue(np.allclose(compose_deformations(first, second), 0.3))
+
+    def test_parallel_input(self):
+        self.job.settings.parallel.chunks = 2
+        self.job.server.cores = 2
+        self.job.save()
+        # the cores are not reset to 1 for the missing MPI executable, they run the chunks in parallel
+        self.assertEqual(self.job.server.cores, 2)
+        for k, (offset, n) in enumerate([(0, 4), (2, 3)]):
+            with open(os.path.join(self.job.working_directory, f"chunk_{k}", "matchSeries.par")) as f:
+                lines = f.read()
+            self.assertIn(f"templateNumOffset {offset}", lines)
+            self.assertIn(f"numTemplates {n}", lines)
+            self.assertIn("templateNamePattern ../frame_%03d.tif", lines)
+        job = self.project.load('match')
+        self.assertEqual(job.settings.parallel.chunks, 2)
+
+    def test_collect_parallel_output(self):
+        self.job.settings.parallel.chunks = 2
+        self.job.input["numTemplates"] = 8
+        # chunk 1 covers the frames 3 to 7 with frame 3 as its reference
+        write_fake_results(self.job, n_frames=5, n_stages=2, directory="chunk_0")
+        write_fake_results(self.job, n_frames=5, n_stages=2, directory="chunk_1")
+        write_fake_frames(self.job, n_frames=8)
+        self.job.save()
+        self.job.collect_output()
+        self.assertEqual(self.job.output.stages, ['stage2'])
+        deformations = self.job.output.deformations.data.compute()
+        self.assertEqual(deformations.shape, (8, 2, 16, 16))
+        for i in range(8):
+            self.assertTrue(np.allclose(deformations[i, 0], 0.01 * i), msg=f"frame {i}")
+            self.assertTrue(np.allclose(deformations[i, 1], 0.01 * (i + 1)), msg=f"frame {i}")
+
+    def test_run_parallel_chunks(self):
+        self.job.input_stack = np.random.default_rng(2).random((5, 16, 16))
+        self.job.settings.parallel.chunks = 2
+        self.job.settings.cache.enabled = False
+        self.job.server.cores = 2
+        use_fake_executable(self.job)
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        self.assertEqual(self.job.server.cores, 2)
+        self.assertEqual(sorted(self.job.output.execution.slot.tolist()), [0, 1])
+        deformations = self.job.output.deformations.data.compute()
+        self.assertEqual(deformations.shape, (5, 2, 16, 16))
+        for i in range(5):
+            self.assertTrue(np.allclose(deformations[i, 0], 0.001 * i), msg=f"frame {i}")
+
+    def test_core_slots(self):
+        self.job.server.cores = 8
+        self.assertEqual(self.job._core_slots(1), [{"threads": 8, "cores": None}])
+        self.assertEqual(self.job._core_slots(3), [{"threads": 2, "cores": None}] * 3)
+        self.job.settings.parallel.threads = 4
+        self.assertEqual(len(self.job._core_slots(3)), 2)
+        self.assertIn("export OMP_NUM_THREADS=4 ", _thread_prefix(threads=4))
+        self.assertIn("taskset -cp 4,5 $$", _thread_prefix(threads=2, cores=[4, 5]))
+        with self.subTest('run'):
+            self.job.input_stack = np.random.default_rng(3).random((6, 16, 16))
+            self.job.settings.parallel.chunks = 2
+            self.job.settings.parallel.threads = 0
+            self.job.settings.cache.enabled = False
+            self.job.server.cores = 4
+            use_fake_executable(self.job)
+            self.job.executable = "echo $OMP_NUM_THREADS > threads.txt; " + self.job.executable.executable_path
+            self.job.run()
+            self.assertTrue(self.job.status.finished)
+            for k in range(2):
+                with open(os.path.join(self.job.working_directory, f"chunk_{k}", "threads.txt")) as f:
+                    self.assertEqual(f.read().strip(), "2")
+            execution = self.job.output.execution
+            self.assertEqual(execution.directory.tolist(), ["chunk_0", "chunk_1"])
+            self.assertEqual(execution.threads.tolist(), [2, 2])
+            self.assertEqual(sorted(execution.slot.tolist()), [0, 1])
+            self.assertTrue((execution.seconds > 0).all())
+
+    def test_tiles(self):
+        self.assertEqual(_tile_starts(40, 17, 4), [0, 12, 23])
+        self.assertEqual(_tile_starts(17, 17, 4), [0])
+        with self.assertRaises(ValueError):
+            _tile_starts(16, 17, 4)
+        with self.subTest('stitching is seamless for consistent tiles'):
+            starts = [(y, x) for y in [0, 12, 23] for x in [0, 12, 23]]
+            deformations = [np.full((2, 9, 9), 0.25) for _ in starts]
+            stitched = _stitch_tiles(deformations, starts, size=17, overlap=4, shape=(40, 40))
+            self.assertTrue(np.allclose(stitched, 0.25 * 16 / 39))
+        self.job.input_stack = np.random.default_rng(4).random((3, 40, 40))
+        self.job.input["numExtraStages"] = 1
+        self.job.settings.tiles.level = 4
+        self.job.settings.tiles.overlap = 4
+        self.job.settings.cache.enabled = False
+        self.job.server.cores = 3
+        use_fake_executable(self.job)
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        self.assertEqual(len(self.job.output.execution), 9)
+        self.assertEqual(sorted(set(self.job.output.execution.slot.tolist())), [0, 1, 2])
+        with open(os.path.join(self.job.working_directory, "tile_0", "matchSeries.par")) as f:
+            self.assertIn("precisionLevel 4", f.read())
+        deformations = self.job.output.deformations.data.compute()
+        self.assertEqual(deformations.shape, (3, 2, 40, 40))
+        for i in range(3):
+            self.assertTrue(np.allclose(deformations[i, 0], 0.001 * i * 16 / 39), msg=f"frame {i}")
+            self.assertTrue(np.allclose(deformations[i, 1], (0.001 * i + 0.0005) * 16 / 39), msg=f"frame {i}")
+
+    def test_input_stack(self):
+        stack = np.random.default_rng(1).random((11, 8, 6))
+        with self.subTest('invalid input'):
+            with self.assertRaises(ValueError):
+                self.job.input_stack = stack[0]
+            with self.assertRaises(ValueError):
+                self.job.input_stack = stack.tolist()
+        self.job.input_stack = hs.signals.Signal2D(stack).as_lazy()
+        self.assertEqual(self.job.input["numTemplates"], 11)
+        self.assertEqual(self.job.input["templateNamePattern"], "frame_%02d.tif")
+        self.job.save()
+        for i in [0, 10]:
+            frame = hs.load(os.path.join(self.job.working_directory, "frame_%02d.tif" % i)).data
+            self.assertTrue(np.array_equal(frame, stack[i]))
+        with self.subTest('already running'):
+            with self.assertRaises(RuntimeError):
+                self.job.input_stack = stack
+
+    def test_input_file(self):
+        stack = np.random.default_rng(2).random((6, 16, 16)).astype(np.float32)
+        files = {
+            "contiguous.tif": lambda f: tifffile.imwrite(f, stack),
+            "compressed.tif": lambda f: tifffile.imwrite(f, stack, compression="zlib"),
+            "velox.emd": lambda f: h5py.File(f, "w").create_dataset(
+                "Data/Image/0/Data", data=np.moveaxis(stack, 0, -1), chunks=(16, 16, 1), compression="gzip"
+            ).file.close(),
+            "contiguous.h5": lambda f: h5py.File(f, "w").create_dataset("series", data=stack).file.close(),
+        }
+        for k, (name, write) in enumerate(files.items()):
+            with self.subTest(name):
+                file_name = os.path.join(self.project.path, name)
+                write(file_name)
+                job = self.project.create.job.MatchSeries('match_file_' + str(k))
+                job.input_stack = file_name
+                self.assertEqual(job.input["numTemplates"], 6)
+                self.assertEqual(job._first_frame_shape(), (16, 16))
+                job.input["numExtraStages"] = 0
+                use_fake_executable(job)
+                job.run()
+                self.assertTrue(job.status.finished)
+                self.assertEqual(job.output.frames.tolist(), [1, 2, 3, 4, 5])
+                self.assertEqual(job.output.deformations.data.shape, (5, 2, 16, 16))
+                self.assertFalse(os.path.exists(os.path.join(job.working_directory, "frame_0.tif")))
+        with self.subTest('ambiguous dataset'):
+            file_name = os.path.join(self.project.path, "two.h5")
+            with h5py.File(file_name, "w") as f:
+                f["a"], f["b"] = stack, stack
+            with self.assertRaises(ValueError):
+                self.job.set_input_file(file_name)
+            self.job.set_input_file(file_name, h5_path="b")
+            self.assertEqual(self.job.input["numTemplates"], 6)
+
+    def test_input_frame_discovery(self):
+        directory = os.path.join(self.project.path, "frames")
+        os.makedirs(directory, exist_ok=True)
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ["frame_%03d.tif" % i for i in range(10)] + ["frame_%03d.tif.bak" % 4, "other.txt"]:
+            open(os.path.join(directory, name), "w").close()
+        self.job.input["templateNumOffset"] = 2
+        self.job.input["templateNumStep"] = 2
+        self.job.input["numTemplates"] = 3
+        self.job._add_input_frames_to_restart_files(directory=directory)
+        self.assertEqual(
+            [os.path.basename(f) for f in self.job.restart_file_list],
+            ["frame_002.tif", "frame_004.tif", "frame_006.tif"]
+        )
+        with self.subTest('frames are only added once'):
+            self.job._add_input_frames_to_restart_files(directory=directory)
+            self.assertEqual(len(self.job.restart_file_list), 3)
+        with self.subTest('missing frames'):
+            self.job.input["numTemplates"] = 6
+            with self.assertRaises(ValueError) as context:
+                self.job._add_input_frames_to_restart_files(directory=directory)
+            self.assertIn("2 input frames are missing", str(context.exception))
+            self.assertIn("frame_010.tif, frame_012.tif", str(context.exception))
+        with self.subTest('frames are copied'):
+            self.job.input["numTemplates"] = 3
+            self.job.save()
+            self.assertTrue(os.path.isfile(os.path.join(self.job.working_directory, "frame_004.tif")))
+
+    def test_staging(self):
+        directory = os.path.join(self.project.path, "frames")
+        os.makedirs(directory, exist_ok=True)
+        self.addCleanup(shutil.rmtree, directory)
+        for i in range(5):
+            with open(os.path.join(directory, "frame_%03d.tif" % i), "w") as f:
+                f.write(str(i))
+        self.job.settings.staging = "link"
+        self.job._add_input_frames_to_restart_files(directory=directory)
+        with self.subTest('hardlink'):
+            self.job.save()
+            self.assertTrue(os.path.samefile(
+                os.path.join(directory, "frame_003.tif"), os.path.join(self.job.working_directory, "frame_003.tif")
+            ))
+            self.assertFalse(os.path.islink(os.path.join(self.job.working_directory, "frame_003.tif")))
+            self.assertEqual(self.job["input/staging_method"], "hardlink")
+        with self.subTest('symlink fallback'):
+            job = self.project.create.job.MatchSeries('match_symlink')
+            job.settings.staging = "link"
+            job.input["templateNamePattern"] = "frame_%03d.tif"
+            job.input["numTemplates"] = 5
+            job._add_input_frames_to_restart_files(directory=directory)
+            with mock.patch("os.link", side_effect=OSError("Invalid cross-device link")):
+                job.save()
+            self.assertTrue(os.path.islink(os.path.join(job.working_directory, "frame_003.tif")))
+            self.assertEqual(job["input/staging_method"], "symlink")
+
+    def test_append_frames(self):
+        stack = np.random.default_rng(2).random((6, 16, 16))
+        self.job.input_stack = stack[:4]
+        self.job.settings.storage.deformed_templates = True
+        use_fake_executable(self.job)
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        self.assertTrue(np.allclose(self.job.output.deformations.data[:, 0, 0, 0].compute(), [0, 0.001, 0.002, 0.003]))
+        with self.subTest('not finished'):
+            job = self.project.create.job.MatchSeries('unfinished')
+            with self.assertRaises(RuntimeError):
+                job.append_frames(stack=stack[4:])
+        self.job.append_frames(stack=stack[4:])
+        self.assertEqual(self.job.input["numTemplates"], 6)
+        self.assertEqual(self.job.output.frames.tolist(), [0, 1, 2, 3, 4, 5])
+        deformations = self.job.output.deformations.data.compute()
+        self.assertEqual(deformations.shape, (6, 2, 16, 16))
+        # the appended frames are registered as frames 1 and 2 of a series with the final reference as frame 0
+        self.assertTrue(np.allclose(deformations[4:, 0, 0, 0], [0.001, 0.002]))
+        self.assertTrue(np.allclose(deformations[:4, 0, 0, 0], [0, 0.001, 0.002, 0.003]))
+        self.assertEqual(tifffile.imread(os.path.join(self.job.working_directory, "append_0", "frame_0.tif"))[0, 0], 0.5)
+        with open(os.path.join(self.job.working_directory, "append_0", "matchSeries.par")) as f:
+            # lambda of the final extra stage, scaled by extraStagesLambdaFactor
+            self.assertIn("lambda 20.0\n", f.read())
+        job = self.project.load('match')
+        self.assertEqual(job.output.deformed_templates.data.shape, (6, 16, 16))
+
+    def test_cache(self):
+        stack = np.random.default_rng(3).random((4, 16, 16))
+        self.job.input_stack = stack
+        self.job.settings.cache.enabled = True
+        use_fake_executable(self.job)
+        self.job.cache.clear()
+        self.addCleanup(shutil.rmtree, self.job.cache.directory, ignore_errors=True)
+        self.job.run()
+        self.assertTrue(os.path.isfile(os.path.join(self.job.working_directory, "output.log")))
+        self.assertEqual(len(os.listdir(self.job.cache.directory)), 1)
+        with self.subTest('hit'):
+            job = self.project.create.job.MatchSeries('match_cached')
+            job.input_stack = stack
+            job.input["numExtraStages"] = "1"
+            job.input["stopEpsilon"] = "0.000001"
+            job.settings.cache.enabled = True
+            use_fake_executable(job)
+            job.run()
+            self.assertTrue(job.status.finished)
+            self.assertFalse(os.path.isfile(os.path.join(job.working_directory, "output.log")))
+            self.assertEqual(job.output.stages, self.job.output.stages)
+            self.assertIsNotNone(self.job.output.execution)
+            self.assertIsNone(job.output.execution)
+            self.assertIsNone(job.output.timings)
+            self.assertTrue(np.array_equal(
+                job.output.deformations.data.compute(), self.job.output.deformations.data.compute()
+            ))
+        with self.subTest('append to a cached result'):
+            job.append_frames(stack=stack[:1])
+            # the median of the final stage is restored from the cache, not replaced by the first frame
+            self.assertEqual(tifffile.imread(os.path.join(job.working_directory, "append_0", "frame_0.tif"))[0, 0], 0.5)
+        with self.subTest('disabled by default'):
+            job = self.project.create.job.MatchSeries('match_bypass')
+            job.input_stack = stack
+            job.input["numExtraStages"] = 1
+            use_fake_executable(job)
+            job.run()
+            self.assertTrue(os.path.isfile(os.path.join(job.working_directory, "output.log")))
+        with self.subTest('different frames and eviction'):
+            job = self.project.create.job.MatchSeries('match_other')
+            job.input_stack = stack[::-1]
+            job.input["numExtraStages"] = 1
+            job.settings.cache.enabled = True
+            job.settings.cache.max_size = 1
+            use_fake_executable(job)
+            job.run()
+            self.assertTrue(os.path.isfile(os.path.join(job.working_directory, "output.log")))
+            self.assertEqual(os.listdir(job.cache.directory), [job._cache_key + ".h5"])
+
+    def test_log_parser(self):
+        parser = MatchSeriesLogParser(n_frames=3, n_stages=2)
+        self.assertEqual(parser.total, 5)
+        parser.start(0)
+        log = [
+            (1, "Created directory results/stage1/"),
+            (2, "Created directory results/stage1/0/"),
+            (2, "Registration on level 6 started"),
+            (4, "Registration on level 7 started"),
+            (8, "Created directory results/stage1/0-r/"),
+            (9, "Created directory results/stage1/1/"),
+            (9, "Registration on level 6 started"),
+        ]
+        for t, line in log:
+            parser.feed(line + "\n", t)
+        progress = parser.progress(t=10)
+        self.assertEqual((progress["stage"], progress["frame"], progress["level"]), (1, 1, 6))
+        self.assertEqual(progress["completed"], 1)
+        self.assertAlmostEqual(progress["eta"], 40)
+        parser.finish(11)
+        self.assertEqual(parser.progress()["completed"], 5)
+        self.assertEqual(parser.timings, {
+            "stage": [0, 1, 1, 1], "level": [-1, -1, 6, 7], "seconds": [1, 2, 4, 4]
+        })
+
+    def test_progress_and_timings(self):
+        self.job.input_stack = np.random.default_rng(4).random((4, 16, 16))
+        self.job.settings.cache.enabled = False
+        use_fake_executable(self.job)
+        self.assertIsNone(self.job.progress)
+        self.job.run()
+        progress = self.job.progress
+        self.assertTrue(progress["finished"])
+        self.assertEqual(progress["completed"], progress["total"])
+        self.assertEqual(progress["total"], 7)
+        timings = self.job.output.timings
+        self.assertEqual(timings.columns.tolist(), ["stage", "level", "seconds"])
+        self.assertTrue((timings.seconds >= 0).all())
+        self.assertEqual(self.job.output.stages, ["stage1", "stage2"])
+
+    def test_numpy_backend(self):
+        image = ndimage.gaussian_filter(np.random.default_rng(5).random((33, 33)), 2)
+        shifts = [0, 1, 2]
+        self.job.input_stack = np.array([ndimage.shift(image, (0, s), mode="nearest") for s in shifts])
+        self.job.input["startLevel"] = 3
+        self.job.input["stopLevel"] = 5
+        self.job.settings.backend = "numpy"
+        self.job.settings.cache.enabled = False
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        self.assertEqual(self.job.output.stages, ["stage1", "stage2"])
+        deformations = self.job.output.deformations.data.compute()
+        self.assertEqual(deformations.shape, (3, 2, 33, 33))
+        # frames shifted by s pixels along x are mapped onto the first frame by a displacement of s pixels
+        shift = deformations[:, 0, 8:-8, 8:-8].mean(axis=(1, 2)) * 32
+        self.assertTrue(np.allclose(shift - shift[0], [0, 1, 2], atol=0.25), msg=str(shift))
+        self.assertIn(5, self.job.output.timings.level.tolist())
+        with self.subTest('frames larger than the grid'):
+            large = ndimage.gaussian_filter(np.random.default_rng(5).random((65, 65)), 4)
+            job = self.project.create.job.MatchSeries('numpy_large_frames')
+            job.input_stack = np.array([ndimage.shift(large, (0, 2 * s), mode="nearest") for s in shifts])
+            job.input["startLevel"] = 3
+            job.input["stopLevel"] = 5
+            job.input["numExtraStages"] = 1
+            job.settings.backend = "numpy"
+            job.settings.cache.enabled = False
+            job.run()
+            self.assertTrue(job.status.finished)
+            self.assertEqual(job.output.stages, ["stage1", "stage2"])
+            deformations = job.output.deformations.data.compute()
+            self.assertEqual(deformations.shape, (3, 2, 33, 33))
+            shift = deformations[:, 0, 8:-8, 8:-8].mean(axis=(1, 2)) * 64
+            self.assertTrue(np.allclose(shift - shift[0], [0, 2, 4], atol=0.5), msg=str(shift))
+        with self.subTest('register'):
+            deformation = register(ndimage.shift(image, (1, 0), mode="nearest"), image, start_level=3, stop_level=5)
+            self.assertAlmostEqual(deformation[1, 8:-8, 8:-8].mean() * 32, 1, delta=0.25)
+        with self.subTest('unknown backend'):
+            job = self.project.create.job.MatchSeries('unknown_backend')
+            job.input_stack = self.job.input_stack
+            job.settings.backend = "fortran"
+            with self.assertRaises(ValueError):
+                job.run()
+
+    def test_prealign(self):
+        image = ndimage.gaussian_filter(np.random.default_rng(6).random((32, 32)), 2)
+        shifts = np.array([[0, 0], [1, 2], [-2, 1]])
+        self.job.input_stack = np.array([ndimage.shift(image, s, mode="nearest") for s in shifts])
+        self.job.settings.prealign = True
+        self.job.settings.cache.enabled = False
+        use_fake_executable(self.job)
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        self.assertTrue(os.path.isfile(os.path.join(self.job.working_directory, "prealigned_2.tif")))
+        self.assertTrue(np.allclose(self.job.output.prealign_shifts, shifts, atol=0.3))
+        deformations = self.job.output.deformations.data.compute()
+        # the fake executable returns 0.001 * frame for the prealigned frames, the shifts are added in units of the width
+        self.assertTrue(np.allclose(deformations[:, 0, 0, 0], [0, 0.001 + 2 / 31, 0.002 + 1 / 31], atol=0.01))
+        self.assertTrue(np.allclose(deformations[:, 1, 0, 0], [0.0005, 0.0015 + 1 / 31, 0.0025 - 2 / 31], atol=0.01))
+        with self.subTest('numpy backend'):
+            job = self.project.create.job.MatchSeries('prealign_numpy')
+            job.input_stack = self.job.input_stack
+            job.input["numExtraStages"] = 0
+            job.input["startLevel"] = 4
+            job.input["stopLevel"] = 5
+            job.settings.prealign = True
+            job.settings.backend = "numpy"
+            job.settings.cache.enabled = False
+            job.run()
+            deformations = job.output.deformations.data.compute()
+            self.assertTrue(np.allclose(deformations[:, :, 8:-8, 8:-8].mean(axis=(2, 3)) * 31, shifts[1:, ::-1], atol=0.3))
+
+    def test_apply_deformations(self):
+        write_fake_results(self.job, n_frames=5, n_stages=2)
+        self.job.save()
+        self.job.collect_output()
+        deformations = self.job.output.deformations.data.compute()
+        spectra = np.random.default_rng(7).random((5, 16, 16, 3))
+        deformed = self.job.apply_deformations(spectra).compute()
+        self.assertEqual(deformed.shape, spectra.shape)
+        for i in [0, 3]:
+            for channel in range(3):
+                self.assertTrue(np.allclose(
+                    deformed[i, ..., channel], deform_image(spectra[i, ..., channel], deformations[i])
+                ))
+        with self.subTest('spectrum image signal'):
+            signal = hs.signals.Signal1D(spectra)
+            result = self.job.apply_deformations(signal)
+            self.assertTrue(result._lazy)
+            self.assertEqual(result.axes_manager.navigation_shape, (16, 16, 5))
+            self.assertTrue(np.allclose(result.data.compute(), deformed))
+        with self.subTest('image stack of a different size and stage 1'):
+            images = np.random.default_rng(8).random((5, 8, 8))
+            result = self.job.apply_deformations(hs.signals.Signal2D(images), stage=1)
+            self.assertEqual(result.axes_manager.navigation_shape, (4,))
+            # frame 1 is the first frame registered in stage 1, displaced by 0 along x and 0.01 along y
+            expected = deform_image(images[1], np.stack([np.zeros((8, 8)), np.full((8, 8), 0.01)]))
+            self.assertTrue(np.allclose(result.data[0].compute(), expected))
+        with self.subTest('wrong number of frames'):
+            with self.assertRaises(ValueError):
+                self.job.apply_deformations(spectra[:4])
+
+    def test_sweep(self):
+        sweep = self.project.create.job.MatchSeriesSweep('sweep')
+        sweep.input_stack = np.random.default_rng(9).random((4, 16, 16))
+        sweep.input["numExtraStages"] = 1
+        sweep.grid["lambda"] = [100, 200]
+        sweep.grid["startLevel"] = [5, 6, 7]
+        sweep.settings.cache.enabled = False
+        sweep.server.cores = 2
+        use_fake_executable(sweep)
+        self.assertEqual(len(sweep.variants), 6)
+        self.assertEqual(sweep.variants[1], {"lambda": 100, "startLevel": 6})
+        sweep.run()
+        self.assertTrue(sweep.status.finished)
+        table = sweep.output.table
+        self.assertEqual(
+            table.columns.tolist(),
+            ["lambda", "startLevel", "job", "status", "seconds", "residual", "ncc", "jacobian_min"]
+        )
+        self.assertEqual(table["lambda"].tolist(), [100] * 3 + [200] * 3)
+        self.assertTrue((table.status == "finished").all())
+        self.assertTrue((table.seconds > 0).all())
+        self.assertTrue(np.isfinite(table.residual).all())
+        self.assertTrue(np.allclose(table.jacobian_min, 1))
+        job = sweep.child_project.load(table.job[4])
+        with open(os.path.join(job.working_directory, "matchSeries.par")) as f:
+            lines = f.read()
+        self.assertIn("lambda 200", lines)
+        self.assertIn("startLevel 6", lines)
+        # the frames are written once and hardlinked by every variant
+        self.assertTrue(os.path.samefile(
+            os.path.join(sweep.working_directory, "frame_2.tif"), os.path.join(job.working_directory, "frame_2.tif")
+        ))
+        self.assertEqual(job.output.deformations.data.shape, (4, 2, 16, 16))
+        slots = set()
+        for name in table.job:
+            slots.update(sweep.child_project.load(name).output.execution.slot.tolist())
+        self.assertEqual(sorted(slots), [0, 1])
+        sweep = self.project.load('sweep')
+        self.assertEqual(list(sweep.grid["startLevel"]), [5, 6, 7])
+
+    def test_preprocess(self):
+        stack = np.random.default_rng(10).random((3, 20, 24)) * 100
+        with self.subTest('preprocess_images'):
+            frames = preprocess_images(stack, crop=(2, 3, 9, 9), saturation=10)
+            self.assertEqual(frames.shape, (3, 9, 9))
+            self.assertTrue(np.allclose(frames.min(axis=(1, 2)), 0))
+            self.assertTrue(np.allclose(frames.max(axis=(1, 2)), 1))
+            self.assertGreater(np.sum(frames == 1), 3)
+            self.assertEqual(preprocess_images(stack, shape=(5, 5), normalize=False).shape, (3, 5, 5))
+            smooth = preprocess_images(stack, sigma=0.1, normalize=False)
+            self.assertLess(smooth.std(), stack.std())
+        self.job.input_stack = stack
+        self.job.input["cropInput"] = 1
+        self.job.input["cropStartX"] = 3
+        self.job.input["cropStartY"] = 2
+        self.job.input["precisionLevel"] = 3
+        self.job.settings.preprocess = True
+        self.job.settings.cache.enabled = False
+        self.job.settings.storage.deformed_templates = True
+        use_fake_executable(self.job)
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        preprocessed = tifffile.imread(os.path.join(self.job.working_directory, "preprocessed_1.tif"))
+        self.assertTrue(np.allclose(preprocessed, preprocess_images(stack[1:2], crop=(2, 3, 9, 9), saturation=0.15)[0]))
+        with open(os.path.join(self.job.working_directory, "matchSeries.par")) as f:
+            lines = f.read()
+        self.assertIn("templateNamePattern preprocessed_%01d.tif", lines)
+        self.assertIn("cropInput 0", lines)
+        self.assertIn("dontNormalizeInputImages 1", lines)
+        self.assertEqual(self.job.output.deformed_templates.data.shape, (3, 9, 9))
+        self.assertTrue(self.job._is_preprocessed())
+        self.job.input["preSmoothSigma"] = 0.1
+        self.assertFalse(self.job._is_preprocessed())
+
+    def test_synthetic_series(self):
+        frames, deformations = synthetic_series(3, shape=(48, 64), drift=(1.0, 0.5), noise=0)
+        self.assertEqual(frames.shape, (3, 48, 64))
+        self.assertEqual(deformations.shape, (3, 2, 48, 64))
+        self.assertTrue(np.allclose(deformations[0], 0))
+        self.assertTrue(np.allclose(deformations[2, 1] * 63, -1.0))
+        # the known deformations register every frame to the first one
+        registered = deform_image(frames[2], deformations[2], order=3)
+        interior = (slice(8, -8), slice(8, -8))
+        self.assertLess(
+            np.sqrt(np.mean((registered[interior] - frames[0][interior]) ** 2)),
+            0.2 * np.sqrt(np.mean((frames[2][interior] - frames[0][interior]) ** 2)),
+        )
+
+    def test_preview(self):
+        frames, _ = synthetic_series(6, shape=(33, 33), spacing=6.0, drift=(0.5, 0.3), noise=0)
+        self.job.input_stack = frames
+        self.job.settings.backend = "numpy"
+        self.job.settings.cache.enabled = False
+        self.job.input["startLevel"] = 3
+        self.job.input["stopLevel"] = 5
+        self.job.input["maxGDIterations"] = 20
+        preview = self.job.preview(n_frames=3, level=4)
+        self.assertEqual(preview["frames"], [0, 2, 5])
+        self.assertEqual(preview["template"].shape, (17, 17))
+        self.assertEqual(preview["metrics"].frame.tolist(), [0, 2, 5])
+        self.assertGreater(preview["seconds"], 0)
+        child = self.project.open("match_hdf5").load("match_preview")
+        self.assertEqual(int(child.input["stopLevel"]), 4)
+        stages, level = self.job._warm_start()
+        self.assertEqual(level, 4)
+        self.assertEqual(sorted(stages), [1, 2])
+        # stage 1 is registered onto the first frame, which is added with a zero deformation
+        self.assertEqual(stages[1][0], [0, 2, 5])
+        self.assertTrue(np.allclose(stages[1][1][0], 0))
+        self.assertEqual(stages[2][0], [0, 2, 5])
+        self.assertTrue(np.allclose(
+            stages[2][1], self.project.open("match_hdf5").load("match_preview").output.deformations.data.compute()
+        ))
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        self.assertEqual(self.job.output.deformations.data.shape, (6, 2, 33, 33))
+        with self.subTest('cache key'):
+            key = self.job._get_cache_key()
+            self.job._preview = None
+            self.assertNotEqual(self.job._get_cache_key(), key)
+        with self.subTest('reload'):
+            self.assertEqual(self.project.load('match')._preview["frames"], [0, 2, 5])
+
+    def test_keyframes(self):
+        self.assertEqual(select_keyframes(6, 2), [0, 2, 4, 5])
+        images = [np.zeros((8, 8))] * 3 + [np.eye(8)] * 3
+        self.assertEqual(select_keyframes(6, 4, images=images, threshold=0.1), [0, 3, 5])
+        self.job.input_stack = np.random.default_rng(7).random((5, 16, 16))
+        self.job.settings.keyframes.step = 2
+        self.job.settings.keyframes.refine_iterations = 0
+        self.job.settings.cache.enabled = False
+        use_fake_executable(self.job)
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        with open(os.path.join(self.job.working_directory, "matchSeries.par")) as f:
+            par = f.read()
+        self.assertIn("numTemplates 3", par)
+        self.assertIn("keyframe_%01d.tif", par)
+        self.assertEqual(self.job.output.keyframes.tolist(), [0, 2, 4])
+        deformations = self.job.output.deformations.data.compute()
+        self.assertEqual(deformations.shape, (5, 2, 16, 16))
+        # keyframe k is registered as 0.001 * k, the frames in between are interpolated in stage 1
+        for i, expected in enumerate([0, 0.0005, 0.001, 0.0015, 0.002]):
+            self.assertTrue(np.allclose(deformations[i, 0], expected), msg=f"frame {i}")
+        with self.subTest('numpy backend'):
+            frames, _ = synthetic_series(5, shape=(33, 33), spacing=6.0, drift=(0.5, 0.3), noise=0)
+            job = self.project.create.job.MatchSeries('keyframes_numpy')
+            job.input_stack = frames
+            job.input["startLevel"] = 3
+            job.input["stopLevel"] = 5
+            job.settings.backend = "numpy"
+            job.settings.keyframes.step = 3
+            job.settings.cache.enabled = False
+            job.run()
+            self.assertTrue(job.status.finished)
+            self.assertEqual(job.output.keyframes.tolist(), [0, 3, 4])
+            self.assertEqual(job.output.deformations.data.shape, (5, 2, 33, 33))
+        with self.subTest('chunks'):
+            job = self.project.create.job.MatchSeries('keyframes_chunks')
+            job.input_stack = self.job.input_stack
+            job.settings.keyframes.step = 2
+            job.settings.parallel.chunks = 2
+            with self.assertRaises(ValueError):
+                job.run()
+
+    def test_reject_frames(self):
+        rng = np.random.default_rng(8)
+        image = ndimage.gaussian_filter(rng.random((32, 32)), 2)
+        stack = np.array([image + rng.normal(0, 0.01, image.shape) for _ in range(8)])
+        stack[2] = 0
+        stack[4] *= 3
+        stack[5] = stack[5][rng.permutation(32)]
+        scan = frame_outliers(stack)
+        self.assertEqual([i for i, reason in enumerate(scan["reason"]) if reason != ""], [2, 4, 5])
+        self.assertIn("blank", scan["reason"][2])
+        self.assertIn("intensity", scan["reason"][4])
+        self.assertEqual(scan["reason"][5], "correlation")
+        self.job.input_stack = stack
+        self.job.settings.reject.enabled = True
+        self.job.settings.cache.enabled = False
+        use_fake_executable(self.job)
+        self.job.run()
+        self.assertTrue(self.job.status.finished)
+        with open(os.path.join(self.job.working_directory, "matchSeries.par")) as f:
+            par = f.read()
+        self.assertIn("numTemplates 5", par)
+        self.assertIn("accepted_%01d.tif", par)
+        self.assertEqual(self.job.output.rejected_frames.frame.tolist(), [2, 4, 5])
+        self.assertEqual(self.job.output.frames.tolist(), [0, 1, 3, 6, 7])
+        deformations = self.job.output.deformations.data.compute()
+        self.assertEqual(deformations.shape, (5, 2, 32, 32))
+        self.assertTrue(np.allclose(deformations[:, 0, 0, 0], 0.001 * np.arange(5)))
+        with self.subTest('reload'):
+            self.assertEqual(self.project.load('match').frame_numbers, [0, 1, 3, 6, 7])
+        with self.subTest('too few frames left'):
+            job = self.project.create.job.MatchSeries('rejected')
+            job.input_stack = np.array([stack[0], stack[2], stack[2]])
+            job.settings.reject.enabled = True
+            with self.assertRaises(ValueError):
+                job.run()
+
+    def test_estimate_resources(self):
+        self.job.settings.backend = "numpy"
+        self.job.input["startLevel"] = 4
+        self.job.input["stopLevel"] = 6
+        estimate = self.job.estimate_resources(frame_shape=(65, 65), set_server=True)
+        self.assertEqual(estimate["registrations"], 4 + 5)
+        self.assertGreater(estimate["seconds"], 0)
+        self.assertGreater(estimate["memory"], 0)
+        self.assertEqual(self.job.server.run_time, int(np.ceil(estimate["seconds"] * 1.5)))
+        self.assertTrue(os.path.isfile(os.path.join(self.project.path, ".matchseries_calibration.json")))
+        with mock.patch.object(type(self.job), "_calibration_run") as calibration_run:
+            self.job.input["numTemplates"] = 50
+            longer = self.job.estimate_resources(frame_shape=(65, 65))
+            self.job.input["stopLevel"] = 8
+            finer = self.job.estimate_resources(frame_shape=(257, 257))
+            calibration_run.assert_not_called()
+        self.assertGreater(longer["seconds"], estimate["seconds"])
+        self.assertGreater(finer["seconds"], longer["seconds"])
+        self.assertGreater(finer["memory"], longer["memory"])
+        with self.subTest('memory of every subprocess on its own'):
+            _, large = measure_command([sys.executable, "-c", "b = b'x' * (200 * 2 ** 20)"], shell=False)
+            _, small = measure_command([sys.executable, "-c", "pass"], shell=False)
+            self.assertLess(small, large - 100 * 2 ** 20)
+        with self.subTest('frame shape from the input stack'):
+            self.job.input_stack = np.zeros((3, 20, 30))
+            self.assertEqual(self.job._first_frame_shape(), (20, 30))
+
+    def test_deformation_storage(self):
+        write_fake_results(self.job, n_frames=5, n_stages=2)
+        self.job.save()
+        self.job.collect_output()
+        expected = self.job.output.deformations.data.compute()
+        for encoding, dtype in [("int16", np.int16), ("float16", np.float16)]:
+            with self.subTest(encoding):
+                self.job.settings.storage.deformations = encoding
+                self.job.collect_output()
+                with h5py.File(self.job.project_hdf5.file_name, "r") as f:
+                    self.assertEqual(f[self.job.output.h5_path + "/stage2/deformations"].dtype, dtype)
+                deformations = self.job.output.deformations.data.compute()
+                self.assertEqual(deformations.dtype.kind, "f")
+                self.assertLessEqual(np.max(np.abs(deformations - expected)) * 15, 0.01)
+        with self.subTest('error bound cannot be met'):
+            self.job.settings.storage.deformations = "int16"
+            self.job.settings.storage.max_error = 1e-6
+            self.job.collect_output()
+            with h5py.File(self.job.project_hdf5.file_name, "r") as f:
+                self.assertEqual(f[self.job.output.h5_path + "/stage2/deformations"].dtype, np.float64)
+            self.assertTrue(np.array_equal(self.job.output.deformations.data.compute(), expected))
+
+    def test_template_statistics(self):
+        rng = np.random.default_rng(11)
+        frames = rng.normal(size=(201, 6, 5))
+        frames[7] = 100
+        statistics = frame_statistics(frames, sigma=3, iterations=2, max_workers=2)
+        self.assertTrue(np.allclose(statistics["mean"], frames.mean(axis=0)))
+        self.assertTrue(np.allclose(statistics["std"], frames.std(axis=0)))
+        self.assertTrue(np.allclose(statistics["clipped_mean"], np.delete(frames, 7, axis=0).mean(axis=0), atol=0.05))
+        self.assertLess(np.max(np.abs(statistics["median"] - np.median(frames, axis=0))), 0.4)
+        with self.subTest('few frames'):
+            self.assertTrue(np.allclose(frame_statistics(frames[:3])["median"], np.median(frames[:3], axis=0)))
+        write_fake_results(self.job, n_frames=5, n_stages=2)
+        self.job.settings.storage.deformed_templates = True
+        self.job.save()
+        self.job.collect_output()
+        templates = self.job.output.deformed_templates.data.compute()
+        self.assertTrue(np.allclose(self.job.output.get_template("mean"), templates.mean(axis=0)))
+        stage1 = self.job.output.get_deformed_templates(stage=1).data.compute()
+        self.assertTrue(np.allclose(self.job.output.get_template("median", stage=1), np.median(stage1, axis=0)))
+        with self.assertRaises(ValueError):
+            self.job.output.get_template("mode")